@@ -2,11 +2,12 @@
 
 import custom_term
 import rccar
+import range_filter
+import ranging_policy
 import gpiolib as gpio
 import time
 import threading as thread
 import logging as log
-from collections import deque
 
 # ---------------- Logging/Debug configurations ---------------
 
@@ -63,11 +64,11 @@ class CarController(object):
 
         self._distance_to_object = None
         self._linear_speed = None
-        self._rpm = 0  # TODO :: Add motor encoder
+        self._rpm = (None, None)
 
         self._ultrasonic_handler = None
         self._session = None
-        self._ultrasonic_filter_size = 20.0
+        self._ultrasonic_filter = None
 
     def connect_car(self, lm_pin_1, lm_pin_2, lm_pwm_pin, rm_pin_1, rm_pin_2, rm_pwm_pin, us_trig_pin, us_echo_pin,
                     **kwargs):
@@ -85,6 +86,26 @@ class CarController(object):
                 motor_min_speed : motor minimum required speed
                 us_min_distance : ultrasonic minimum distance
                 us_max_distance : ultrasonic maximum distance
+                us_ranging_rate : ultrasonic measurements per second (without a rate policy)
+                us_rate_policy : ranging rate policy (default: ranging_policy.AdaptiveRatePolicy,
+                        None ranges at us_ranging_rate)
+                us_filter : ultrasonic reading filter (range_filter.MEDIAN, EMA or KALMAN)
+                us_filter_params : filter parameters (see range_filter.create_filter)
+                us_sensors : more ultrasonic sensors {direction: (trig pin, echo pin)}
+                us_exclusion_groups : lists of sensor directions that must not fire together
+                lm_encoder_pin : left wheel encoder pin (None: no speed measurement)
+                rm_encoder_pin : right wheel encoder pin (None: no speed measurement)
+                encoder_slots : encoder pulses per wheel revolution
+                wheel_diameter : wheel diameter in cm
+                max_rpm : wheel RPM at 100% speed, enables closed loop speed control with both
+                        encoders (None: open loop duty cycle)
+                speed_loop_rate : speed control loop rate in Hz
+                speed_gains : speed control PID gains (kp, ki, kd)
+                motor_acceleration : motor duty cycle change limit in % per second (None: no ramping)
+                reversal_dead_time : motor coasting time between directions of a reversal in seconds
+                steering_expo : steering curve of continuous drive commands [0:1] (0: linear)
+                pin_journal : pin journal file (see gpiolib.set_pin_journal)
+                warm_start : re-adopt the pins listed in the pin journal (restart after a crash)
         :return:
         """
         err_code = SUCCESS
@@ -93,6 +114,13 @@ class CarController(object):
         us_min_distance = kwargs.get("us_min_distance", 5)
         us_max_distance = kwargs.get("us_max_distance", 400)
 
+        self._ultrasonic_filter = range_filter.create_filter(
+                kwargs.get("us_filter", range_filter.MEDIAN),
+                min_distance=us_min_distance,
+                max_distance=us_max_distance,
+                **kwargs.get("us_filter_params", {})
+        )
+
         assert all(
                 [
                         lm_pin_1, lm_pin_2, lm_pwm_pin,
@@ -113,7 +141,22 @@ class CarController(object):
                 us_echo_pin=us_echo_pin,
                 us_min_distance=us_min_distance,
                 us_max_distance=us_max_distance,
-
+                us_ranging_rate=kwargs.get("us_ranging_rate", 10),
+                us_sensors=kwargs.get("us_sensors", {}),
+                us_exclusion_groups=kwargs.get("us_exclusion_groups", None),
+                us_rate_policy=kwargs.get("us_rate_policy", ranging_policy.AdaptiveRatePolicy()),
+                lm_encoder_pin=kwargs.get("lm_encoder_pin", None),
+                rm_encoder_pin=kwargs.get("rm_encoder_pin", None),
+                encoder_slots=kwargs.get("encoder_slots", 20),
+                wheel_diameter=kwargs.get("wheel_diameter", 6.5),
+                max_rpm=kwargs.get("max_rpm", None),
+                speed_loop_rate=kwargs.get("speed_loop_rate", 50),
+                speed_gains=kwargs.get("speed_gains", None),
+                motor_acceleration=kwargs.get("motor_acceleration", None),
+                reversal_dead_time=kwargs.get("reversal_dead_time", 0.05),
+                steering_expo=kwargs.get("steering_expo", 0.0),
+                pin_journal=kwargs.get("pin_journal", None),
+                warm_start=kwargs.get("warm_start", False)
         )
 
         car_init = self._car.initialize()
@@ -327,23 +370,34 @@ class CarController(object):
         :return: error code that indicates if the reading operation was successful
         """
 
-        readings = deque(maxlen=self._ultrasonic_filter_size)
+        sequence = None
 
         while self._session:
 
             # check if car is connected
             if self._car:
 
-                readings.append(self._car.get_distance())
+                # sleep until the ranging service publishes a new reading
+                err_code, (distance, timestamp, sequence, _) = self._car.wait_for_distance(sequence, timeout=1.0)
+
+                if err_code == rccar.SUCCESS:
 
-                self._distance_to_object = sum(readings)/self._ultrasonic_filter_size
+                    # filter drops timeouts and echo spikes, keeps the last estimate
+                    estimate = self._ultrasonic_filter.update(distance, timestamp)
+
+                    if estimate is not None:
+                        self._distance_to_object = estimate
+
+                # measured wheel speeds
+                self._rpm = self._car.get_rpm()
+                self._linear_speed = self._car.get_linear_speed()
 
             else:
 
                 self._distance_to_object = 0
+                time.sleep(0.1)
 
             self.update_controller_data()
-            time.sleep(0.1)
 
         return 0
 
@@ -380,9 +434,7 @@ class CarController(object):
         else:
 
             err_code = ERR_INVALID_CONFIGURATION
-            log.error(
-
-            )
+            log.error("Can't update controller data, controller is not connected!")
 
         return err_code
 
@@ -0,0 +1,129 @@
+#!/usr/bin/env python2
+
+#
+# Differential drive mixing
+# Maps a continuous (throttle, steering) command to signed left / right wheel duty
+# cycles. The outer wheel runs at the throttle, the inner wheel at throttle * factor:
+# the factor goes from 1 (straight) through 0 (pivot on the inner wheel, steering 50)
+# to -1 (rotation in place, steering 100). The factors are precomputed in a lookup
+# table over the steering range, a command costs one table lookup and one linear
+# interpolation whatever the steering curve.
+# mix_batch mixes recorded or planned command sequences, vectorized with numpy when
+# it's installed.
+#
+
+from bisect import bisect_left
+
+# numpy is optional, only used by the batch mode
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# table points over the steering range [0:100]
+_TABLE_SIZE = 200
+
+
+class DriveMixer(object):
+
+    def __init__(self, steering_expo=0.0, table_size=_TABLE_SIZE):
+        """
+        :param steering_expo: steering curve [0:1], 0 linear, larger values soften the
+        steering around the center (joystick expo: (1 - expo) * x + expo * x^3)
+        :param table_size: lookup table points over the steering range
+        """
+        self._size = table_size
+        self._step = 100.0 / table_size
+
+        # inner wheel factor at every table point, decreasing from 1 to -1
+        self._factors = list()
+
+        for i in range(table_size + 1):
+
+            x = float(i) / table_size
+            self._factors.append(1 - 2 * ((1 - steering_expo) * x + steering_expo * x ** 3))
+
+        # increasing copy for the inverse lookup
+        self._negated = [-factor for factor in self._factors]
+
+    # inner wheel factor of a steering value
+    def factor(self, steering):
+        """
+        :param steering: steering % [-100:100]
+        :return: inner wheel speed relative to the outer wheel [-1:1]
+        """
+        position = min(abs(steering), 100.0) / self._step
+        index = min(int(position), self._size - 1)
+
+        low = self._factors[index]
+
+        return low + (self._factors[index + 1] - low) * (position - index)
+
+    # steering of an inner wheel factor
+    def steering(self, factor):
+        """
+        Inverse of factor, presets use it to turn with a given inner / outer wheel ratio
+        :param factor: inner wheel speed relative to the outer wheel [-1:1]
+        :return: steering % [0:100]
+        """
+        target = -min(max(factor, -1.0), 1.0)
+        index = max(1, min(bisect_left(self._negated, target), self._size))
+
+        low, high = self._negated[index - 1], self._negated[index]
+        fraction = (target - low) / (high - low) if high != low else 0.0
+
+        return (index - 1 + fraction) * self._step
+
+    # wheel duty cycles of a command
+    def mix(self, throttle, steering):
+        """
+        :param throttle: % [-100:100], negative backwards
+        :param steering: % [-100:100], positive to the right
+        :return: (left, right) signed duty cycles % [-100:100], positive forwards
+        """
+        throttle = min(max(throttle, -100.0), 100.0)
+
+        outer = throttle
+        inner = throttle * self.factor(steering)
+
+        return (outer, inner) if steering >= 0 else (inner, outer)
+
+    # wheel duty cycles of a command sequence
+    def mix_batch(self, throttles, steerings):
+        """
+        Mixes a sequence of commands, vectorized with numpy (table interpolation with
+        numpy.interp), command after command otherwise
+        :param throttles: throttle sequence
+        :param steerings: steering sequence
+        :return: (lefts, rights) lists of signed duty cycles
+        """
+        if np is None:
+
+            mixed = [self.mix(t, s) for t, s in zip(throttles, steerings)]
+
+            return [left for left, _ in mixed], [right for _, right in mixed]
+
+        throttles = np.clip(np.asarray(throttles, dtype=float), -100.0, 100.0)
+        steerings = np.asarray(steerings, dtype=float)
+
+        grid = np.arange(self._size + 1) * self._step
+        inner = throttles * np.interp(np.minimum(np.abs(steerings), 100.0), grid, self._factors)
+
+        right_turn = steerings >= 0
+
+        lefts = np.where(right_turn, throttles, inner)
+        rights = np.where(right_turn, inner, throttles)
+
+        return lefts.tolist(), rights.tolist()
+
+
+if __name__ == '__main__':
+
+    mixer = DriveMixer()
+
+    for throttle, steering in ((50, 0), (50, 25), (50, 50), (50, 100), (-50, 25), (80, -60)):
+
+        print("throttle {:4d} steering {:4d} : left {:7.2f} right {:7.2f}".format(throttle, steering,
+                                                                                  *mixer.mix(throttle, steering)))
+
+    print("turn rate 50% : steering {:.2f}".format(mixer.steering(0.5)))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python2
+
+#
+# Synchronous motor updates
+# A drive train commit prepares the direction pin levels and the duty cycles of all its
+# motors first, then writes the duty cycles back to back and every direction pin in one
+# gpiolib.PinGroup batch (one register store on memory mapped backends), so the wheels
+# change state together instead of one motor after the other.
+# The skew of every commit (time between the first and the last wheel taking its new
+# state) is measured.
+#
+
+import logging as log
+from collections import deque
+
+import gpiolib as gpio
+import motor_controller as motor
+from micro_sleep import monotonic
+
+# -------------------------------- Error codes ---------------------------------
+
+SUCCESS = 0
+_ERR_INVALID_PIN = 1
+_ERR_USED_PIN = 2
+_ERR_INVALID_CONFIG = 3
+_ERR_INVALID_ARGS = 4
+_ERR_ERROR = 5
+
+# commit skews kept for the statistics
+_SKEW_HISTORY = 256
+
+
+class DriveTrain(object):
+
+    def __init__(self, motors):
+        """
+        :param motors: {name: initialized motor_controller.MotorControl}
+        """
+        self._motors = dict(motors)
+        self._names = sorted(self._motors)
+
+        # direction pins of every motor, written as one batch
+        self._direction_pins = gpio.PinGroup.union([self._motors[name].direction_pins for name in self._names])
+
+        self._skews = deque(maxlen=_SKEW_HISTORY)
+        self._commits = 0
+        self._synchronized = 0
+        self._max_skew = 0.0
+
+    @property
+    def names(self):
+        """motor names"""
+        return list(self._names)
+
+    # apply commands to several motors at once
+    def commit(self, commands):
+        """
+        Applies a (direction, speed) command to each given motor together, nothing is
+        applied if any command is invalid
+        :param commands: {name: (direction, speed)}, directions are motor_controller.ROTATE_CW,
+        ROTATE_CCW, STOP or BRAKE, speeds % [0:100]
+        :return: error code, the first motor error (minimum speed) if any
+        """
+        err_code = SUCCESS
+        levels = dict()
+        turning = list()
+        changed = dict()
+
+        # check every command first
+        for name, (direction, speed) in commands.items():
+
+            car_motor = self._motors.get(name, None)
+
+            if car_motor is None:
+
+                log.error("No motor {} in the drive train!".format(name))
+                return _ERR_INVALID_ARGS
+
+            motor_err, motor_levels = car_motor.prepare_rotation(direction, speed)
+
+            if motor_levels is None:
+                return motor_err
+
+            if err_code == SUCCESS:
+                err_code = motor_err
+
+            levels.update(motor_levels)
+
+            if motor_levels:
+                turning.append(name)
+
+        # duty cycles back to back, then all the direction pins in one batch
+        for name, (direction, speed) in commands.items():
+
+            if self._motors[name].apply_speed(speed):
+                changed[name] = monotonic()
+
+        if levels:
+
+            if self._direction_pins.write(levels) != gpio.SUCCESS:
+
+                log.error("Drive train failed to write the direction pins!")
+                err_code = _ERR_ERROR
+
+            written = monotonic()
+
+            for name in turning:
+                changed[name] = written
+
+        for name, (direction, speed) in commands.items():
+            self._motors[name].direction_applied(direction)
+
+        self._commits += 1
+        self._record_skew(changed, levels)
+
+        return err_code
+
+    # skew of a commit
+    def _record_skew(self, changed, levels):
+        """
+        :param changed: {name: time the motor took its new state}
+        :param levels: direction pins written in the batch
+        :return: None
+        """
+        if len(changed) < 2:
+            return
+
+        times = list(changed.values())
+
+        # every wheel changed in the pin batch, the batch skew is the wheel skew
+        if len(set(times)) == 1 and levels:
+            skew = self._direction_pins.last_skew
+        else:
+            skew = max(times) - min(times)
+
+        self._skews.append(skew)
+        self._synchronized += 1
+        self._max_skew = max(self._max_skew, skew)
+
+    # skew statistics
+    def stats(self):
+        """
+        :return: dict(commits, synchronized, last_skew, mean_skew, p99_skew, max_skew),
+        synchronized counts the commits that changed more than one wheel, skews in seconds
+        (mean and p99 over the latest commits)
+        """
+        skews = sorted(self._skews)
+
+        return dict(commits=self._commits,
+                    synchronized=self._synchronized,
+                    last_skew=self._skews[-1] if self._skews else 0.0,
+                    mean_skew=sum(skews) / len(skews) if skews else 0.0,
+                    p99_skew=skews[int(len(skews) * 0.99)] if skews else 0.0,
+                    max_skew=self._max_skew)
+
+
+if __name__ == '__main__':
+
+    import time
+
+    m0 = motor.MotorControl()
+    m1 = motor.MotorControl()
+
+    m0.init_motor(pin_1=16, pin_2=20, pwm_pin=21)
+    m1.init_motor(pin_1=13, pin_2=19, pwm_pin=26)
+
+    drive = DriveTrain({"left": m0, "right": m1})
+
+    for direction in (motor.ROTATE_CW, motor.ROTATE_CCW, motor.STOP, motor.BRAKE):
+
+        drive.commit({"left": (direction, 50), "right": (direction, 50)})
+        time.sleep(1)
+
+    print(drive.stats())
+
+    m0.deinit_motor()
+    m1.deinit_motor()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python2
+
+#
+# Simulated HC-SR04 ultrasonic sensor for the in-process GPIO backends (memory,
+# emulated sysfs). A thread watches the trigger pin and answers every trigger pulse
+# on the echo pin: after the burst time the echo rises and stays high for the round
+# trip time to the simulated obstacle, with optional jitter, dropouts (no echo at all)
+# and multipath echoes (a longer path than the direct one). Nothing in range gives
+# the sensor's long no-echo pulse.
+# The edges are stamped with their planned times, like the kernel stamps interrupts,
+# so edge timing doesn't depend on how late the simulator thread wakes up.
+#
+
+import random
+import threading as thread
+import logging as log
+from collections import deque
+
+import micro_sleep
+from micro_sleep import monotonic
+
+# -------------------------------- Error codes ---------------------------------
+
+SUCCESS = 0
+_ERR_INVALID_CONFIG = 3
+_ERR_INVALID_ARGS = 4
+
+# ------------------------------ Sensor timings (s) ----------------------------
+
+# trigger falling edge to echo rising edge (8 cycles 40kHz burst and processing)
+BURST_TIME = 0.00045
+
+# echo pulse when no echo comes back
+NO_ECHO_PULSE = 0.038
+
+# shortest trigger pulse the sensor reacts to
+MIN_TRIGGER_PULSE = 0.00001
+
+# simulated measurements kept in the history
+_HISTORY_SIZE = 1024
+
+
+class EchoSimulator(object):
+
+    def __init__(self, backend, trig_pin, echo_pin, distance=100.0, sound_speed=34000, max_distance=400,
+                 jitter=0.0, dropout=0.0, multipath=0.0, multipath_factor=2.0, seed=None):
+        """
+        :param backend: in-process GPIO backend (gpio_backend.MemoryBackend, EmulatedSysfsBackend)
+        :param trig_pin: trigger pin the simulated sensor listens to
+        :param echo_pin: echo pin the simulated sensor drives
+        :param distance: obstacle distance in cm, or a callable(monotonic time) returning
+        it, None when nothing is in range
+        :param sound_speed: speed of sound in cm/s
+        :param max_distance: sensor range in cm, farther obstacles give no echo
+        :param jitter: standard deviation of the echo pulse width in seconds
+        :param dropout: probability of no echo at all
+        :param multipath: probability of an echo from a longer path
+        :param multipath_factor: multipath echo distance relative to the direct one
+        :param seed: random generator seed (repeatable runs)
+        """
+        self._backend = backend
+        self._trig_pin = trig_pin
+        self._echo_pin = echo_pin
+        self._distance = distance
+        self._sound_speed = float(sound_speed)
+        self._max_distance = max_distance
+        self._jitter = jitter
+        self._dropout = dropout
+        self._multipath = multipath
+        self._multipath_factor = multipath_factor
+        self._random = random.Random(seed)
+
+        self._waiter = None
+        self._thread = None
+        self._running = False
+
+        # (trigger time, simulated distance, echo pulse width or None) of the latest triggers
+        self._history = deque(maxlen=_HISTORY_SIZE)
+
+        self.triggers = 0
+        self.ignored = 0
+        self.dropouts = 0
+        self.multipath_echoes = 0
+        self.no_echoes = 0
+
+    # start answering triggers
+    def start(self):
+        """
+        Starts the simulator thread
+        :return: error code that indicates if the simulator started
+        """
+        if self._running:
+            return SUCCESS
+
+        if not hasattr(self._backend, "level_waiter"):
+
+            log.error("Echo simulator needs an in-process GPIO backend!")
+            log.debug("Backend {} can't watch the trigger pin".format(self._backend.name))
+            return _ERR_INVALID_CONFIG
+
+        self._waiter = self._backend.level_waiter([self._trig_pin])
+        self._running = True
+
+        self._thread = thread.Thread(target=self._simulate)
+        self._thread.setDaemon(True)
+        self._thread.setName("Echo_Simulator")
+        self._thread.start()
+
+        return SUCCESS
+
+    # stop answering triggers
+    def stop(self):
+        """
+        Stops the simulator thread
+        :return: 0
+        """
+        if self._running:
+
+            self._running = False
+            self._waiter.interrupt()
+            self._thread.join()
+            self._waiter.close()
+
+            self._thread = None
+            self._waiter = None
+
+        return 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    # move the obstacle
+    def set_distance(self, distance):
+        """
+        :param distance: obstacle distance in cm, callable(monotonic time) or None
+        :return: None
+        """
+        self._distance = distance
+
+    # distance of the obstacle at a given time
+    def distance_at(self, timestamp):
+        """
+        :param timestamp: monotonic time
+        :return: simulated distance in cm, None if nothing is in range
+        """
+        distance = self._distance(timestamp) if callable(self._distance) else self._distance
+
+        if distance is None or distance > self._max_distance:
+            return None
+
+        return distance
+
+    # simulated measurements
+    def history(self):
+        """
+        :return: list of (trigger time, simulated distance, echo pulse width), pulse width
+        is None for dropouts, oldest first
+        """
+        return list(self._history)
+
+    # simulator counters
+    def stats(self):
+        """
+        :return: dict(triggers, ignored, dropouts, multipath, no_echoes), ignored counts
+        triggers that came while the sensor was busy or were too short
+        """
+        return dict(triggers=self.triggers, ignored=self.ignored, dropouts=self.dropouts,
+                    multipath=self.multipath_echoes, no_echoes=self.no_echoes)
+
+    # simulator thread
+    def _simulate(self):
+
+        rise = None
+        busy_until = 0.0
+
+        while self._running:
+
+            for pin, value, timestamp in self._waiter.wait():
+
+                if value:
+                    rise = timestamp
+                    continue
+
+                # the sensor starts its burst on the trigger falling edge
+                if rise is None or timestamp - rise < MIN_TRIGGER_PULSE or timestamp < busy_until:
+
+                    self.ignored += 1
+                    rise = None
+                    continue
+
+                rise = None
+                self.triggers += 1
+
+                busy_until = self._answer(timestamp)
+
+        return 0
+
+    # echo pulse for one trigger
+    def _answer(self, trigger):
+        """
+        Drives the echo pin for a trigger falling edge at the given time
+        :param trigger: trigger falling edge monotonic time
+        :return: time the sensor is ready for the next trigger
+        """
+        distance = self.distance_at(trigger)
+
+        # no echo at all
+        if self._random.random() < self._dropout:
+
+            self.dropouts += 1
+            self._history.append((trigger, distance, None))
+            return trigger + BURST_TIME
+
+        if distance is None:
+
+            self.no_echoes += 1
+            width = NO_ECHO_PULSE
+
+        else:
+
+            path = distance
+
+            if self._random.random() < self._multipath:
+
+                self.multipath_echoes += 1
+                path *= self._multipath_factor
+
+            width = max(0.0, 2 * path / self._sound_speed + self._random.gauss(0, self._jitter))
+
+        self._history.append((trigger, distance, width))
+
+        start = trigger + BURST_TIME
+        end = start + width
+
+        for timestamp, value in ((start, 1), (end, 0)):
+
+            micro_sleep.sleep_until(timestamp)
+
+            try:
+                self._backend.drive_input(self._echo_pin, value, timestamp)
+            except (OSError, IOError) as e:
+                log.debug("Echo simulator failed to drive pin {}: {}".format(self._echo_pin, e))
+
+        return end
+
+
+if __name__ == '__main__':
+
+    import sys
+    import argparse
+    import gpiolib as gpio
+    import gpio_backend
+    import ultrasonic
+    import range_filter
+
+    parser = argparse.ArgumentParser(description="Simulated ultrasonic ranging accuracy and latency")
+    parser.add_argument("--readings", type=int, default=200, help="readings per distance")
+    parser.add_argument("--jitter", type=float, default=20e-6, help="echo pulse jitter (s)")
+    parser.add_argument("--dropout", type=float, default=0.02, help="dropout probability")
+    parser.add_argument("--multipath", type=float, default=0.02, help="multipath echo probability")
+    parser.add_argument("--polling", action="store_true", help="time the echo by polling instead of edges")
+    args = parser.parse_args()
+
+    backend = gpio_backend.MemoryBackend()
+    gpio.set_backend(backend)
+
+    sensor = ultrasonic.UltrasonicSensor(min_distance=4, max_distance=300)
+    sensor.init_ultrasonic(trig_pin=6, echo_pin=5)
+
+    # the simulator thread has to get the interpreter lock while the sensor polls
+    if args.polling:
+
+        sensor._echo_edges = False
+
+        if hasattr(sys, "setswitchinterval"):
+            sys.setswitchinterval(1e-4)
+
+    # p50 and p99 of a list of samples
+    def percentiles(samples):
+
+        samples = sorted(samples) or [float("nan")]
+        return samples[len(samples) // 2], samples[int(len(samples) * 0.99)]
+
+    simulator = EchoSimulator(backend, 6, 5, jitter=args.jitter, dropout=args.dropout, multipath=args.multipath,
+                              seed=1)
+
+    with simulator:
+
+        for distance in (10, 50, 100, 200, 290):
+
+            simulator.set_distance(distance)
+            median = range_filter.create_filter(range_filter.MEDIAN, window=5)
+
+            raw_errors, filtered_errors, latency = list(), list(), list()
+
+            for _ in range(args.readings):
+
+                start = monotonic()
+                reading = sensor.get_distance()
+                latency.append(monotonic() - start)
+
+                estimate = median.update(reading)
+
+                if reading >= 0:
+                    raw_errors.append(abs(reading - distance))
+
+                if estimate is not None:
+                    filtered_errors.append(abs(estimate - distance))
+
+            print("{:4d} cm : raw p50 {:6.2f} p99 {:6.2f} cm, median filter p50 {:6.2f} p99 {:6.2f} cm, "
+                  "latency p50 {:6.2f} p99 {:6.2f} ms".format(distance,
+                                                              *(percentiles(raw_errors) +
+                                                                percentiles(filtered_errors) +
+                                                                percentiles([t * 1000 for t in latency]))))
+
+    print("Simulator: {}".format(simulator.stats()))
+    print("Sensor: {}".format(sensor.echo_stats()))
+
+    sensor.deinit_ultrasonic()
+    backend.close()
@@ -0,0 +1,1578 @@
+#!/usr/bin/env python2
+
+#
+# GPIO I/O backends used by gpiolib
+# SysfsBackend          : /sys/class/gpio (or any directory laid out like it)
+# EmulatedSysfsBackend  : sysfs look-alike in a temporary directory, it creates and
+#                         removes gpioN directories on export/unexport like the kernel
+# MemoryBackend         : pure in-memory pins, records every pin transition with a
+#                         monotonic timestamp
+# MmapBackend           : BCM283x GPIO registers mapped from /dev/gpiomem (or any
+#                         mmap-able stand-in file)
+#
+# Hardware PWM channels (/sys/class/pwm) have their own backends: SysfsPWMBackend and
+# EmulatedSysfsPWMBackend.
+#
+# Edge events of input pins (pin, value, monotonic timestamp) are delivered through
+# edge waiters: SysfsEdgeWaiter blocks in epoll on POLLPRI, QueueEdgeWaiter is used
+# by the in-process backends.
+#
+# Pins exported through sysfs become usable once udev created (and fixed permissions
+# of) their attributes, SysfsBackend.wait_exported waits for that using inotify.
+#
+# Backend methods raise OSError/IOError on failure, gpiolib converts them into its
+# error codes.
+#
+
+import os
+import mmap
+import stat
+import time
+import errno
+import fcntl
+import ctypes
+import ctypes.util
+import select
+import shutil
+import tempfile
+import threading as thread
+from collections import deque
+
+from micro_sleep import monotonic
+
+# --------------------------------- Constants ----------------------------------
+
+SYSFS_GPIO_ROOT = "/sys/class/gpio"
+SYSFS_PWM_ROOT = "/sys/class/pwm"
+
+SYSFS = "sysfs"
+EMULATED = "emulated"
+MEMORY = "memory"
+MMAP = "mmap"
+
+GPIOMEM_DEVICE = "/dev/gpiomem"
+
+_INPUT = "in"
+_OUTPUT = "out"
+
+EDGE_NONE = "none"
+EDGE_RISING = "rising"
+EDGE_FALLING = "falling"
+EDGE_BOTH = "both"
+
+_EDGES = (EDGE_NONE, EDGE_RISING, EDGE_FALLING, EDGE_BOTH)
+
+# default size of MemoryBackend transitions history
+_HISTORY_SIZE = 100000
+
+# maximum number of queued edge events per in-process edge waiter
+_EDGE_QUEUE_SIZE = 4096
+
+# level sampling interval of PollingEdgeWaiter in seconds
+_EDGE_POLL_INTERVAL = 50e-6
+
+# BCM283x GPIO register block (byte offsets)
+_GPFSEL0 = 0x00
+_GPSET0 = 0x1C
+_GPCLR0 = 0x28
+_GPLEV0 = 0x34
+_GPIO_BLOCK_SIZE = 4096
+
+# GPFSEL pin functions
+_FSEL_INPUT = 0b000
+_FSEL_OUTPUT = 0b001
+
+# default time to wait for exported pin attributes to become writable, in seconds
+_EXPORT_TIMEOUT = 1.0
+
+# sysfs doesn't report every directory creation through inotify, pending attributes
+# are checked again at least this often (seconds)
+_EXPORT_RECHECK = 0.01
+
+# inotify(7) flags
+_IN_ATTRIB = 0x00000004
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+
+# inotify is reached through libc, it is missing from some C libraries
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    _inotify_init1 = _libc.inotify_init1
+    _inotify_add_watch = _libc.inotify_add_watch
+except (OSError, AttributeError):
+    _inotify_init1 = _inotify_add_watch = None
+
+# positional read/write are only available in python 3.3+
+_pwrite = getattr(os, "pwrite", None)
+_pread = getattr(os, "pread", None)
+
+
+# ------------------------------ sysfs file helpers ----------------------------
+
+# write a string at offset 0 of an already opened sysfs attribute
+def _fd_write(fd, data):
+    """
+    Writes data to the start of an open sysfs attribute file. Uses os.pwrite when
+    available (python 3.3+), otherwise seeks to the start of the file and writes.
+    :param fd: file descriptor of the sysfs attribute
+    :param data: string to write
+    :return: number of bytes written
+    """
+    data = str(data).encode("ascii")
+
+    if _pwrite is not None:
+        return _pwrite(fd, data, 0)
+
+    os.lseek(fd, 0, os.SEEK_SET)
+    return os.write(fd, data)
+
+
+# read the content of an already opened sysfs attribute
+def _fd_read(fd):
+    """
+    Reads the content of an open sysfs attribute file from offset 0
+    :param fd: file descriptor of the sysfs attribute
+    :return: file content stripped from white spaces
+    """
+    if _pread is not None:
+        return _pread(fd, 16, 0).decode("ascii").strip()
+
+    os.lseek(fd, 0, os.SEEK_SET)
+    return os.read(fd, 16).decode("ascii").strip()
+
+
+# one shot write to a sysfs file (export, unexport)
+def _sysfs_write(path, data):
+    """
+    Opens a sysfs file, writes data to it and closes it again
+    :param path: path of the sysfs file
+    :param data: string to write
+    :return: None, raises OSError on failure
+    """
+    fd = os.open(path, os.O_WRONLY)
+
+    try:
+        _fd_write(fd, data)
+    finally:
+        os.close(fd)
+
+
+# open a sysfs attribute for reading and writing
+def _open_attribute(path):
+    """
+    Opens a sysfs attribute for reading and writing, falls back to read only access
+    if the attribute is not writable (input pins, udev permissions)
+    :param path: path of the attribute
+    :return: file descriptor
+    """
+    try:
+        return os.open(path, os.O_RDWR)
+    except (OSError, IOError):
+        return os.open(path, os.O_RDONLY)
+
+
+# set O_NONBLOCK on a file descriptor
+def set_nonblocking(fd):
+    """
+    :param fd: file descriptor (self-pipe ends, edge pipes)
+    :return: None
+    """
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+
+# check if a level change is reported for an edge setting
+def _edge_matches(edge, value):
+    return edge == EDGE_BOTH or (edge == EDGE_RISING and value) or (edge == EDGE_FALLING and not value)
+
+
+# wait for files to become writable
+def _wait_writable(paths, timeout=_EXPORT_TIMEOUT):
+    """
+    Waits until all the given files exist and are writable. The files and their parent
+    directories are watched with inotify (created, attributes changed), every pending
+    file is also checked again each _EXPORT_RECHECK seconds in case an event is not
+    reported (or inotify is not available).
+    :param paths: file paths
+    :param timeout: maximum time to wait in seconds
+    :return: None, raises OSError(ETIMEDOUT) if some files are not writable in time
+    """
+    deadline = monotonic() + timeout
+    pending = [path for path in paths if not os.access(path, os.W_OK)]
+    watched = set()
+
+    # closing an inotify instance takes milliseconds, don't create one if nothing is pending
+    if not pending:
+        return None
+
+    fd = _inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC) if _inotify_init1 is not None else -1
+
+    try:
+
+        while True:
+
+            # watch the pin directories and the directory they are created in
+            if fd >= 0:
+
+                for path in pending:
+
+                    for directory in (os.path.dirname(os.path.dirname(path)), os.path.dirname(path)):
+
+                        if directory not in watched and os.path.isdir(directory):
+
+                            if _inotify_add_watch(fd, directory.encode("utf-8"),
+                                                  _IN_CREATE | _IN_ATTRIB | _IN_MOVED_TO) >= 0:
+                                watched.add(directory)
+
+            pending = [path for path in pending if not os.access(path, os.W_OK)]
+
+            if not pending:
+                return None
+
+            remaining = deadline - monotonic()
+
+            if remaining <= 0:
+                raise OSError(errno.ETIMEDOUT, os.strerror(errno.ETIMEDOUT), pending[0])
+
+            # events are only a wake up, the files are checked again anyway
+            if fd >= 0:
+
+                if select.select([fd], [], [], min(remaining, _EXPORT_RECHECK))[0]:
+
+                    try:
+                        os.read(fd, 4096)
+                    except OSError:
+                        pass
+
+            else:
+                time.sleep(min(remaining, _EXPORT_RECHECK))
+
+    finally:
+
+        if fd >= 0:
+            os.close(fd)
+
+
+# ------------------------------- Edge waiters ---------------------------------
+
+class SysfsEdgeWaiter(object):
+    """
+    Waits for edges on sysfs pins (configured through their edge attribute) using
+    epoll on POLLPRI. Every waiter opens its own value file descriptors, so several
+    waiters on the same pin don't steal each other's notifications.
+    """
+
+    def __init__(self, backend, pins=()):
+
+        self._backend = backend
+        self._epoll = select.epoll()
+
+        # {pin: fd}, {fd: pin}
+        self._fds = dict()
+        self._pins = dict()
+
+        # self-pipe used to interrupt a blocked wait
+        self._wake_r, self._wake_w = os.pipe()
+
+        for fd in (self._wake_r, self._wake_w):
+            set_nonblocking(fd)
+
+        self._epoll.register(self._wake_r, select.EPOLLIN)
+
+        for pin in pins:
+            self.add(pin)
+
+    def add(self, pin):
+        """
+        Starts watching a pin
+        :param pin: pin number
+        :return: None
+        """
+        if pin in self._fds:
+            return
+
+        fd = os.open(os.path.join(self._backend.pin_dir(pin), "value"), os.O_RDONLY)
+
+        # the first read arms the edge notification
+        _fd_read(fd)
+
+        self._fds[pin] = fd
+        self._pins[fd] = pin
+        self._epoll.register(fd, select.EPOLLPRI | select.EPOLLERR)
+
+    def remove(self, pin):
+        """
+        Stops watching a pin
+        :param pin: pin number
+        :return: None
+        """
+        fd = self._fds.pop(pin, None)
+
+        if fd is not None:
+
+            self._pins.pop(fd, None)
+            self._epoll.unregister(fd)
+            os.close(fd)
+
+    def flush(self):
+        """
+        Drops pending edge notifications
+        :return: None
+        """
+        for fd in list(self._pins.keys()):
+            _fd_read(fd)
+
+    def interrupt(self):
+        """
+        Makes a blocked wait return (with no events)
+        :return: None
+        """
+        try:
+            os.write(self._wake_w, b"x")
+        except OSError:
+            pass
+
+    def wait(self, timeout=None):
+        """
+        Blocks until an edge occurs on any of the watched pins
+        :param timeout: seconds to wait, None waits forever
+        :return: list of (pin, value, timestamp) events, empty on timeout
+        """
+        ready = self._epoll.poll(-1 if timeout is None else max(0.0, timeout))
+        timestamp = monotonic()
+
+        events = list()
+
+        for fd, _ in ready:
+
+            pin = self._pins.get(fd)
+
+            if pin is not None:
+                events.append((pin, int(_fd_read(fd)), timestamp))
+
+            elif fd == self._wake_r:
+
+                try:
+                    os.read(self._wake_r, 64)
+                except OSError:
+                    pass
+
+        return events
+
+    def close(self):
+        """
+        Closes the waiter file descriptors
+        :return: None
+        """
+        for pin in list(self._fds.keys()):
+            self.remove(pin)
+
+        self._epoll.close()
+
+        for fd in (self._wake_r, self._wake_w):
+            os.close(fd)
+
+
+class QueueEdgeWaiter(object):
+    """
+    Edge waiter of the in-process backends (emulated sysfs, memory), the backend
+    queues edge events with the time of the level change and wakes the waiter
+    through a pipe. Only the latest _EDGE_QUEUE_SIZE events are kept. A level waiter
+    gets every level change, whatever the pin edge setting (outputs included).
+    """
+
+    def __init__(self, backend, pins=(), levels=False):
+
+        self._backend = backend
+        self._pins = set(pins)
+        self.levels = levels
+        self._events = deque(maxlen=_EDGE_QUEUE_SIZE)
+
+        self._wake_r, self._wake_w = os.pipe()
+
+        for fd in (self._wake_r, self._wake_w):
+            set_nonblocking(fd)
+
+        backend._add_waiter(self)
+
+    def add(self, pin):
+        self._pins.add(pin)
+
+    def remove(self, pin):
+        self._pins.discard(pin)
+
+    def notify(self, pin, value, timestamp):
+        """
+        Called by the backend on a reported level change
+        :param pin: pin number
+        :param value: new pin level
+        :param timestamp: time of the level change
+        :return: None
+        """
+        if pin in self._pins:
+
+            self._events.append((pin, value, timestamp))
+            self.interrupt()
+
+    def interrupt(self):
+
+        try:
+            os.write(self._wake_w, b"x")
+        except OSError:
+            pass
+
+    def flush(self):
+
+        self._events.clear()
+        self._drain()
+
+    def wait(self, timeout=None):
+
+        if not self._events:
+
+            if timeout is not None:
+                timeout = max(0.0, timeout)
+
+            select.select([self._wake_r], [], [], timeout)
+
+        self._drain()
+
+        events = list()
+
+        while self._events:
+            events.append(self._events.popleft())
+
+        return events
+
+    def close(self):
+
+        self._backend._remove_waiter(self)
+
+        for fd in (self._wake_r, self._wake_w):
+            os.close(fd)
+
+    def _drain(self):
+
+        try:
+            os.read(self._wake_r, 4096)
+        except OSError:
+            pass
+
+
+class PollingEdgeWaiter(object):
+    """
+    Edge waiter for backends without edge notifications (memory mapped registers),
+    samples the pin levels every _EDGE_POLL_INTERVAL seconds while waiting and
+    reports level changes that match the pin's edge setting.
+    """
+
+    def __init__(self, backend, pins=(), interval=_EDGE_POLL_INTERVAL):
+
+        self._backend = backend
+        self._interval = interval
+        self._levels = dict()
+        self._interrupted = False
+
+        for pin in pins:
+            self.add(pin)
+
+    def add(self, pin):
+        self._levels[pin] = self._backend.read_value(pin)
+
+    def remove(self, pin):
+        self._levels.pop(pin, None)
+
+    def flush(self):
+
+        for pin in list(self._levels.keys()):
+            self._levels[pin] = self._backend.read_value(pin)
+
+    def interrupt(self):
+        self._interrupted = True
+
+    def wait(self, timeout=None):
+
+        deadline = None if timeout is None else monotonic() + max(0.0, timeout)
+        self._interrupted = False
+
+        while True:
+
+            events = list()
+            timestamp = monotonic()
+
+            for pin, previous in list(self._levels.items()):
+
+                value = self._backend.read_value(pin)
+
+                if value != previous:
+
+                    self._levels[pin] = value
+
+                    if _edge_matches(self._backend.edge_of(pin), value):
+                        events.append((pin, value, timestamp))
+
+            if events or self._interrupted or (deadline is not None and timestamp >= deadline):
+                return events
+
+            time.sleep(self._interval)
+
+    def close(self):
+        self._levels.clear()
+
+
+# in-process edge detection, shared by the emulated sysfs and memory backends
+class _InProcessEdges(object):
+
+    def _init_edges(self):
+
+        self._edges = dict()
+        self._waiters = list()
+        self._waiters_lock = thread.Lock()
+
+    def edge_waiter(self, pins=()):
+        return QueueEdgeWaiter(self, pins)
+
+    def level_waiter(self, pins=()):
+        """
+        Waiter reporting every level change of the pins, whatever their edge setting,
+        the way external hardware watching the lines sees them (simulated devices)
+        :param pins: pin numbers
+        :return: QueueEdgeWaiter
+        """
+        return QueueEdgeWaiter(self, pins, levels=True)
+
+    def _add_waiter(self, waiter):
+
+        with self._waiters_lock:
+            self._waiters.append(waiter)
+
+    def _remove_waiter(self, waiter):
+
+        with self._waiters_lock:
+
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _notify_edge(self, pin, value, timestamp):
+
+        edge = _edge_matches(self._edges.get(pin, EDGE_NONE), value)
+
+        with self._waiters_lock:
+            waiters = list(self._waiters)
+
+        for waiter in waiters:
+
+            if edge or waiter.levels:
+                waiter.notify(pin, value, timestamp)
+
+
+# ------------------------------- Backend interface ----------------------------
+
+class GPIOBackend(object):
+    """
+    Interface of a GPIO backend, pins are addressed by their number.
+    All methods raise OSError/IOError on failure.
+    """
+
+    name = None
+
+    def export(self, pin):
+        raise NotImplementedError
+
+    def unexport(self, pin):
+        raise NotImplementedError
+
+    def export_pins(self, pins):
+        """
+        Exports several pins
+        :param pins: pin numbers
+        :return: None
+        """
+        for pin in pins:
+            self.export(pin)
+
+    def wait_exported(self, pins, timeout=_EXPORT_TIMEOUT):
+        """
+        Waits until exported pins can be configured, in-process backends are ready
+        as soon as export returns
+        :param pins: pin numbers
+        :param timeout: maximum time to wait in seconds
+        :return: None, raises OSError(ETIMEDOUT) if some pins are not ready in time
+        """
+        return None
+
+    def is_exported(self, pin):
+        raise NotImplementedError
+
+    def write_direction(self, pin, direction):
+        raise NotImplementedError
+
+    def read_direction(self, pin):
+        raise NotImplementedError
+
+    def write_value(self, pin, value):
+        raise NotImplementedError
+
+    def read_value(self, pin):
+        raise NotImplementedError
+
+    def write_values(self, values):
+        """
+        Writes several pin values as one batch, backends that can't do it in a single
+        operation write the pins one after the other
+        :param values: {pin: value}
+        :return: measured skew, seconds between the first and the last pin write
+        """
+        first = last = None
+
+        for pin, value in values.items():
+
+            self.write_value(pin, value)
+            last = monotonic()
+
+            if first is None:
+                first = last
+
+        return last - first if first is not None else 0.0
+
+    def read_levels(self, pins):
+        """
+        Reads the levels of several pins
+        :param pins: pin numbers
+        :return: bit mask, bit n is the level of pin n
+        """
+        mask = 0
+
+        for pin in pins:
+            mask |= self.read_value(pin) << pin
+
+        return mask
+
+    def write_edge(self, pin, edge):
+        raise NotImplementedError
+
+    def edge_waiter(self, pins=()):
+        """
+        Creates an edge waiter for the given pins
+        :param pins: pin numbers to watch
+        :return: edge waiter (wait, flush, interrupt, add, remove, close)
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Releases resources held by the backend
+        :return: 0
+        """
+        return 0
+
+
+# -------------------------------- sysfs backend -------------------------------
+
+class SysfsBackend(GPIOBackend):
+    """
+    GPIO access through the sysfs gpio class. Pin attributes (value, direction) are
+    opened once and written through their cached file descriptors.
+    """
+
+    name = SYSFS
+
+    def __init__(self, root=SYSFS_GPIO_ROOT):
+
+        self._root = root
+        self._export_path = os.path.join(root, "export")
+        self._unexport_path = os.path.join(root, "unexport")
+
+        # {pin: {attribute: fd}}
+        self._fds = dict()
+        self._fds_lock = thread.Lock()
+
+    @property
+    def root(self):
+        return self._root
+
+    def pin_dir(self, pin):
+        """
+        :param pin: pin number
+        :return: path of the pin class directory (gpioN)
+        """
+        return os.path.join(self._root, "gpio" + str(pin))
+
+    def export(self, pin):
+        _sysfs_write(self._export_path, pin)
+
+    def unexport(self, pin):
+        self._close_pin(pin)
+        _sysfs_write(self._unexport_path, pin)
+
+    def export_pins(self, pins):
+
+        # one open of the export file, one write per pin (the kernel takes one pin per write)
+        fd = os.open(self._export_path, os.O_WRONLY)
+
+        try:
+
+            for pin in pins:
+                _fd_write(fd, pin)
+
+        finally:
+            os.close(fd)
+
+    def wait_exported(self, pins, timeout=_EXPORT_TIMEOUT):
+
+        # udev may still be changing the owner/mode of the attributes after export
+        _wait_writable([os.path.join(self.pin_dir(pin), attribute)
+                        for pin in pins for attribute in ("direction", "value")], timeout)
+
+    def is_exported(self, pin):
+        return os.path.exists(self.pin_dir(pin))
+
+    def write_direction(self, pin, direction):
+        self._write_attribute(pin, "direction", direction)
+
+    def read_direction(self, pin):
+        return _fd_read(self._attribute_fd(pin, "direction"))
+
+    def write_value(self, pin, value):
+        self._write_attribute(pin, "value", value)
+
+    def read_value(self, pin):
+        return int(_fd_read(self._attribute_fd(pin, "value")))
+
+    def write_edge(self, pin, edge):
+
+        if edge not in _EDGES:
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), "edge")
+
+        self._write_attribute(pin, "edge", edge)
+
+    def edge_waiter(self, pins=()):
+        return SysfsEdgeWaiter(self, pins)
+
+    def close(self):
+
+        for pin in list(self._fds.keys()):
+            self._close_pin(pin)
+
+        return 0
+
+    # get (open if needed) the file descriptor of a pin attribute
+    def _attribute_fd(self, pin, attribute):
+        """
+        Returns the cached file descriptor of a pin attribute, the attribute is opened on
+        first use
+        :param pin: pin number
+        :param attribute: attribute name (value, direction)
+        :return: file descriptor
+        """
+        fd = self._fds.get(pin, {}).get(attribute)
+
+        if fd is None:
+
+            with self._fds_lock:
+
+                pin_fds = self._fds.setdefault(pin, dict())
+                fd = pin_fds.get(attribute)
+
+                if fd is None:
+                    fd = pin_fds[attribute] = _open_attribute(os.path.join(self.pin_dir(pin), attribute))
+
+        return fd
+
+    # write to a pin attribute
+    def _write_attribute(self, pin, attribute, data):
+        _fd_write(self._attribute_fd(pin, attribute), data)
+
+    # close cached file descriptors of a pin
+    def _close_pin(self, pin):
+
+        with self._fds_lock:
+            pin_fds = self._fds.pop(pin, dict())
+
+        for fd in pin_fds.values():
+
+            try:
+                os.close(fd)
+            except (OSError, IOError):
+                pass
+
+
+# --------------------------- Emulated sysfs backend ---------------------------
+
+class EmulatedSysfsBackend(_InProcessEdges, SysfsBackend):
+    """
+    A sysfs gpio class look-alike rooted in a (temporary) directory. Exporting a pin
+    creates its gpioN directory and attributes, unexporting removes it, the same
+    errors the kernel returns are raised for invalid operations. Regular files don't
+    raise POLLPRI, edges are reported through in-process edge waiters instead.
+    """
+
+    name = EMULATED
+
+    def __init__(self, root=None):
+
+        # prefer tmpfs to keep the emulated attributes off the disk
+        self._owns_root = root is None
+
+        if root is None:
+            root = tempfile.mkdtemp(prefix="gpio_", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+        SysfsBackend.__init__(self, root)
+        self._init_edges()
+
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+        for path in (self._export_path, self._unexport_path):
+            open(path, "a").close()
+
+    def export(self, pin):
+
+        if self.is_exported(pin):
+            raise OSError(errno.EBUSY, os.strerror(errno.EBUSY), self._export_path)
+
+        pin_dir = self.pin_dir(pin)
+        os.mkdir(pin_dir)
+
+        for attribute, default in (("direction", _INPUT), ("value", 0), ("active_low", 0), ("edge", "none")):
+
+            with open(os.path.join(pin_dir, attribute), "w") as f:
+                f.write("{}\n".format(default))
+
+    def export_pins(self, pins):
+        GPIOBackend.export_pins(self, pins)
+
+    def unexport(self, pin):
+
+        if not self.is_exported(pin):
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), self._unexport_path)
+
+        SysfsBackend.unexport(self, pin)
+        shutil.rmtree(self.pin_dir(pin))
+        self._edges.pop(pin, None)
+
+    def write_value(self, pin, value):
+
+        # the kernel refuses value writes to input pins
+        if self._read_attribute(pin, "direction") == _INPUT:
+            raise OSError(errno.EPERM, os.strerror(errno.EPERM), os.path.join(self.pin_dir(pin), "value"))
+
+        self._set_value(pin, value)
+
+    def write_edge(self, pin, edge):
+
+        SysfsBackend.write_edge(self, pin, edge)
+        self._edges[pin] = edge
+
+    def drive_input(self, pin, value, timestamp=None):
+        """
+        Sets the level of an input pin, as if it was driven by external hardware
+        :param pin: pin number
+        :param value: pin level (0, 1)
+        :param timestamp: monotonic time of the level change reported with the edge
+        (None: now)
+        :return: None
+        """
+        self._set_value(pin, value, timestamp)
+
+    def close(self):
+
+        SysfsBackend.close(self)
+
+        if self._owns_root:
+            shutil.rmtree(self._root, ignore_errors=True)
+
+        return 0
+
+    # regular files keep stale bytes after a shorter write, truncate them like sysfs would
+    def _write_attribute(self, pin, attribute, data):
+
+        fd = self._attribute_fd(pin, attribute)
+        os.ftruncate(fd, _fd_write(fd, data))
+
+    def _read_attribute(self, pin, attribute):
+        return _fd_read(self._attribute_fd(pin, attribute))
+
+    def _set_value(self, pin, value, timestamp=None):
+
+        value = int(value)
+        previous = self.read_value(pin)
+
+        self._write_attribute(pin, "value", value)
+
+        if previous != value:
+            self._notify_edge(pin, value, timestamp or monotonic())
+
+
+# ------------------------------- Memory backend -------------------------------
+
+class MemoryBackend(_InProcessEdges, GPIOBackend):
+    """
+    In-memory GPIO pins, no file system access at all. Every level change of a pin
+    is recorded as a (timestamp, pin, value) transition using the monotonic clock.
+    """
+
+    name = MEMORY
+
+    def __init__(self, history=_HISTORY_SIZE):
+
+        self._lock = thread.Lock()
+        self._exported = set()
+        self._directions = dict()
+        self._values = dict()
+        self._transitions = deque(maxlen=history)
+        self._writes = 0
+
+        self._init_edges()
+
+    def export(self, pin):
+
+        with self._lock:
+
+            if pin in self._exported:
+                raise OSError(errno.EBUSY, os.strerror(errno.EBUSY), "export")
+
+            self._exported.add(pin)
+            self._directions[pin] = _INPUT
+            self._values[pin] = 0
+
+    def unexport(self, pin):
+
+        with self._lock:
+
+            if pin not in self._exported:
+                raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), "unexport")
+
+            self._exported.discard(pin)
+            self._directions.pop(pin, None)
+            self._values.pop(pin, None)
+            self._edges.pop(pin, None)
+
+    def is_exported(self, pin):
+        return pin in self._exported
+
+    def write_direction(self, pin, direction):
+
+        with self._lock:
+
+            self._check_exported(pin)
+
+            if direction not in (_INPUT, _OUTPUT):
+                raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), "direction")
+
+            self._directions[pin] = direction
+
+    def read_direction(self, pin):
+
+        self._check_exported(pin)
+        return self._directions[pin]
+
+    def write_value(self, pin, value):
+
+        with self._lock:
+
+            self._check_exported(pin)
+
+            if self._directions[pin] == _INPUT:
+                raise OSError(errno.EPERM, os.strerror(errno.EPERM), "value")
+
+            self._set_value(pin, int(value))
+
+    def read_value(self, pin):
+
+        self._check_exported(pin)
+        return self._values[pin]
+
+    def write_values(self, values):
+
+        # all pins change under one lock, with one timestamp
+        with self._lock:
+
+            for pin in values:
+
+                self._check_exported(pin)
+
+                if self._directions[pin] == _INPUT:
+                    raise OSError(errno.EPERM, os.strerror(errno.EPERM), "value")
+
+            timestamp = monotonic()
+
+            for pin, value in values.items():
+                self._set_value(pin, int(value), timestamp)
+
+        return 0.0
+
+    def read_levels(self, pins):
+
+        with self._lock:
+            return GPIOBackend.read_levels(self, pins)
+
+    def write_edge(self, pin, edge):
+
+        with self._lock:
+
+            self._check_exported(pin)
+
+            if edge not in _EDGES:
+                raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), "edge")
+
+            self._edges[pin] = edge
+
+    def drive_input(self, pin, value, timestamp=None):
+        """
+        Sets the level of an input pin, as if it was driven by external hardware
+        :param pin: pin number
+        :param value: pin level (0, 1)
+        :param timestamp: monotonic time of the level change recorded and reported with
+        the edge (None: now)
+        :return: None
+        """
+        with self._lock:
+
+            self._check_exported(pin)
+            self._set_value(pin, int(value), timestamp)
+
+    def transitions(self, pin=None):
+        """
+        Recorded pin transitions
+        :param pin: only return transitions of this pin (None: all pins)
+        :return: list of (timestamp, pin, value) tuples, oldest first
+        """
+        with self._lock:
+            records = list(self._transitions)
+
+        if pin is not None:
+            records = [r for r in records if r[1] == pin]
+
+        return records
+
+    def clear_transitions(self):
+        """
+        Drops recorded transitions and resets the write counter
+        :return: 0
+        """
+        with self._lock:
+            self._transitions.clear()
+            self._writes = 0
+
+        return 0
+
+    @property
+    def writes(self):
+        """number of value writes (including writes that didn't change the pin level)"""
+        return self._writes
+
+    def _set_value(self, pin, value, timestamp=None):
+
+        self._writes += 1
+
+        if self._values[pin] != value:
+
+            timestamp = timestamp or monotonic()
+
+            self._values[pin] = value
+            self._transitions.append((timestamp, pin, value))
+            self._notify_edge(pin, value, timestamp)
+
+    def _check_exported(self, pin):
+
+        if pin not in self._exported:
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), "gpio{}".format(pin))
+
+
+# ------------------------ Memory mapped register backend ----------------------
+
+class GPIORegisters(object):
+    """
+    Word access to a memory mapped BCM283x GPIO register block. Any mmap-able file
+    works: /dev/gpiomem on the board, or a plain file standing in for it (created
+    and sized on first use). /dev/gpiomem itself is never created, opening it fails
+    with ENOENT on a host without the device. With emulate_levels, set/clear writes
+    are mirrored into the level registers, the way the pins would follow them on the
+    hardware.
+    """
+
+    def __init__(self, path=GPIOMEM_DEVICE, size=_GPIO_BLOCK_SIZE, emulate_levels=False):
+
+        stand_in = path != GPIOMEM_DEVICE
+
+        fd = os.open(path, os.O_RDWR | os.O_SYNC | (os.O_CREAT if stand_in else 0))
+
+        try:
+
+            # stand-in files must cover the mapped block
+            if stand_in and stat.S_ISREG(os.fstat(fd).st_mode) and os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+
+            self._mmap = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+
+        finally:
+            os.close(fd)
+
+        # 32 bit words over the mapping, each assignment is a single word store
+        self._words = (ctypes.c_uint32 * (size // 4)).from_buffer(self._mmap)
+        self._emulate_levels = emulate_levels
+
+    def set_function(self, pin, function):
+        """
+        Sets the function (GPFSEL bits) of a pin
+        :param pin: pin number
+        :param function: 3 bit function code (0: input, 1: output)
+        :return: None
+        """
+        index = _GPFSEL0 // 4 + pin // 10
+        shift = (pin % 10) * 3
+
+        self._words[index] = (self._words[index] & ~(0b111 << shift)) | (function << shift)
+
+    def function(self, pin):
+        """
+        :param pin: pin number
+        :return: 3 bit function code of the pin
+        """
+        return (self._words[_GPFSEL0 // 4 + pin // 10] >> ((pin % 10) * 3)) & 0b111
+
+    def set_mask(self, mask, bank=0):
+        """
+        Drives the pins of a mask high with one GPSET write
+        :param mask: bit mask of pins (bit n: pin 32 * bank + n)
+        :param bank: register bank (0: pins 0-31, 1: pins 32-53)
+        :return: None
+        """
+        self._words[_GPSET0 // 4 + bank] = mask
+
+        if self._emulate_levels:
+            self._words[_GPLEV0 // 4 + bank] |= mask
+
+    def clear_mask(self, mask, bank=0):
+        """
+        Drives the pins of a mask low with one GPCLR write
+        :param mask: bit mask of pins (bit n: pin 32 * bank + n)
+        :param bank: register bank (0: pins 0-31, 1: pins 32-53)
+        :return: None
+        """
+        self._words[_GPCLR0 // 4 + bank] = mask
+
+        if self._emulate_levels:
+            self._words[_GPLEV0 // 4 + bank] &= ~mask & 0xFFFFFFFF
+
+    def levels(self, bank=0):
+        """
+        :param bank: register bank (0: pins 0-31, 1: pins 32-53)
+        :return: GPLEV word, bit n is the level of pin 32 * bank + n
+        """
+        return self._words[_GPLEV0 // 4 + bank]
+
+    def write_levels(self, mask, value, bank=0):
+        """
+        Overwrites level bits, only meaningful for stand-in files (external input)
+        :param mask: bit mask of pins
+        :param value: new levels of the masked pins
+        :param bank: register bank
+        :return: None
+        """
+        index = _GPLEV0 // 4 + bank
+        self._words[index] = (self._words[index] & ~mask & 0xFFFFFFFF) | (value & mask)
+
+    def close(self):
+
+        # the ctypes view must go before the mapping can be closed
+        del self._words
+        self._mmap.close()
+
+
+class MmapBackend(GPIOBackend):
+    """
+    GPIO access through the memory mapped BCM283x GPIO registers: a pin write is one
+    GPSET/GPCLR word store, a pin read one GPLEV word load, no system calls at all.
+    Pins don't need to be exported, export/unexport only track which pins are in use
+    (unexport returns the pin to input). Edges are detected by sampling the levels
+    (PollingEdgeWaiter). Stand-in files get emulated levels by default, the device
+    never does: without /dev/gpiomem the backend fails instead of driving nothing.
+    """
+
+    name = MMAP
+
+    def __init__(self, path=GPIOMEM_DEVICE, emulate_levels=None):
+
+        # the device must exist, a missing one is no stand-in file
+        if path == GPIOMEM_DEVICE and not os.path.exists(path):
+            raise OSError(errno.ENOENT, "No GPIO register device (is this a Raspberry Pi?)", path)
+
+        if emulate_levels is None:
+            emulate_levels = path != GPIOMEM_DEVICE and not (os.path.exists(path) and stat.S_ISCHR(os.stat(path).st_mode))
+
+        self._registers = GPIORegisters(path, emulate_levels=emulate_levels)
+        self._lock = thread.Lock()
+        self._exported = set()
+        self._edges = dict()
+
+    @property
+    def registers(self):
+        return self._registers
+
+    def export(self, pin):
+
+        with self._lock:
+
+            if pin in self._exported:
+                raise OSError(errno.EBUSY, os.strerror(errno.EBUSY), "export")
+
+            self._exported.add(pin)
+
+    def unexport(self, pin):
+
+        with self._lock:
+
+            if pin not in self._exported:
+                raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), "unexport")
+
+            self._exported.discard(pin)
+            self._edges.pop(pin, None)
+            self._registers.set_function(pin, _FSEL_INPUT)
+
+    def is_exported(self, pin):
+        return pin in self._exported
+
+    def write_direction(self, pin, direction):
+
+        if direction not in (_INPUT, _OUTPUT):
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), "direction")
+
+        # GPFSEL is a read-modify-write shared by 10 pins
+        with self._lock:
+            self._registers.set_function(pin, _FSEL_OUTPUT if direction == _OUTPUT else _FSEL_INPUT)
+
+    def read_direction(self, pin):
+
+        # alternate functions are reported as inputs, the pin doesn't drive its GPSET/GPCLR level
+        return _OUTPUT if self._registers.function(pin) == _FSEL_OUTPUT else _INPUT
+
+    def write_value(self, pin, value):
+
+        if value:
+            self._registers.set_mask(1 << (pin & 31), pin >> 5)
+        else:
+            self._registers.clear_mask(1 << (pin & 31), pin >> 5)
+
+    def read_value(self, pin):
+        return int((self._registers.levels(pin >> 5) >> (pin & 31)) & 1)
+
+    def write_values(self, values):
+
+        # one GPSET and one GPCLR store per bank
+        set_masks = [0, 0]
+        clear_masks = [0, 0]
+
+        for pin, value in values.items():
+
+            if value:
+                set_masks[pin >> 5] |= 1 << (pin & 31)
+            else:
+                clear_masks[pin >> 5] |= 1 << (pin & 31)
+
+        first = last = None
+
+        for bank in (0, 1):
+
+            if set_masks[bank]:
+
+                self._registers.set_mask(set_masks[bank], bank)
+                last = monotonic()
+                first = first or last
+
+            if clear_masks[bank]:
+
+                self._registers.clear_mask(clear_masks[bank], bank)
+                last = monotonic()
+                first = first or last
+
+        return last - first if first is not None else 0.0
+
+    def read_levels(self, pins):
+
+        # one GPLEV load per bank
+        levels = self._registers.levels(0) | (self._registers.levels(1) << 32)
+        mask = 0
+
+        for pin in pins:
+            mask |= levels & (1 << pin)
+
+        return int(mask)
+
+    def write_edge(self, pin, edge):
+
+        if edge not in _EDGES:
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), "edge")
+
+        self._edges[pin] = edge
+
+    def edge_of(self, pin):
+        return self._edges.get(pin, EDGE_NONE)
+
+    def edge_waiter(self, pins=()):
+        return PollingEdgeWaiter(self, pins)
+
+    def drive_input(self, pin, value):
+        """
+        Sets the level of an input pin in a stand-in register file
+        :param pin: pin number
+        :param value: pin level (0, 1)
+        :return: None
+        """
+        self._registers.write_levels(1 << (pin & 31), (1 if value else 0) << (pin & 31), pin >> 5)
+
+    def close(self):
+
+        self._registers.close()
+        return 0
+
+
+# ---------------------------- Hardware PWM backends ---------------------------
+
+class SysfsPWMBackend(object):
+    """
+    Hardware PWM channels through the sysfs pwm class (pwmchipN/pwmM), channels are
+    addressed by (chip, channel). Times are in nanoseconds.
+    """
+
+    name = SYSFS
+
+    def __init__(self, root=SYSFS_PWM_ROOT):
+
+        self._root = root
+
+        # {(chip, channel): {attribute: fd}}
+        self._fds = dict()
+        self._fds_lock = thread.Lock()
+
+    @property
+    def root(self):
+        return self._root
+
+    def chip_dir(self, chip):
+        return os.path.join(self._root, "pwmchip" + str(chip))
+
+    def channel_dir(self, chip, channel):
+        return os.path.join(self.chip_dir(chip), "pwm" + str(channel))
+
+    def export(self, chip, channel):
+        _sysfs_write(os.path.join(self.chip_dir(chip), "export"), channel)
+
+    def unexport(self, chip, channel):
+        self._close_channel(chip, channel)
+        _sysfs_write(os.path.join(self.chip_dir(chip), "unexport"), channel)
+
+    def is_exported(self, chip, channel):
+        return os.path.exists(self.channel_dir(chip, channel))
+
+    def write_period(self, chip, channel, period_ns):
+        self._write_attribute(chip, channel, "period", int(period_ns))
+
+    def write_duty_cycle(self, chip, channel, duty_ns):
+        self._write_attribute(chip, channel, "duty_cycle", int(duty_ns))
+
+    def write_enable(self, chip, channel, enabled):
+        self._write_attribute(chip, channel, "enable", 1 if enabled else 0)
+
+    def read_attribute(self, chip, channel, attribute):
+        return _fd_read(self._attribute_fd(chip, channel, attribute))
+
+    def close(self):
+
+        for chip, channel in list(self._fds.keys()):
+            self._close_channel(chip, channel)
+
+        return 0
+
+    def _attribute_fd(self, chip, channel, attribute):
+
+        fd = self._fds.get((chip, channel), {}).get(attribute)
+
+        if fd is None:
+
+            with self._fds_lock:
+
+                channel_fds = self._fds.setdefault((chip, channel), dict())
+                fd = channel_fds.get(attribute)
+
+                if fd is None:
+                    path = os.path.join(self.channel_dir(chip, channel), attribute)
+                    fd = channel_fds[attribute] = _open_attribute(path)
+
+        return fd
+
+    def _write_attribute(self, chip, channel, attribute, data):
+        _fd_write(self._attribute_fd(chip, channel, attribute), data)
+
+    def _close_channel(self, chip, channel):
+
+        with self._fds_lock:
+            channel_fds = self._fds.pop((chip, channel), dict())
+
+        for fd in channel_fds.values():
+
+            try:
+                os.close(fd)
+            except (OSError, IOError):
+                pass
+
+
+class EmulatedSysfsPWMBackend(SysfsPWMBackend):
+    """
+    A sysfs pwm class look-alike rooted in a (temporary) directory, with pwm chips
+    that create/remove their pwmM channel directories on export/unexport and reject
+    invalid settings (duty cycle longer than the period, enabling without a period)
+    like the kernel does.
+    """
+
+    name = EMULATED
+
+    def __init__(self, root=None, chips=None):
+
+        self._owns_root = root is None
+
+        if root is None:
+            root = tempfile.mkdtemp(prefix="pwm_", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+        SysfsPWMBackend.__init__(self, root)
+
+        # {chip: number of channels}, the BCM283x has one chip with two channels
+        chips = chips or {0: 2}
+
+        for chip, npwm in chips.items():
+
+            chip_dir = self.chip_dir(chip)
+
+            if not os.path.isdir(chip_dir):
+                os.makedirs(chip_dir)
+
+            for attribute, default in (("export", ""), ("unexport", ""), ("npwm", npwm)):
+
+                with open(os.path.join(chip_dir, attribute), "w") as f:
+                    f.write("{}\n".format(default))
+
+    def export(self, chip, channel):
+
+        export_path = os.path.join(self.chip_dir(chip), "export")
+
+        if not os.path.isdir(self.chip_dir(chip)):
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), export_path)
+
+        with open(os.path.join(self.chip_dir(chip), "npwm")) as f:
+            npwm = int(f.read())
+
+        if not 0 <= channel < npwm:
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), export_path)
+
+        if self.is_exported(chip, channel):
+            raise OSError(errno.EBUSY, os.strerror(errno.EBUSY), export_path)
+
+        channel_dir = self.channel_dir(chip, channel)
+        os.mkdir(channel_dir)
+
+        for attribute, default in (("period", 0), ("duty_cycle", 0), ("enable", 0), ("polarity", "normal")):
+
+            with open(os.path.join(channel_dir, attribute), "w") as f:
+                f.write("{}\n".format(default))
+
+    def unexport(self, chip, channel):
+
+        if not self.is_exported(chip, channel):
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), os.path.join(self.chip_dir(chip), "unexport"))
+
+        self._close_channel(chip, channel)
+        shutil.rmtree(self.channel_dir(chip, channel))
+
+    def write_period(self, chip, channel, period_ns):
+
+        if int(period_ns) < int(self.read_attribute(chip, channel, "duty_cycle")):
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), "period")
+
+        SysfsPWMBackend.write_period(self, chip, channel, period_ns)
+
+    def write_duty_cycle(self, chip, channel, duty_ns):
+
+        if not 0 <= int(duty_ns) <= int(self.read_attribute(chip, channel, "period")):
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), "duty_cycle")
+
+        SysfsPWMBackend.write_duty_cycle(self, chip, channel, duty_ns)
+
+    def write_enable(self, chip, channel, enabled):
+
+        if enabled and int(self.read_attribute(chip, channel, "period")) == 0:
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), "enable")
+
+        SysfsPWMBackend.write_enable(self, chip, channel, enabled)
+
+    def close(self):
+
+        SysfsPWMBackend.close(self)
+
+        if self._owns_root:
+            shutil.rmtree(self._root, ignore_errors=True)
+
+        return 0
+
+    # regular files keep stale bytes after a shorter write, truncate them like sysfs would
+    def _write_attribute(self, chip, channel, attribute, data):
+
+        fd = self._attribute_fd(chip, channel, attribute)
+        os.ftruncate(fd, _fd_write(fd, data))
+
+
+# ------------------------------ Backend factory -------------------------------
+
+def create_backend(kind=SYSFS, root=None, **kwargs):
+    """
+    Creates a GPIO backend by name
+    :param kind: backend type (SYSFS, EMULATED, MEMORY, MMAP)
+    :param root: sysfs root directory for SYSFS and EMULATED backends, register file
+    (default /dev/gpiomem) for MMAP
+    :param kwargs: extra backend arguments
+    :return: backend instance
+    """
+    if kind == SYSFS:
+        return SysfsBackend(root or SYSFS_GPIO_ROOT)
+
+    elif kind == EMULATED:
+        return EmulatedSysfsBackend(root)
+
+    elif kind == MEMORY:
+        return MemoryBackend(**kwargs)
+
+    elif kind == MMAP:
+        return MmapBackend(root or GPIOMEM_DEVICE, **kwargs)
+
+    raise ValueError("Unknown GPIO backend: {}".format(kind))
+
+
+# backend selected by the environment (RCCAR_GPIO_BACKEND, RCCAR_GPIO_ROOT)
+def backend_from_env(environ=None):
+    """
+    Creates the backend selected by the RCCAR_GPIO_BACKEND (sysfs, emulated, memory,
+    mmap) and RCCAR_GPIO_ROOT environment variables, defaults to sysfs on /sys/class/gpio
+    :param environ: environment mapping (default os.environ)
+    :return: backend instance
+    """
+    environ = os.environ if environ is None else environ
+
+    return create_backend(environ.get("RCCAR_GPIO_BACKEND", SYSFS), environ.get("RCCAR_GPIO_ROOT"))
+
+
+# hardware PWM backend selected by the environment (RCCAR_GPIO_BACKEND, RCCAR_PWM_ROOT)
+def pwm_backend_from_env(environ=None):
+    """
+    Creates the hardware PWM backend matching the GPIO backend selected by
+    RCCAR_GPIO_BACKEND: sysfs and mmap use /sys/class/pwm (or RCCAR_PWM_ROOT), emulated and
+    memory GPIO backends get an emulated pwm class (in RCCAR_PWM_ROOT if set)
+    :param environ: environment mapping (default os.environ)
+    :return: hardware PWM backend instance
+    """
+    environ = os.environ if environ is None else environ
+
+    if environ.get("RCCAR_GPIO_BACKEND", SYSFS) in (SYSFS, MMAP):
+        return SysfsPWMBackend(environ.get("RCCAR_PWM_ROOT") or SYSFS_PWM_ROOT)
+
+    return EmulatedSysfsPWMBackend(environ.get("RCCAR_PWM_ROOT"))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python2
+
+#
+# GPIO write throughput benchmark
+# Compares the legacy shell based pin writes (os.system("echo ...")) against
+# the cached file descriptor writes used by gpiolib.GPIO_Pin, reports the number
+# of pin transitions per second for each method.
+#
+
+import os
+import time
+import argparse
+import gpiolib as gpio
+import gpio_backend
+
+
+# legacy pin write, forks a shell for every transition
+def shell_transitions(pin, transitions):
+    """
+    Toggles the pin using a shell echo for every write (the pre-fd gpiolib behaviour)
+    :param pin: GPIO_Pin instance configured as output
+    :param transitions: number of pin transitions to perform
+    :return: transitions per second
+    """
+    value_path = os.path.join(pin._backend.pin_dir(pin._pin_number), "value")
+
+    start = time.time()
+
+    for i in range(transitions):
+        os.system("echo \"{}\" > {}".format(i & 1, value_path))
+
+    return transitions / (time.time() - start)
+
+
+# pin writes through gpiolib cached file descriptors
+def fd_transitions(pin, transitions):
+    """
+    Toggles the pin using GPIO_Pin.set_pin_value
+    :param pin: GPIO_Pin instance configured as output
+    :param transitions: number of pin transitions to perform
+    :return: transitions per second
+    """
+    start = time.time()
+
+    for i in range(transitions):
+        pin.set_pin_value(i & 1)
+
+    return transitions / (time.time() - start)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="GPIO pin write throughput benchmark")
+    parser.add_argument("--pin", type=int, default=21, help="output pin to toggle")
+    parser.add_argument("--transitions", type=int, default=2000, help="number of transitions per method")
+    parser.add_argument("--backend", default=gpio_backend.SYSFS,
+                        choices=(gpio_backend.SYSFS, gpio_backend.EMULATED, gpio_backend.MEMORY,
+                                 gpio_backend.MMAP),
+                        help="GPIO backend to benchmark")
+    parser.add_argument("--root", default=None, help="sysfs root directory (sysfs, emulated backends) or register file (mmap)")
+    args = parser.parse_args()
+
+    backend = gpio_backend.create_backend(args.backend, args.root)
+    gpio.set_backend(backend)
+
+    tp = gpio.GPIO_Pin(args.pin, gpio.GPIO)
+    tp.set_pin_direction(gpio.OUTPUT)
+
+    try:
+
+        after = fd_transitions(tp, args.transitions)
+
+        # shell writes need a directory backed pin
+        if isinstance(backend, gpio_backend.SysfsBackend):
+
+            before = shell_transitions(tp, args.transitions)
+
+            print("shell echo : {:10.1f} transitions/sec".format(before))
+            print("cached fd  : {:10.1f} transitions/sec".format(after))
+            print("speed up   : {:10.1f}x".format(after / before))
+
+        else:
+
+            print("{:10s} : {:10.1f} transitions/sec".format(backend.name, after))
+
+    finally:
+
+        tp.set_pin_value(gpio.LOW)
+        tp.deinit_pin()
+        backend.close()
@@ -9,13 +9,22 @@
 # ask for help though). Unlinke this module, the others
 # have a community so finding ahelp shouldn't be too hard.
 #
-# version 1.4
+# version 1.5
 #
 
 import os
 import time
+import json
+import heapq
+import select
+import weakref
 import threading as thread
 import logging as log
+from collections import deque
+
+import gpio_backend
+from gpio_backend import set_nonblocking
+from micro_sleep import monotonic
 
 # ---------------- GPIO constants -----------------
 
@@ -28,6 +37,11 @@ OUTPUT = "out"
 GPIO = "GPIO"
 PWM = "PWM"
 
+NONE = gpio_backend.EDGE_NONE
+RISING = gpio_backend.EDGE_RISING
+FALLING = gpio_backend.EDGE_FALLING
+BOTH = gpio_backend.EDGE_BOTH
+
 # ---------------- Logging/Debug configurations ---------------
 
 VERBOSE = "verbose"
@@ -46,6 +60,7 @@ ERR_INVALID_ARGUMENT = 2
 ERR_INVALID_CONFIGURATION = 3
 ERR_PWM_NOT_RUNNING = 4
 ERR_ERROR = 5
+ERR_TIMEOUT = 6
 
 # ----------------------------- Available GPIO Pins ----------------------------
 _AVAILABLE_GPIO = {
@@ -77,33 +92,1102 @@ _AVAILABLE_GPIO = {
         21: ["GPIO"]
 }
 
-_GPIO_EXPORT_DIR = "/sys/class/gpio/export"
-_GPIO_UNEXPORT_DIR = "/sys/class/gpio/unexport"
-_GPIO_CLASS_DIR = "/sys/class/gpio"
+_GPIO_CLASS_DIR = gpio_backend.SYSFS_GPIO_ROOT
+
+# ------------------------ Hardware PWM capable GPIO Pins ----------------------
+# GPIO pin: (pwm chip, pwm channel), requires the pwm/pwm-2chan device tree overlay
+_HARDWARE_PWM = {
+        12: (0, 0),
+        18: (0, 0),
+        13: (0, 1),
+        19: (0, 1)
+}
+
+
+# ------------------------------- GPIO backend ---------------------------------
+
+# backend used by pins that are not given an explicit backend, sysfs on /sys/class/gpio
+# unless selected otherwise by RCCAR_GPIO_BACKEND/RCCAR_GPIO_ROOT (see gpio_backend)
+_backend = gpio_backend.backend_from_env()
+
+
+# set default GPIO backend
+def set_backend(backend):
+    """
+    Sets the backend used by GPIO pins created after this call (sysfs, emulated sysfs
+    or in-memory pins, see gpio_backend)
+    :param backend: gpio_backend.GPIOBackend instance
+    :return: previous backend
+    """
+    global _backend
+
+    previous = _backend
+    _backend = backend
+
+    return previous
+
+
+# get default GPIO backend
+def get_backend():
+    """
+    :return: backend used by GPIO pins that are not given an explicit backend
+    """
+    return _backend
+
+
+# hardware PWM backend, created on first use
+_pwm_backend = None
+
+
+# set default hardware PWM backend
+def set_pwm_backend(backend):
+    """
+    Sets the backend used by hardware PWM pins created after this call
+    :param backend: gpio_backend.SysfsPWMBackend instance
+    :return: previous backend
+    """
+    global _pwm_backend
+
+    previous = _pwm_backend
+    _pwm_backend = backend
+
+    return previous
+
+
+# get default hardware PWM backend
+def get_pwm_backend():
+    """
+    :return: backend used by hardware PWM pins that are not given an explicit backend,
+    /sys/class/pwm unless selected otherwise (see gpio_backend.pwm_backend_from_env)
+    """
+    global _pwm_backend
+
+    if _pwm_backend is None:
+        _pwm_backend = gpio_backend.pwm_backend_from_env()
+
+    return _pwm_backend
+
+
+# ----------------------------- Pin write counters -----------------------------
+
+# live pins (counted by write_stats) and the counters of de-initialized pins
+_counted_pins = weakref.WeakSet()
+_retired_writes = [0, 0]
+_counters_lock = thread.Lock()
+
+
+# backend writes issued and elided by the pin state cache
+def write_stats():
+    """
+    Number of direction/value writes issued to the backend and elided by the pin state
+    cache (the write wouldn't have changed the pin), over all pins created so far
+    :return: dict(issued, elided)
+    """
+    with _counters_lock:
+
+        issued, elided = _retired_writes
+
+        for pin in list(_counted_pins):
+            issued += pin._writes_issued
+            elided += pin._writes_elided
+
+    return dict(issued=issued, elided=elided)
+
+
+# ------------------------------ Bulk pin bring-up ------------------------------
+
+# pins exported and configured by export_pins, not yet claimed by a GPIO_Pin
+# {pin_number: (backend, direction, value)}
+_prepared_pins = dict()
+_prepared_lock = thread.Lock()
+
+
+# export and configure several pins in one pass
+def export_pins(pins, backend=None, timeout=gpio_backend._EXPORT_TIMEOUT):
+    """
+    Brings up several pins at once: all pins are exported first, then their attributes
+    are awaited together (inotify, see gpio_backend.SysfsBackend.wait_exported), then
+    directions are written and the output values are written as one batch.
+    GPIO_Pin instances created later for these pins adopt them (no export, no
+    redundant direction/value writes), is_used() reports them as free until then.
+    :param pins: {pin_number: (direction, value)}, value is ignored for INPUT pins
+    :param backend: GPIO backend (default: the module backend)
+    :param timeout: maximum time to wait for the exported pins in seconds
+    :return: error code, SUCCESS if all pins were brought up
+    """
+    err_code = SUCCESS
+    backend = backend or _backend
+
+    # check pins are available and free
+    for pin_number, (direction, value) in pins.items():
+
+        if not _AVAILABLE_GPIO.get(pin_number, None) or direction not in (INPUT, OUTPUT):
+
+            log.error("Failed to bring up pins {}".format(sorted(pins)))
+            log.debug("Invalid pin {} or direction {}".format(pin_number, direction))
+            return ERR_INVALID_PIN_NUMBER
+
+        if backend.is_exported(pin_number):
+
+            log.error("Failed to bring up pins {}".format(sorted(pins)))
+            log.debug("Pin {} is already exported".format(pin_number))
+            return ERR_INVALID_CONFIGURATION
+
+    try:
+
+        backend.export_pins(list(pins))
+        backend.wait_exported(list(pins), timeout)
+
+        for pin_number, (direction, value) in pins.items():
+            backend.write_direction(pin_number, direction)
+
+        backend.write_values(dict((pin_number, value) for pin_number, (direction, value) in pins.items()
+                                  if direction == OUTPUT))
+
+    except (OSError, IOError) as e:
+
+        log.error("Failed to bring up pins {}".format(sorted(pins)))
+        log.debug("Bulk export/configuration failed: {}".format(e))
+        err_code = ERR_ERROR
+
+    with _prepared_lock:
+
+        for pin_number, (direction, value) in pins.items():
+
+            # a failed bring-up leaves nothing half configured behind
+            if err_code != SUCCESS:
+
+                try:
+                    if backend.is_exported(pin_number):
+                        backend.unexport(pin_number)
+                except (OSError, IOError):
+                    pass
+
+            else:
+                _prepared_pins[pin_number] = (backend, direction, value if direction == OUTPUT else None)
+
+    if err_code == SUCCESS:
+        log.info("Pins {} brought up".format(sorted(pins)))
+
+    return err_code
+
+
+# unexport pins brought up by export_pins that no GPIO_Pin claimed
+def release_pins():
+    """
+    Unexports the pins exported by export_pins() (or re-adopted from the pin journal)
+    that were not claimed by a GPIO_Pin / HardwarePWM_Pin
+    :return: list of released pin numbers and (chip, channel) tuples
+    """
+    with _prepared_lock:
+
+        released = list(_prepared_pins.items())
+        _prepared_pins.clear()
+
+        channels = list(_prepared_channels.items())
+        _prepared_channels.clear()
+
+    for pin_number, (backend, direction, value) in released:
+
+        try:
+            backend.unexport(pin_number)
+        except (OSError, IOError) as e:
+            log.debug("Unexport of pin {} failed: {}".format(pin_number, e))
+
+        _journal_update("gpio", pin_number, None)
+
+    for (chip, channel), backend in channels:
+
+        try:
+            backend.unexport(chip, channel)
+        except (OSError, IOError) as e:
+            log.debug("Unexport of PWM channel {}:{} failed: {}".format(chip, channel, e))
+
+        _journal_update("pwm", "{}:{}".format(chip, channel), None)
+
+    return [pin_number for pin_number, _ in released] + [channel for channel, _ in channels]
+
+
+# prepared pins not claimed yet
+def prepared_pins():
+    """
+    :return: pin numbers brought up by export_pins (or re-adopted from the pin journal)
+    that no GPIO_Pin claimed yet
+    """
+    with _prepared_lock:
+        return sorted(_prepared_pins)
+
+
+# take a pin prepared by export_pins
+def _claim_prepared(pin_number, backend):
+
+    with _prepared_lock:
+
+        prepared = _prepared_pins.get(pin_number, None)
+
+        if prepared is None or prepared[0] is not backend:
+            return None
+
+        del _prepared_pins[pin_number]
+
+    return prepared[1:]
+
+
+# --------------------------------- Pin journal --------------------------------
+
+# journal of the pins (and hardware PWM channels) owned by this project, lets a
+# restarted controller re-adopt the pins left exported by a crash
+# (RCCAR_PIN_JOURNAL, disabled if not set)
+_journal_path = os.environ.get("RCCAR_PIN_JOURNAL") or None
+_journal = dict(gpio=dict(), pwm=dict())
+_journal_lock = thread.Lock()
+
+# entries of a previous run are read from the journal file before its first update
+_journal_loaded = False
+
+# hardware PWM channels re-adopted from the journal, {(chip, channel): backend}
+_prepared_channels = dict()
+
+
+# set pin journal file
+def set_pin_journal(path):
+    """
+    Sets the pin journal file, exported pins and their configuration are recorded in
+    it from now on, the entries it already holds (pins a crashed run left exported) are
+    kept until they are re-adopted or released
+    :param path: journal file path, None disables the journal
+    :return: previous journal path
+    """
+    global _journal_path, _journal_loaded
+
+    with _journal_lock:
+
+        previous = _journal_path
+        _journal_path = path
+        _journal_loaded = False
+
+    return previous
+
+
+# get pin journal file
+def get_pin_journal():
+    """
+    :return: pin journal file path, None if the journal is disabled
+    """
+    return _journal_path
+
+
+# load the pin journal file
+def _load_journal():
+    """
+    Reads the pin journal
+    :return: journal dict(gpio={pin: entry}, pwm={"chip:channel": entry}), empty if the
+    file is missing or can't be parsed
+    """
+    journal = dict(gpio=dict(), pwm=dict())
+
+    try:
+
+        with open(_journal_path) as f:
+            content = json.load(f)
+
+        journal["gpio"] = dict((int(pin), entry) for pin, entry in content.get("gpio", {}).items())
+        journal["pwm"] = dict(content.get("pwm", {}))
+
+    except (OSError, IOError, ValueError, AttributeError) as e:
+        log.debug("Pin journal {} not loaded: {}".format(_journal_path, e))
+
+    return journal
+
+
+# record (or forget) a pin in the journal
+def _journal_update(kind, key, entry):
+    """
+    Updates one journal entry and rewrites the journal file (write and rename, a crash
+    never leaves a partial journal behind)
+    :param kind: "gpio" or "pwm"
+    :param key: pin number or "chip:channel"
+    :param entry: dict describing the pin, None removes the pin
+    :return: None
+    """
+    global _journal_loaded
+
+    if _journal_path is None:
+        return None
+
+    with _journal_lock:
+
+        # keep the entries of the previous run, this run's entries win
+        if not _journal_loaded:
+
+            journal = _load_journal()
+
+            for journal_kind in ("gpio", "pwm"):
+                journal[journal_kind].update(_journal[journal_kind])
+                _journal[journal_kind] = journal[journal_kind]
+
+            _journal_loaded = True
+
+        if entry is None:
+            _journal[kind].pop(key, None)
+        else:
+            _journal[kind][key] = entry
+
+        temp_path = "{}.{}".format(_journal_path, os.getpid())
+
+        try:
+
+            with open(temp_path, "w") as f:
+                json.dump(dict(gpio=dict((str(pin), e) for pin, e in _journal["gpio"].items()),
+                               pwm=_journal["pwm"]), f)
+
+            os.rename(temp_path, _journal_path)
+
+        except (OSError, IOError) as e:
+            log.debug("Pin journal {} not written: {}".format(_journal_path, e))
+
+
+# warm start, re-adopt the pins recorded in the journal
+def adopt_journaled_pins(backend=None, pwm_backend=None):
+    """
+    Re-adopts the pins and hardware PWM channels a previous run recorded in the pin
+    journal and left exported (crash). Every pin is verified: it must still be exported,
+    its direction is read back (a different direction is rewritten by the first
+    set_pin_direction) and output levels are read so the first writes aren't elided
+    wrongly. Verified pins are handed to the next GPIO_Pin / HardwarePWM_Pin created
+    for them, like pins brought up by export_pins. Journal entries of pins that are no
+    longer exported are dropped.
+    :param backend: GPIO backend (default: the module backend)
+    :param pwm_backend: hardware PWM backend (default: the module PWM backend)
+    :return: (err_code, adopted), adopted is a list of pin numbers and (chip, channel)
+    tuples
+    """
+    global _journal_loaded
+
+    err_code = SUCCESS
+    adopted = list()
+
+    backend = backend or _backend
+
+    if _journal_path is None:
+
+        log.error("Can't warm start, no pin journal set!")
+        return ERR_INVALID_CONFIGURATION, adopted
+
+    journal = _load_journal()
+
+    for pin_number, entry in journal["gpio"].items():
+
+        try:
+
+            if not backend.is_exported(pin_number):
+                continue
+
+            direction = backend.read_direction(pin_number)
+            value = backend.read_value(pin_number) if direction == OUTPUT else None
+
+        except (OSError, IOError, ValueError, NotImplementedError) as e:
+
+            log.warning("Pin {} can't be re-adopted".format(pin_number))
+            log.debug("Verifying pin {} failed: {}".format(pin_number, e))
+            continue
+
+        if direction != entry.get("direction"):
+            log.warning("Pin {} direction changed to {} since the last run".format(pin_number, direction))
+
+        with _prepared_lock:
+            _prepared_pins[pin_number] = (backend, direction, value)
+
+        adopted.append(pin_number)
+
+    for key in journal["pwm"]:
+
+        chip, channel = [int(n) for n in key.split(":")]
+
+        try:
+
+            pwm_backend = pwm_backend or get_pwm_backend()
+
+            if not pwm_backend.is_exported(chip, channel):
+                continue
+
+        except (OSError, IOError) as e:
+
+            log.debug("Verifying PWM channel {} failed: {}".format(key, e))
+            continue
+
+        with _prepared_lock:
+            _prepared_channels[(chip, channel)] = pwm_backend
+
+        adopted.append((chip, channel))
+
+    # the journal now only holds the re-adopted pins
+    with _journal_lock:
+
+        _journal_loaded = True
+
+        _journal["gpio"] = dict((pin, journal["gpio"][pin]) for pin in adopted if pin in journal["gpio"])
+        _journal["pwm"] = dict((key, entry) for key, entry in journal["pwm"].items()
+                               if tuple(int(n) for n in key.split(":")) in adopted)
+
+    log.info("Re-adopted pins: {}".format(adopted))
+
+    return err_code, adopted
+
+
+# ------------------------------- PWM scheduler --------------------------------
+
+# PWM edge types
+_PERIOD_START = 0
+_FALLING_EDGE = 1
+
+# late period policies
+LATE_RECOVER = "recover"    # generate late periods back to back until the schedule is met again
+LATE_SKIP = "skip"          # drop periods whose deadline already passed, resume on the next one
+
+
+# scheduling state of a PWM pin
+class _PWMChannel(object):
+
+    def __init__(self, pin, pulses, late_policy):
+
+        self.pin = pin
+        self.active = True
+        self.late_policy = late_policy
+
+        # remaining periods (None: infinite)
+        self.remaining = pulses if pulses else None
+
+        # scheduled start and length of the current period
+        self.period_start = 0
+        self.period = 0
+
+        # measured write times of the current period edges
+        self._rise_time = None
+        self._fall_time = None
+        self._level = LOW
+
+        # edges written after the deadline of the following edge, skipped periods
+        self.overruns = 0
+        self.skipped_periods = 0
+
+        # measured periods
+        self._periods = 0
+        self._period_sum = 0.0
+        self._high_sum = 0.0
+
+        # jitter statistics (Welford running mean/variance)
+        self.edges = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._max = 0.0
+
+    def record_jitter(self, jitter):
+        """
+        Adds an edge's jitter to the running statistics
+        :param jitter: delay between edge deadline and pin write in seconds
+        :return: None
+        """
+        self.edges += 1
+
+        delta = jitter - self._mean
+        self._mean += delta / self.edges
+        self._m2 += delta * (jitter - self._mean)
+
+        if jitter > self._max:
+            self._max = jitter
+
+    def record_period_start(self, write_time, level):
+        """
+        Closes the measurement of the previous period when a new one starts
+        :param write_time: time the period start edge was written
+        :param level: level written at the period start
+        :return: None
+        """
+        if self._rise_time is not None:
+
+            period = write_time - self._rise_time
+
+            if self._fall_time is not None:
+                high = self._fall_time - self._rise_time
+            else:
+                high = period if self._level == HIGH else 0.0
+
+            self._periods += 1
+            self._period_sum += period
+            self._high_sum += high
+
+        self._rise_time = write_time
+        self._fall_time = None
+        self._level = level
+
+    def record_falling_edge(self, write_time):
+        self._fall_time = write_time
+
+    def restart_measurement(self):
+        """
+        Drops the current period measurement (periods were skipped)
+        :return: None
+        """
+        self._rise_time = None
+        self._fall_time = None
+
+    def stats(self):
+        """
+        :return: dict of timing statistics, times in seconds
+        """
+        return {
+                "edges": self.edges,
+                "mean_jitter": self._mean,
+                "stddev_jitter": (self._m2 / self.edges) ** 0.5 if self.edges else 0.0,
+                "max_jitter": self._max,
+                "overruns": self.overruns,
+                "skipped_periods": self.skipped_periods,
+                "periods": self._periods,
+                "frequency": self._periods / self._period_sum if self._period_sum else 0.0,
+                "duty_cycle": 100.0 * self._high_sum / self._period_sum if self._period_sum else 0.0
+        }
+
+
+# single thread software PWM generator
+class PWMScheduler(object):
+    """
+    Generates software PWM on any number of pins from one thread. The next edge of
+    each pin is kept in a heap ordered by its absolute deadline on the monotonic
+    clock, the thread sleeps until the earliest deadline, writes the edge and
+    schedules the pin's next edge from the previous deadline (never from the wake up
+    time), so write latency and sleep overshoot don't accumulate.
+    Periods that start late are handled by the channel's late policy: LATE_RECOVER
+    keeps every period and catches up, LATE_SKIP drops the periods that were missed
+    entirely. The thread is started by the first registered pin and exits once no
+    pins are left.
+    """
+
+    def __init__(self, late_policy=LATE_SKIP):
+
+        self._lock = thread.Lock()
+
+        # held while an edge is written, unregister waits on it
+        self._edge_lock = thread.Lock()
+
+        # heap of (deadline, sequence, channel, edge)
+        self._heap = list()
+        self._sequence = 0
+        self._channels = dict()
+        self._thread = None
+
+        self._late_policy = late_policy
+
+        # self-pipe used to interrupt the scheduler sleep
+        self._wake_r, self._wake_w = os.pipe()
+
+        for fd in (self._wake_r, self._wake_w):
+            set_nonblocking(fd)
+
+    # default late policy
+    def set_late_policy(self, late_policy):
+        """
+        Sets the late policy of pins registered without an explicit one
+        :param late_policy: LATE_RECOVER or LATE_SKIP
+        :return: error code
+        """
+        if late_policy not in (LATE_RECOVER, LATE_SKIP):
+            return ERR_INVALID_ARGUMENT
+
+        self._late_policy = late_policy
+
+        return SUCCESS
+
+    # add a pin to the scheduler
+    def register(self, pin, pulses=0, late_policy=None):
+        """
+        Starts generating PWM on a pin, the pin timing is read at every period start
+        through pin._pwm_timing()
+        :param pin: GPIO_Pin in PWM mode
+        :param pulses: number of periods to generate (0: infinite)
+        :param late_policy: LATE_RECOVER, LATE_SKIP or None for the scheduler default
+        :return: PWM channel of the pin
+        """
+        with self._lock:
+
+            channel = _PWMChannel(pin, pulses, late_policy or self._late_policy)
+
+            previous = self._channels.get(pin)
+            if previous is not None:
+                previous.active = False
+
+            self._channels[pin] = channel
+            self._push(channel, monotonic(), _PERIOD_START)
+
+            if self._thread is None:
+
+                self._thread = thread.Thread(target=self._run)
+                self._thread.setDaemon(True)
+                self._thread.setName("PWM_Scheduler")
+                self._thread.start()
+
+        self._wake()
+
+        return channel
+
+    # remove a pin from the scheduler
+    def unregister(self, pin):
+        """
+        Stops generating PWM on a pin, returns once an edge being written to the pin
+        has completed, the pin is left LOW (a stop in the high phase doesn't latch it)
+        :param pin: GPIO_Pin in PWM mode
+        :return: True if the pin was registered
+        """
+        with self._lock:
+
+            channel = self._channels.pop(pin, None)
+
+            if channel is not None:
+                channel.active = False
+
+        # wait for an in-flight edge, then end the period
+        with self._edge_lock:
+
+            if channel is not None:
+                pin.set_pin_value(LOW)
+
+        self._wake()
+
+        return channel is not None
+
+    # per pin timing statistics
+    def stats(self):
+        """
+        Timing statistics of every registered pin:
+            edges, mean_jitter, stddev_jitter, max_jitter : delay between edge deadlines
+                and pin writes
+            overruns : edges written after the deadline of the following edge
+            skipped_periods : periods dropped by the LATE_SKIP policy
+            periods, frequency, duty_cycle : measured from the edge write times
+        :return: {pin_number: statistics dict}
+        """
+        with self._lock:
+            channels = list(self._channels.values())
+
+        return dict((channel.pin._pin_number, channel.stats()) for channel in channels)
+
+    # scheduler thread
+    def _run(self):
+
+        while True:
+
+            with self._lock:
+
+                # drop edges of unregistered pins
+                while self._heap and not self._heap[0][2].active:
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._thread = None
+                    return 0
+
+                deadline, _, channel, edge = self._heap[0]
+                delay = deadline - monotonic()
+
+                if delay <= 0:
+                    heapq.heappop(self._heap)
+
+            if delay > 0:
+                self._sleep(delay)
+                continue
+
+            with self._edge_lock:
+
+                if channel.active:
+                    self._fire(channel, edge, deadline)
+
+    # write an edge and schedule the next one
+    def _fire(self, channel, edge, deadline):
+
+        if edge == _PERIOD_START:
+
+            t_up, t_dwn = channel.pin._pwm_timing()
+            period = t_up + t_dwn
+
+            # drop the periods that were missed entirely
+            if channel.late_policy == LATE_SKIP and period > 0:
+
+                missed = int((monotonic() - deadline) / period)
+
+                if missed > 0:
+                    deadline += missed * period
+                    channel.skipped_periods += missed
+                    channel.restart_measurement()
+
+            # number of periods done
+            if channel.remaining is not None:
+
+                if channel.remaining == 0:
+                    self._finish(channel)
+                    return
+
+                channel.remaining -= 1
+
+            channel.period_start = deadline
+            channel.period = period
+
+            level = HIGH if t_up > 0 else LOW
+            channel.pin.set_pin_value(level)
+            written = monotonic()
+
+            channel.record_period_start(written, level)
+
+            # a falling edge is needed only if the pin is not high/low for the whole period
+            if t_up > 0 and t_dwn > 0:
+                next_edge, next_deadline = _FALLING_EDGE, deadline + t_up
+            else:
+                next_edge, next_deadline = _PERIOD_START, deadline + period
+
+        else:
+
+            channel.pin.set_pin_value(LOW)
+            written = monotonic()
+
+            channel.record_falling_edge(written)
+            next_edge, next_deadline = _PERIOD_START, channel.period_start + channel.period
+
+        channel.record_jitter(written - deadline)
+
+        if written > next_deadline:
+            channel.overruns += 1
+
+        with self._lock:
+
+            if channel.active:
+                self._push(channel, next_deadline, next_edge)
+
+    # all pulses were generated
+    def _finish(self, channel):
+
+        channel.pin.set_pin_value(LOW)
+
+        with self._lock:
+
+            if self._channels.get(channel.pin) is channel:
+                del self._channels[channel.pin]
+
+            channel.active = False
+
+        channel.pin._pwm_on = False
+
+    def _push(self, channel, deadline, edge):
+        self._sequence += 1
+        heapq.heappush(self._heap, (deadline, self._sequence, channel, edge))
+
+    def _sleep(self, delay):
+
+        readable, _, _ = select.select([self._wake_r], [], [], delay)
+
+        if readable:
+
+            try:
+                os.read(self._wake_r, 64)
+            except OSError:
+                pass
+
+    def _wake(self):
+
+        try:
+            os.write(self._wake_w, b"x")
+        except OSError:
+            pass
+
+
+_pwm_scheduler = None
+_pwm_scheduler_lock = thread.Lock()
+
+
+# get the shared PWM scheduler
+def get_pwm_scheduler():
+    """
+    :return: PWMScheduler shared by all PWM pins
+    """
+    global _pwm_scheduler
+
+    with _pwm_scheduler_lock:
+
+        if _pwm_scheduler is None:
+            _pwm_scheduler = PWMScheduler()
+
+    return _pwm_scheduler
+
+
+# ------------------------------ Event detection -------------------------------
+
+# edge event callback/queue of an input pin
+class _EventHandler(object):
+
+    def __init__(self, pin, callback, queue, bouncetime):
+
+        self.pin = pin
+        self.callback = callback
+        self.queue = queue
+        self.bouncetime = bouncetime / 1000.0
+
+        self.events = 0
+        self.bounces = 0
+        self._last_event = None
+
+    def dispatch(self, value, timestamp):
+        """
+        Hands an edge event to the callback/queue, drops it if it comes within
+        bouncetime of the previous accepted event
+        :param value: pin level after the edge
+        :param timestamp: monotonic time of the edge
+        :return: None
+        """
+        if self._last_event is not None and (timestamp - self._last_event) < self.bouncetime:
+            self.bounces += 1
+            return
+
+        self._last_event = timestamp
+        self.events += 1
+
+        event = (self.pin._pin_number, value, timestamp)
+
+        if self.queue is not None:
+            self.queue.put(event)
+
+        if self.callback is not None:
+
+            try:
+                self.callback(*event)
+            except Exception as e:
+                log.error("Event callback of pin {} failed: {}".format(self.pin._pin_number, e))
+
+
+# single thread edge event dispatcher
+class EventDispatcher(object):
+    """
+    Services edge events of any number of input pins from one thread. All pins are
+    watched by a single edge waiter (one epoll set on sysfs), every event is handed
+    to the pin's callback (called from the dispatcher thread, keep it short) and/or
+    put in its queue as a (pin_number, value, timestamp) tuple. The thread is started
+    by the first registered pin, removing the last pin waits for it to exit.
+    """
+
+    def __init__(self, backend):
+
+        self._backend = backend
+        self._lock = thread.Lock()
+        self._handlers = dict()
+        self._waiter = None
+        self._thread = None
+
+    # register an input pin
+    def add(self, pin, edge, callback=None, bouncetime=0, queue=None):
+        """
+        Starts dispatching edge events of a pin
+        :param pin: GPIO_Pin configured as input
+        :param edge: RISING, FALLING or BOTH
+        :param callback: called with (pin_number, value, timestamp) on every edge
+        :param bouncetime: edges within bouncetime milliseconds of the previous edge are dropped
+        :param queue: Queue that receives (pin_number, value, timestamp) tuples
+        :return: error code
+        """
+        if edge not in (RISING, FALLING, BOTH) or bouncetime < 0 or (callback is None and queue is None):
+
+            log.error("Failed to add event detection to pin {}".format(pin._pin_number))
+            log.debug("Invalid edge {}, bouncetime {} or no callback/queue".format(edge, bouncetime))
+            return ERR_INVALID_ARGUMENT
+
+        # the dispatcher waiter gets the edges, no per-pin queue
+        err_code = pin.set_pin_edge(edge, watch=False)
+
+        if err_code != SUCCESS:
+            return err_code
+
+        with self._lock:
+
+            try:
+
+                if self._waiter is None:
+                    self._waiter = self._backend.edge_waiter()
+
+                self._waiter.add(pin._pin_number)
+
+            except (OSError, IOError) as e:
+
+                log.error("Failed to add event detection to pin {}".format(pin._pin_number))
+                log.debug("Watching pin {} failed: {}".format(pin._pin_number, e))
+                return ERR_ERROR
+
+            self._handlers[pin._pin_number] = _EventHandler(pin, callback, queue, bouncetime)
+            pin._event_detect = True
+
+            if self._thread is None:
+
+                self._thread = thread.Thread(target=self._run, args=(self._waiter,))
+                self._thread.setDaemon(True)
+                self._thread.setName("GPIO_Event_Dispatcher")
+                self._thread.start()
+
+            waiter = self._waiter
+
+        waiter.interrupt()
+
+        return SUCCESS
+
+    # unregister an input pin
+    def remove(self, pin):
+        """
+        Stops dispatching edge events of a pin, once the last pin is removed the
+        dispatcher thread has exited (unless called from a callback)
+        :param pin: GPIO_Pin
+        :return: error code
+        """
+        worker = None
+
+        with self._lock:
+
+            handler = self._handlers.pop(pin._pin_number, None)
+
+            if handler is None:
+                return ERR_INVALID_CONFIGURATION
+
+            pin._event_detect = False
+
+            waiter = self._waiter
+            waiter.remove(pin._pin_number)
+
+            # last pin, the thread closes its waiter and exits, a later add starts anew
+            if not self._handlers:
+
+                worker = self._thread
+                self._waiter = None
+                self._thread = None
+
+            waiter.interrupt()
+
+        # outside the lock, the thread takes it once more on its way out
+        if worker is not None and worker is not thread.current_thread():
+            worker.join()
+
+        return SUCCESS
+
+    # per pin event counters
+    def stats(self):
+        """
+        :return: {pin_number: {"events": dispatched events, "bounces": dropped events}}
+        """
+        with self._lock:
+            handlers = list(self._handlers.items())
+
+        return dict((number, {"events": h.events, "bounces": h.bounces}) for number, h in handlers)
+
+    # dispatcher thread
+    def _run(self, waiter):
+
+        while True:
+
+            # the last pin was removed, the waiter isn't the dispatcher's any more
+            with self._lock:
+
+                if self._waiter is not waiter:
+
+                    waiter.close()
+                    return 0
+
+            for pin_number, value, timestamp in waiter.wait():
+
+                handler = self._handlers.get(pin_number)
+
+                if handler is not None:
+                    handler.dispatch(value, timestamp)
+
+
+_event_dispatchers = dict()
+_event_dispatchers_lock = thread.Lock()
+
+
+# get the event dispatcher of a backend
+def get_event_dispatcher(backend=None):
+    """
+    :param backend: GPIO backend (default backend if None)
+    :return: EventDispatcher shared by all pins of the backend
+    """
+    backend = backend or _backend
+
+    with _event_dispatchers_lock:
+
+        dispatcher = _event_dispatchers.get(backend)
+
+        if dispatcher is None:
+            dispatcher = _event_dispatchers[backend] = EventDispatcher(backend)
+
+    return dispatcher
+
+
+# call a function/fill a queue on input pin edges
+def add_event_detect(pin, edge, callback=None, bouncetime=0, queue=None):
+    """
+    Dispatches edge events of an input pin to a callback and/or a queue, all pins are
+    serviced by one thread (see EventDispatcher)
+    :param pin: GPIO_Pin configured as input
+    :param edge: RISING, FALLING or BOTH
+    :param callback: called with (pin_number, value, timestamp) on every edge
+    :param bouncetime: edges within bouncetime milliseconds of the previous edge are dropped
+    :param queue: Queue that receives (pin_number, value, timestamp) tuples
+    :return: error code
+    """
+    return get_event_dispatcher(pin._backend).add(pin, edge, callback, bouncetime, queue)
+
+
+# stop edge event dispatching of an input pin
+def remove_event_detect(pin):
+    """
+    :param pin: GPIO_Pin passed to add_event_detect before
+    :return: error code
+    """
+    return get_event_dispatcher(pin._backend).remove(pin)
 
 
 # -------------------------------- GPIO pin class ------------------------------
 class GPIO_Pin(object):
 
     # GPIO Pin attributes
-    def __init__(self, pin_number, mode):
+    def __init__(self, pin_number, mode, backend=None):
 
         self._pin_number = pin_number
-        self._gpio_pin_class_dir = os.path.join(_GPIO_CLASS_DIR, "gpio" + str(pin_number))
-        self._gpio_pin_direction_dir = os.path.join(self._gpio_pin_class_dir, "direction")
-        self._gpio_pin_value_dir = os.path.join(self._gpio_pin_class_dir, "value")
+        self._backend = backend or _backend
 
         self._direction = OUTPUT
         self._last_state = 0
         self._mode = mode
+
+        # write-through cache of the pin state, a write that wouldn't change the cached
+        # direction/value is elided. None: unknown, the next write goes to the backend
+        self._exported = False
+        self._cached_direction = None
+        self._cached_value = None
+
+        self._writes_issued = 0
+        self._writes_elided = 0
+
+        with _counters_lock:
+            _counted_pins.add(self)
+
+        # edge detection (input pins)
+        self._edge = NONE
+        self._edge_waiter = None
+        self._pending_edges = deque()
+        self._event_detect = False
+
         self._init_gpio_pin()
 
         self._pwm_duty = 0
         self._frequency = 1
         self._pwm_on = False
         self._pwm_handler = None
-        self.__t_up = 0
-        self.__t_dwn = 0
+
+        # (t_up, t_down) of a PWM period, replaced as a whole so the scheduler never
+        # reads the high time of one duty cycle with the low time of another
+        self.__timing = (0, 0)
 
     # Add pin instance to /sys/class/gpio
     def _init_gpio_pin(self):
@@ -115,23 +1199,52 @@ class GPIO_Pin(object):
         # error code
         err_code = SUCCESS
 
+        prepared = _claim_prepared(self._pin_number, self._backend)
+
+        # pin was already brought up by export_pins, adopt its configuration
+        if prepared is not None:
+
+            self._exported = True
+            self._direction, value = prepared
+            self._cached_direction = self._direction
+
+            if value is not None:
+                self._last_state = self._cached_value = value
+
+            log.info("Pin {} adopted!".format(self._pin_number))
+            self._journal()
+
+            if self._mode == PWM:
+                self.set_pin_direction(OUTPUT)
+
         # check if pin is available
-        if self.is_available(self._pin_number):
+        elif self.is_available(self._pin_number):
 
-            _, used = self.is_used(self._pin_number)
+            used = self._backend.is_exported(self._pin_number)
+            self._exported = used
 
             # if pin is not used before
             if not used:
 
-                # export pin
-                if os.system("echo \"{}\" > {}".format(self._pin_number, _GPIO_EXPORT_DIR)):
+                # export pin, then wait for udev to make its attributes writable
+                try:
+                    self._backend.export(self._pin_number)
+                    self._backend.wait_exported([self._pin_number])
+
+                except (OSError, IOError) as e:
 
                     log.error("Failed to inistantiate pin {}.".format(self._pin_number))
+                    log.debug("Export of pin {} failed: {}".format(self._pin_number, e))
                     err_code = ERR_ERROR
 
+                    # exported but not ready in time, deinit_pin can still release it
+                    self._exported = self._backend.is_exported(self._pin_number)
+
                 else:
 
                     log.info("Pin {} inistance created!".format(self._pin_number))
+                    self._exported = True
+                    self._journal()
 
                     # if this pin is used as a PWM pin, set it as output
                     if self._mode == PWM:
@@ -163,16 +1276,28 @@ class GPIO_Pin(object):
         err_code = SUCCESS
 
         # if current gpio pin is already configured
-        if self.is_used(self._pin_number):
+        if self._exported:
 
             # check if pin was output/high
             if self._direction == OUTPUT and self._last_state == HIGH:
                 self.set_pin_value(LOW)
 
+            # release edge detection file descriptors
+            if self._event_detect:
+                remove_event_detect(self)
+
+            if self._edge_waiter is not None:
+                self._edge_waiter.close()
+                self._edge_waiter = None
+
             # unexport pin
-            if os.system("echo {} > {}".format(str(self._pin_number), _GPIO_UNEXPORT_DIR)):
+            try:
+                self._backend.unexport(self._pin_number)
+
+            except (OSError, IOError) as e:
 
                 log.error("Failed to deconfigure pin {}".format(self._pin_number))
+                log.debug("Unexport of pin {} failed: {}".format(self._pin_number, e))
                 err_code = ERR_ERROR
 
             # if unexport failed
@@ -180,6 +1305,17 @@ class GPIO_Pin(object):
 
                 log.info("Deconfigured pin {}".format(self._pin_number))
 
+                self._exported = False
+                self.invalidate()
+                _journal_update("gpio", self._pin_number, None)
+
+                # keep the pin writes in the module counters
+                with _counters_lock:
+
+                    _counted_pins.discard(self)
+                    _retired_writes[0] += self._writes_issued
+                    _retired_writes[1] += self._writes_elided
+
         # if current gpio pin is not used
         else:
 
@@ -199,7 +1335,7 @@ class GPIO_Pin(object):
         err_code = SUCCESS
 
         # check if pin is initialized
-        if self.is_used(self._pin_number):
+        if self._exported:
 
             # check if direction is valid
             if direction in (INPUT, OUTPUT):
@@ -208,7 +1344,7 @@ class GPIO_Pin(object):
                 if self._mode == GPIO:
 
                     # set pin direction
-                    if os.system("echo \"{}\" > {}".format(direction, self._gpio_pin_direction_dir)):
+                    if self._write_direction(direction):
 
                         log.error("Failed to set pin {} direction to {}".format(self._pin_number, direction))
                         log.debug("Failed to set pin {} direction!".format(self._pin_number))
@@ -222,7 +1358,7 @@ class GPIO_Pin(object):
                 # if pin is used for PWM
                 elif self._mode == PWM:
 
-                    if os.system("echo \"{}\" > {}".format(OUTPUT, self._gpio_pin_direction_dir)):
+                    if self._write_direction(OUTPUT):
 
                         log.error("Failed to set pin {} direction to {}".format(self._pin_number, OUTPUT))
                         log.debug("Failed to set pin {} direction!".format(self._pin_number))
@@ -248,98 +1384,350 @@ class GPIO_Pin(object):
         # if pin was not initialized before
         else:
 
-            log.error("Failed to set pin {} direction to {}".format(self._pin_number, direction))
-            log.debug("No instance for pin {} in /sys/class/gpio!".format(self._pin_number))
-            err_code = ERR_INVALID_CONFIGURATION
+            log.error("Failed to set pin {} direction to {}".format(self._pin_number, direction))
+            log.debug("No instance for pin {} in /sys/class/gpio!".format(self._pin_number))
+            err_code = ERR_INVALID_CONFIGURATION
+
+        return err_code
+
+    # set pin value
+    def set_pin_value(self, value):
+        """
+        Sets pin value, by writing to /sys/class/gpio/gpio${pin_num}/value
+        :param direction: Pin value HIGHor LOW
+        :return: error code to indicate it the pin was configured successfully or not
+        :param value:
+        :return:
+        """
+
+        err_code = SUCCESS
+
+        # check if pin is initialized
+        if self._exported:
+
+            # check if direction is valid
+            if value in (HIGH, LOW):
+
+                # set pin value
+                if self._write_value(value):
+
+                    log.error("Couldn't set pin {} value to {}!".format(self._pin_number, value))
+                    log.debug("Failed to set pin {} value!".format(self._pin_number))
+                    err_code = ERR_ERROR
+
+                else:
+
+                    log.debug("Pin {} value set to: {}".format(self._pin_number, value))
+                    self._last_state = value
+
+            # if pin direction is invalid
+            else:
+
+                log.error("Couldn't set pin {} value to {}!".format(self._pin_number, value))
+                log.debug("Invalid value ({}) for pin {}".format(value, self._pin_number))
+                err_code = ERR_INVALID_ARGUMENT
+
+        # if pin was not initialized before
+        else:
+
+            log.error("Couldn't set pin {} value to {}!".format(self._pin_number, value))
+            log.debug("No instance for pin {} in /sys/class/gpio!".format(self._pin_number))
+            err_code = ERR_INVALID_CONFIGURATION
+
+        return err_code
+
+    # get pin value
+    def get_pin_value(self):
+        """
+        Checks pin value, by reading /sys/class/gpio/gpio${bin_num}/value
+        :return: (err_code, value)
+        """
+
+        err_code = SUCCESS
+        pin_state = LOW
+
+        # check if pin is initialized
+        if self._exported:
+
+            # check pin direction
+            if self._direction == OUTPUT:
+
+                pin_state = self._last_state
+
+            else:
+
+                try:
+
+                    pin_state = self._backend.read_value(self._pin_number)
+                    self._last_state = pin_state
+
+                except (OSError, IOError, ValueError) as e:
+
+                    log.error("Couldn't read pin {}".format(self._pin_number))
+                    log.debug("Reading pin {} value failed: {}".format(self._pin_number, e))
+                    err_code = ERR_ERROR
+
+        # if pin was not initialized before
+        else:
+
+            log.error("Couldn't read pin {}".format(self._pin_number))
+            log.debug("No instance for pin {} in /sys/class/gpio!".format(self._pin_number))
+            err_code = ERR_INVALID_CONFIGURATION
+
+        return err_code, pin_state
+
+    # write pin direction through the backend
+    def _write_direction(self, direction):
+        """
+        Writes the pin direction through the pin backend, unless the cached direction
+        is already the same
+        :param direction: INPUT or OUTPUT
+        :return: error code, SUCCESS if the direction was written (or elided)
+        """
+        err_code = SUCCESS
+
+        # direction didn't change
+        if self._cached_direction == direction:
+
+            self._writes_elided += 1
+            return err_code
+
+        # the value of a pin changing direction is unknown
+        self._cached_value = None
+
+        try:
+
+            self._writes_issued += 1
+            self._backend.write_direction(self._pin_number, direction)
+            self._cached_direction = direction
+            self._journal()
+
+        except (OSError, IOError) as e:
+
+            log.debug("Writing pin {} direction failed: {}".format(self._pin_number, e))
+            self._cached_direction = None
+            err_code = ERR_ERROR
+
+        return err_code
+
+    # write pin value through the backend
+    def _write_value(self, value):
+        """
+        Writes the pin value through the pin backend, unless the cached value is
+        already the same
+        :param value: HIGH or LOW
+        :return: error code, SUCCESS if the value was written (or elided)
+        """
+        err_code = SUCCESS
+
+        # value didn't change
+        if self._cached_value == value:
+
+            self._writes_elided += 1
+            return err_code
+
+        try:
+
+            self._writes_issued += 1
+            self._backend.write_value(self._pin_number, value)
+            self._cached_value = value
+
+        except (OSError, IOError) as e:
+
+            log.debug("Writing pin {} value failed: {}".format(self._pin_number, e))
+            self._cached_value = None
+            err_code = ERR_ERROR
+
+        return err_code
+
+    # record the pin in the pin journal
+    def _journal(self):
+        _journal_update("gpio", self._pin_number, dict(mode=self._mode, direction=self._cached_direction))
+
+    # drop the cached pin state
+    def invalidate(self):
+        """
+        Forgets the cached direction and value, the next writes go to the backend.
+        Use it when the pin may have been changed outside this instance.
+        :return: None
+        """
+        self._cached_direction = None
+        self._cached_value = None
+
+    # reload the cached pin state from the backend
+    def resync(self):
+        """
+        Re-reads export status, direction and value of the pin from the backend
+        :return: error code, SUCCESS if the pin state was read
+        """
+        err_code = SUCCESS
+
+        self.invalidate()
+
+        try:
+
+            self._exported = self._backend.is_exported(self._pin_number)
+
+            if self._exported:
+
+                self._cached_direction = self._backend.read_direction(self._pin_number)
+                self._direction = self._cached_direction
+
+                self._last_state = self._backend.read_value(self._pin_number)
+
+                # inputs are read every time, only output values are cached
+                if self._direction == OUTPUT:
+                    self._cached_value = self._last_state
+
+        except (OSError, IOError, ValueError, NotImplementedError) as e:
+
+            log.error("Couldn't resync pin {}".format(self._pin_number))
+            log.debug("Reading pin {} state failed: {}".format(self._pin_number, e))
+            self.invalidate()
+            err_code = ERR_ERROR
 
         return err_code
 
-    # set pin value
-    def set_pin_value(self, value):
+    # backend write counters of the pin
+    def write_stats(self):
         """
-        Sets pin value, by writing to /sys/class/gpio/gpio${pin_num}/value
-        :param direction: Pin value HIGHor LOW
-        :return: error code to indicate it the pin was configured successfully or not
-        :param value:
-        :return:
+        :return: dict(issued, elided), direction/value writes issued to the backend and
+        elided by the pin state cache
         """
+        return dict(issued=self._writes_issued, elided=self._writes_elided)
 
+    # set pin edge detection
+    def set_pin_edge(self, edge, watch=True):
+        """
+        Configures the edges reported by wait_for_edge, by writing to
+        /sys/class/gpio/gpio${pin_num}/edge
+        :param edge: NONE, RISING, FALLING or BOTH
+        :param watch: queue the edges for wait_for_edge from now on, False if they are
+        consumed elsewhere (EventDispatcher), wait_for_edge then starts watching on its
+        first call
+        :return: error code to indicate it the pin was configured successfully or not
+        """
         err_code = SUCCESS
 
         # check if pin is initialized
-        if self.is_used(self._pin_number):
+        if self._exported:
 
-            # check if direction is valid
-            if value in (HIGH, LOW):
+            # check if edge is valid
+            if edge in (NONE, RISING, FALLING, BOTH):
 
-                # set pin direction
-                if os.system("echo \"{}\" > {}".format(value, self._gpio_pin_value_dir)):
+                try:
 
-                    log.error("Couldn't set pin {} value to {}!".format(self._pin_number, value))
-                    log.debug("Failed to set pin {} value!".format(self._pin_number))
+                    self._backend.write_edge(self._pin_number, edge)
+                    self._edge = edge
+
+                    # start watching the pin right away, edges are queued from now on
+                    if watch and edge != NONE and self._edge_waiter is None:
+                        self._edge_waiter = self._backend.edge_waiter([self._pin_number])
+
+                    log.info("Pin {} edge set to: {}".format(self._pin_number, edge))
+
+                except (OSError, IOError) as e:
+
+                    log.error("Failed to set pin {} edge to {}".format(self._pin_number, edge))
+                    log.debug("Writing pin {} edge failed: {}".format(self._pin_number, e))
                     err_code = ERR_ERROR
 
-                else:
+                except NotImplementedError:
 
-                    log.debug("Pin {} value set to: {}".format(self._pin_number, value))
-                    self._last_state = value
+                    log.error("Failed to set pin {} edge to {}".format(self._pin_number, edge))
+                    log.debug("GPIO backend {} has no edge detection".format(self._backend.name))
+                    err_code = ERR_INVALID_CONFIGURATION
 
-            # if pin direction is invalid
+            # if edge is invalid
             else:
 
-                log.error("Couldn't set pin {} value to {}!".format(self._pin_number, value))
-                log.debug("Invalid value ({}) for pin {}".format(value, self._pin_number))
+                log.error("Failed to set pin {} edge to {}".format(self._pin_number, edge))
+                log.debug("Invalid edge ({}) for pin {}".format(edge, self._pin_number))
                 err_code = ERR_INVALID_ARGUMENT
 
         # if pin was not initialized before
         else:
 
-            log.error("Couldn't set pin {} value to {}!".format(self._pin_number, value))
+            log.error("Failed to set pin {} edge to {}".format(self._pin_number, edge))
             log.debug("No instance for pin {} in /sys/class/gpio!".format(self._pin_number))
             err_code = ERR_INVALID_CONFIGURATION
 
         return err_code
 
-    # get pin value
-    def get_pin_value(self):
+    # block until an edge occurs on the pin
+    def wait_for_edge(self, timeout=None):
         """
-        Checks pin value, by reading /sys/class/gpio/gpio${bin_num}/value
-        :return: (err_code, value)
+        Waits for an edge (configured with set_pin_edge) without polling the pin value,
+        the thread sleeps in epoll until the kernel reports the edge
+        :param timeout: seconds to wait (None: wait forever)
+        :return: (err_code, timestamp, value), timestamp is the monotonic time
+        (micro_sleep.monotonic) the edge was detected at, value is the pin level after
+        the edge. err_code is ERR_TIMEOUT if no edge occurred within the timeout
         """
-
         err_code = SUCCESS
-        pin_state = LOW
+        timestamp = None
+        value = self._last_state
 
-        # check if pin is initialized
-        if self.is_used(self._pin_number):
+        # check if edge detection was configured
+        if self._edge != NONE:
 
-            # check pin direction
-            if self._direction == OUTPUT:
+            try:
 
-                pin_state = self._last_state
+                # edges consumed elsewhere until now, watch the pin from here on
+                if self._edge_waiter is None:
+                    self._edge_waiter = self._backend.edge_waiter([self._pin_number])
 
-            else:
+                if not self._pending_edges:
+                    self._pending_edges.extend(self._edge_waiter.wait(timeout))
 
-                pin_state = int(open(self._gpio_pin_value_dir, "r").read().strip())
-                self._last_state = pin_state
+                if self._pending_edges:
 
-        # if pin was not initialized before
+                    _, value, timestamp = self._pending_edges.popleft()
+                    self._last_state = value
+
+                else:
+
+                    err_code = ERR_TIMEOUT
+
+            except (OSError, IOError) as e:
+
+                log.error("Failed to wait for an edge on pin {}".format(self._pin_number))
+                log.debug("Edge wait on pin {} failed: {}".format(self._pin_number, e))
+                err_code = ERR_ERROR
+
+        # if edge detection is off
         else:
 
-            log.error("Couldn't read pin {}".format(self._pin_number))
-            log.debug("No instance for pin {} in /sys/class/gpio!".format(self._pin_number))
+            log.error("Failed to wait for an edge on pin {}".format(self._pin_number))
+            log.debug("Edge detection is not configured for pin {}".format(self._pin_number))
             err_code = ERR_INVALID_CONFIGURATION
 
-        return err_code, pin_state
+        return err_code, timestamp, value
+
+    # drop edges that occurred before
+    def flush_edges(self):
+        """
+        Discards edges that were detected but not consumed by wait_for_edge yet, call
+        it before starting an operation whose edges are waited for
+        :return: 0
+        """
+        self._pending_edges.clear()
+
+        if self._edge_waiter is not None:
+            self._edge_waiter.flush()
+
+        return 0
 
     # generate PWM signal on the pin
-    def pwm_generate(self, frequency, duty_cycle, pulses=0):
+    def pwm_generate(self, frequency, duty_cycle, pulses=0, late_policy=None):
         """
         Generates PWM signal with the given frequency, duty cycle for the given
         number of pulses
         :param frequency: Frequency of the PWM
         :param duty_cycle: Duty cycle of the PWM in % [0:100]
         :param pulses: Numbe rof pulses to generate (0: means infinite)
+        :param late_policy: What to do with periods that started late (LATE_RECOVER,
+        LATE_SKIP), None uses the scheduler's default policy
         :return: error code that indicates if the PWM signal was generated successfully
         """
         err_code = SUCCESS
@@ -348,25 +1736,22 @@ class GPIO_Pin(object):
         if self._mode == PWM:
 
             # check if frequency and duty cycle are valid numbers
-            if (frequency > 0) and (0 <= duty_cycle <= 100):
+            if (frequency > 0) and (0 <= duty_cycle <= 100) and late_policy in (None, LATE_RECOVER, LATE_SKIP):
 
                 self._frequency = frequency
                 self._pwm_duty = duty_cycle
 
                 # PWM time calculations
                 t_total = 1.0 / frequency
-                self.__t_up = duty_cycle * t_total / 100
-                self.__t_dwn = t_total - self.__t_up
+                t_up = duty_cycle * t_total / 100
+                self.__timing = (t_up, t_total - t_up)
 
                 # if no pwm signal on this pin
                 if not self._pwm_on:
 
-                    # PWM thread
+                    # register pin in the shared PWM scheduler
                     self._pwm_on = True
-                    self._pwm_handler = thread.Thread(target=self.__gen_pwm__, args=(pulses,))
-                    self._pwm_handler.setDaemon(True)
-                    self._pwm_handler.setName("Pin{}_PWM_Thread".format(self._pin_number))
-                    self._pwm_handler.start()
+                    self._pwm_handler = get_pwm_scheduler().register(self, pulses, late_policy)
 
                     log.debug(
                             "Satrted PWM on pin: {} with frequency: {} and duty cycle: {}".format(self._pin_number,
@@ -382,8 +1767,8 @@ class GPIO_Pin(object):
             else:
 
                 log.critical("Failed to generate PWM for pin {}".format(self._pin_number))
-                log.debug("Invalid frequency {} or duty cycle {} values for pin {}".format(frequency, duty_cycle,
-                                                                                           self._pin_number))
+                log.debug("Invalid frequency {}, duty cycle {} or late policy {} for pin {}".format(
+                        frequency, duty_cycle, late_policy, self._pin_number))
                 err_code = ERR_INVALID_ARGUMENT
 
         # if pin mode in not PWM
@@ -407,13 +1792,14 @@ class GPIO_Pin(object):
 
         if duty_cycle:
 
-            self.__t_up = duty_cycle * total_time / 100
-            self.__t_dwn = total_time - self.__t_up
+            t_up = duty_cycle * total_time / 100
+            self.__timing = (t_up, total_time - t_up)
 
         else:
 
-            self.__t_up = 0
-            self.__t_dwn = total_time
+            self.__timing = (0, total_time)
+
+        self._pwm_duty = duty_cycle
 
         return 0
 
@@ -434,11 +1820,10 @@ class GPIO_Pin(object):
                 # clear PWM flag False (reset)
                 self._pwm_on = False
 
-                # wait till pwm thread returns
-                while self._pwm_handler.is_alive():
-                    pass
+                # remove pin from the scheduler, returns after any in-flight edge was written
+                get_pwm_scheduler().unregister(self)
 
-                # set thread handler to None
+                # set PWM channel handler to None
                 self._pwm_handler = None
 
             else:
@@ -456,72 +1841,23 @@ class GPIO_Pin(object):
 
         return err_code
 
-    # private method for PWM generation
-    def __gen_pwm__(self, pulses):
+    # PWM timing used by the scheduler
+    def _pwm_timing(self):
         """
-        A private function that handles PWM generation on the pin
-        :param pulses: number of pulses to generate
-        :return: 0
+        :return: (t_up, t_down) of the current PWM period in seconds
         """
-        # number of PWM pulses > 0
-        if pulses:
-
-            while pulses:
-
-                # if up_time > 0
-                if 0 < self.__t_up < 100:
+        return self.__timing
 
-                    # set pin high for __t_up time
-                    self.set_pin_value(HIGH)
-                    time.sleep(self.__t_up)
-
-                    # set pin low for __t_down time
-                    self.set_pin_value(LOW)
-                    time.sleep(self.__t_dwn)
-
-                elif self.__t_up == 100:
-
-                    self.set_pin_value(HIGH)
-                    time.sleep(self.__t_up+self.__t_dwn)
-
-                # if up_time == 0
-                elif self.__t_up == 0:
-
-                    self.set_pin_value(LOW)
-                    time.sleep(self.__t_up + self.__t_dwn)
-
-                # decrement number of remaining pulses
-                pulses -= 1
-
-        # if number of PWM pulses is 0 
-        else:
-
-            # while pwm_on flag is True (set)
-            while self._pwm_on:
-
-                # if up_time > 0
-                if 0 < self.__t_up < 100:
-
-                    # set pin high for __t_up time
-                    self.set_pin_value(HIGH)
-                    time.sleep(self.__t_up)
-
-                    # set pin low for __t_down time
-                    self.set_pin_value(LOW)
-                    time.sleep(self.__t_dwn)
-
-                elif self.__t_up == 100:
-
-                    self.set_pin_value(HIGH)
-                    time.sleep(self.__t_dwn + self.__t_up)
-
-                # if up_time == 0
-                elif self.__t_up == 0:
-
-                    self.set_pin_value(LOW)
-                    time.sleep(self.__t_dwn + self.__t_up)
+    # PWM timing statistics
+    def pwm_stats(self):
+        """
+        Timing statistics of the running PWM signal, see PWMScheduler.stats
+        :return: dict of statistics, None if no PWM signal is running on the pin
+        """
+        if self._pwm_handler is None:
+            return None
 
-        return 0
+        return self._pwm_handler.stats()
 
     # check if pin is available in the board
     @staticmethod
@@ -538,7 +1874,8 @@ class GPIO_Pin(object):
     def is_used(pin_number):
         """
         Checks if the given GPIO Pin is already used (configured) by checking if
-        /sys/class/gpio/gpio${pin_number} exists
+        /sys/class/gpio/gpio${pin_number} exists (exported in the default backend).
+        Pins brought up by export_pins() are free until a GPIO_Pin claims them.
         :param pin_number:
         :return: (err_code, Boolean)
         error code indicates if the function was run successfully or not
@@ -552,7 +1889,7 @@ class GPIO_Pin(object):
         if _AVAILABLE_GPIO.get(pin_number, None):
 
             # check if pin is used
-            used = os.path.exists(os.path.join(_GPIO_CLASS_DIR, "gpio" + str(pin_number)))
+            used = _backend.is_exported(pin_number) and pin_number not in _prepared_pins
 
         # if pin is invalid
         else:
@@ -562,6 +1899,393 @@ class GPIO_Pin(object):
 
         return (err_code, used)
 
+
+# ------------------------------ Pin group class -------------------------------
+class PinGroup(object):
+    """
+    Output pins written together as one batch, memory mapped backends change all the
+    pins with one set and one clear register store, other backends write the pins back
+    to back. Pins whose cached value is already right are left out of the batch. The
+    skew (time between the first and the last pin change) of every batch is measured.
+    """
+
+    def __init__(self, pins):
+        """
+        :param pins: GPIO_Pin instances, all using the same backend
+        """
+        self._pins = dict((pin._pin_number, pin) for pin in pins)
+        self._backend = pins[0]._backend if pins else _backend
+
+        self._batches = 0
+        self._total_skew = 0.0
+        self._max_skew = 0.0
+        self._last_skew = 0.0
+
+    # one group of the pins of several groups
+    @classmethod
+    def union(cls, groups):
+        """
+        :param groups: PinGroup instances, all using the same backend
+        :return: PinGroup of all their pins, written as one batch
+        """
+        return cls([pin for group in groups for pin in group._pins.values()])
+
+    @property
+    def pins(self):
+        """pin numbers of the group"""
+        return sorted(self._pins)
+
+    @property
+    def last_skew(self):
+        """skew of the latest batch in seconds"""
+        return self._last_skew
+
+    # write the values of several pins in one batch
+    def write(self, values):
+        """
+        Writes the given pin values as one batch
+        :param values: {GPIO_Pin or pin number: HIGH or LOW}, pins that aren't in the
+        dict keep their current value
+        :return: error code, SUCCESS if all pins were written
+        """
+        err_code = SUCCESS
+        batch = dict()
+
+        for pin, value in values.items():
+
+            pin_number = getattr(pin, "_pin_number", pin)
+            gpio_pin = self._pins.get(pin_number, None)
+
+            # pin is not a member of the group, or value is invalid
+            if gpio_pin is None or value not in (HIGH, LOW):
+
+                log.error("Couldn't write pin group {}!".format(self.pins))
+                log.debug("Invalid pin ({}) or value ({}) for pin group".format(pin_number, value))
+                return ERR_INVALID_ARGUMENT
+
+            # pin is an input or is generating PWM
+            if gpio_pin._direction != OUTPUT or gpio_pin._pwm_on:
+
+                log.error("Couldn't write pin group {}!".format(self.pins))
+                log.debug("Pin {} isn't a static output".format(pin_number))
+                return ERR_INVALID_CONFIGURATION
+
+            # pin already has the value
+            if gpio_pin._cached_value == value:
+                gpio_pin._writes_elided += 1
+            else:
+                batch[pin_number] = value
+
+        # nothing changes
+        if not batch:
+            return err_code
+
+        try:
+
+            skew = self._backend.write_values(batch)
+
+        except (OSError, IOError) as e:
+
+            log.error("Couldn't write pin group {}!".format(self.pins))
+            log.debug("Writing pin group values failed: {}".format(e))
+            err_code = ERR_ERROR
+
+            for pin_number in batch:
+                self._pins[pin_number]._cached_value = None
+
+        else:
+
+            for pin_number, value in batch.items():
+
+                gpio_pin = self._pins[pin_number]
+                gpio_pin._last_state = gpio_pin._cached_value = value
+                gpio_pin._writes_issued += 1
+
+            self._batches += 1
+            self._last_skew = skew
+            self._total_skew += skew
+            self._max_skew = max(self._max_skew, skew)
+
+        return err_code
+
+    # read the levels of all pins in the group
+    def read(self):
+        """
+        Reads a snapshot of the group pin levels
+        :return: (err_code, mask), bit n of mask is the level of pin n
+        """
+        err_code = SUCCESS
+        mask = 0
+
+        try:
+            mask = self._backend.read_levels(self.pins)
+
+        except (OSError, IOError, ValueError) as e:
+
+            log.error("Couldn't read pin group {}!".format(self.pins))
+            log.debug("Reading pin group levels failed: {}".format(e))
+            err_code = ERR_ERROR
+
+        return err_code, mask
+
+    # batch skew statistics
+    def stats(self):
+        """
+        Inter-pin skew of the group writes
+        :return: dict(batches, mean_skew, max_skew), skews in seconds
+        """
+        return dict(batches=self._batches,
+                    mean_skew=self._total_skew / self._batches if self._batches else 0.0,
+                    max_skew=self._max_skew)
+
+
+# ---------------------------- Hardware PWM pin class --------------------------
+class HardwarePWM_Pin(object):
+    """
+    PWM output generated by the SoC PWM peripheral through /sys/class/pwm, offers the
+    PWM methods of GPIO_Pin (pwm_generate, pwm_update, pwm_stop, deinit_pin) without
+    any CPU load, at kHz frequencies.
+    """
+
+    def __init__(self, chip, channel, backend=None):
+
+        self._chip = chip
+        self._channel = channel
+        self._backend = backend or get_pwm_backend()
+
+        self._frequency = 0
+        self._pwm_duty = 0
+        self._period_ns = 0
+        self._duty_ns = 0
+        self._pwm_on = False
+
+        self._exported = self._init_pwm_channel() == SUCCESS
+
+    # export the pwm channel
+    def _init_pwm_channel(self):
+        """
+        Exports the PWM channel, by writing to /sys/class/pwm/pwmchip${chip}/export
+        :return: error code that indicates if the channel was exported successfully
+        """
+        err_code = SUCCESS
+
+        with _prepared_lock:
+            adopted = _prepared_channels.get((self._chip, self._channel), None) is self._backend
+
+            if adopted:
+                del _prepared_channels[(self._chip, self._channel)]
+
+        # channel was re-adopted from the pin journal
+        if adopted:
+
+            log.info("PWM channel {}:{} adopted!".format(self._chip, self._channel))
+            _journal_update("pwm", "{}:{}".format(self._chip, self._channel), dict(chip=self._chip,
+                                                                                   channel=self._channel))
+
+        # if channel is not used before
+        elif not self._backend.is_exported(self._chip, self._channel):
+
+            try:
+
+                self._backend.export(self._chip, self._channel)
+                log.info("PWM channel {}:{} exported!".format(self._chip, self._channel))
+                _journal_update("pwm", "{}:{}".format(self._chip, self._channel), dict(chip=self._chip,
+                                                                                       channel=self._channel))
+
+            except (OSError, IOError) as e:
+
+                log.error("Failed to export PWM channel {}:{}".format(self._chip, self._channel))
+                log.debug("Export of PWM channel {}:{} failed: {}".format(self._chip, self._channel, e))
+                err_code = ERR_ERROR
+
+        # if channel was used before
+        else:
+
+            log.error("Failed to export PWM channel {}:{}".format(self._chip, self._channel))
+            log.debug("PWM channel {}:{} is already exported!".format(self._chip, self._channel))
+            err_code = ERR_INVALID_CONFIGURATION
+
+        return err_code
+
+    # PWM channel of a GPIO pin
+    @staticmethod
+    def channel_of(pin_number):
+        """
+        :param pin_number: GPIO pin number
+        :return: (chip, channel) of the PWM peripheral muxed to the pin, None if the pin
+        has no hardware PWM
+        """
+        return _HARDWARE_PWM.get(pin_number, None)
+
+    # check if the channel was exported
+    def is_exported(self):
+        """
+        :return: True if the PWM channel was exported by this instance
+        """
+        return self._exported
+
+    # generate PWM signal
+    def pwm_generate(self, frequency, duty_cycle, pulses=0):
+        """
+        Generates a PWM signal with the given frequency and duty cycle
+        :param frequency: Frequency of the PWM in Hz
+        :param duty_cycle: Duty cycle of the PWM in % [0:100]
+        :param pulses: must be 0, the PWM peripheral has no pulse counter
+        :return: error code that indicates if the PWM signal was generated successfully
+        """
+        err_code = SUCCESS
+
+        # check if the channel was exported
+        if self._exported:
+
+            # check if frequency and duty cycle are valid numbers
+            if (0 < frequency <= 1e9) and (0 <= duty_cycle <= 100) and not pulses:
+
+                period_ns = int(round(1e9 / frequency))
+                duty_ns = int(round(period_ns * duty_cycle / 100.0))
+
+                try:
+
+                    # the duty cycle must never be longer than the period
+                    if period_ns < self._duty_ns:
+                        self._backend.write_duty_cycle(self._chip, self._channel, duty_ns)
+                        self._backend.write_period(self._chip, self._channel, period_ns)
+                    else:
+                        self._backend.write_period(self._chip, self._channel, period_ns)
+                        self._backend.write_duty_cycle(self._chip, self._channel, duty_ns)
+
+                    self._period_ns = period_ns
+                    self._duty_ns = duty_ns
+                    self._frequency = frequency
+                    self._pwm_duty = duty_cycle
+
+                    if not self._pwm_on:
+                        self._backend.write_enable(self._chip, self._channel, True)
+                        self._pwm_on = True
+
+                    log.debug("Started hardware PWM on channel {}:{} with frequency: {} and duty cycle: {}".format(
+                            self._chip, self._channel, frequency, duty_cycle))
+
+                except (OSError, IOError) as e:
+
+                    log.critical("Failed to generate PWM on channel {}:{}".format(self._chip, self._channel))
+                    log.debug("Configuring PWM channel {}:{} failed: {}".format(self._chip, self._channel, e))
+                    err_code = ERR_ERROR
+
+            # if duty cycle or frequency values are invalid
+            else:
+
+                log.critical("Failed to generate PWM on channel {}:{}".format(self._chip, self._channel))
+                log.debug("Invalid frequency {}, duty cycle {} or pulses {} for channel {}:{}".format(
+                        frequency, duty_cycle, pulses, self._chip, self._channel))
+                err_code = ERR_INVALID_ARGUMENT
+
+        # if channel was not exported
+        else:
+
+            log.critical("Failed to generate PWM on channel {}:{}".format(self._chip, self._channel))
+            log.debug("PWM channel {}:{} is not exported.".format(self._chip, self._channel))
+            err_code = ERR_INVALID_CONFIGURATION
+
+        return err_code
+
+    # updates PWM duty cycle
+    def pwm_update(self, duty_cycle):
+        """
+        Updates PWM duty cycle, the peripheral applies it at the end of the current period
+        :param duty_cycle: New duty cycle [0:100]
+        :return: error code
+        """
+        err_code = SUCCESS
+
+        if self._period_ns and 0 <= duty_cycle <= 100:
+
+            duty_ns = int(round(self._period_ns * duty_cycle / 100.0))
+
+            try:
+
+                self._backend.write_duty_cycle(self._chip, self._channel, duty_ns)
+                self._duty_ns = duty_ns
+                self._pwm_duty = duty_cycle
+
+            except (OSError, IOError) as e:
+
+                log.error("Failed to update PWM duty cycle on channel {}:{}".format(self._chip, self._channel))
+                log.debug("Writing duty cycle of channel {}:{} failed: {}".format(self._chip, self._channel, e))
+                err_code = ERR_ERROR
+
+        else:
+
+            log.error("Failed to update PWM duty cycle on channel {}:{}".format(self._chip, self._channel))
+            log.debug("Invalid duty cycle {} or PWM period not set".format(duty_cycle))
+            err_code = ERR_INVALID_ARGUMENT
+
+        return err_code
+
+    # stop PWM signal
+    def pwm_stop(self):
+        """
+        Disables the PWM channel
+        :return: error_code that indicates if the pwm signal was stopped successfully
+        """
+        err_code = SUCCESS
+
+        if self._pwm_on:
+
+            try:
+
+                self._backend.write_enable(self._chip, self._channel, False)
+                self._pwm_on = False
+
+            except (OSError, IOError) as e:
+
+                log.error("Failed to stop PWM on channel {}:{}".format(self._chip, self._channel))
+                log.debug("Disabling channel {}:{} failed: {}".format(self._chip, self._channel, e))
+                err_code = ERR_ERROR
+
+        else:
+
+            log.error("Invalid operation: Trying to stop a PWM signal on channel {}:{} while it's not running.".format(
+                    self._chip, self._channel))
+            err_code = ERR_PWM_NOT_RUNNING
+
+        return err_code
+
+    # release the pwm channel
+    def deinit_pin(self):
+        """
+        Disables and unexports the PWM channel
+        :return: error code that indicates if the channel was released successfully
+        """
+        err_code = SUCCESS
+
+        if self._exported:
+
+            if self._pwm_on:
+                self.pwm_stop()
+
+            try:
+
+                self._backend.unexport(self._chip, self._channel)
+                self._exported = False
+                log.info("Released PWM channel {}:{}".format(self._chip, self._channel))
+                _journal_update("pwm", "{}:{}".format(self._chip, self._channel), None)
+
+            except (OSError, IOError) as e:
+
+                log.error("Failed to release PWM channel {}:{}".format(self._chip, self._channel))
+                log.debug("Unexport of channel {}:{} failed: {}".format(self._chip, self._channel, e))
+                err_code = ERR_ERROR
+
+        else:
+
+            log.warning("Failed to release PWM channel {}:{}".format(self._chip, self._channel))
+            log.debug("PWM channel is not exported!")
+            err_code = ERR_INVALID_CONFIGURATION
+
+        return err_code
+
+
 if __name__ == "__main__":
 
     # # test 1 (pin 21)
@@ -674,6 +2398,10 @@ if __name__ == "__main__":
 
     time.sleep(5)
 
+    # all nine pins are driven by the PWM_Scheduler thread
+    for pin_number, stats in sorted(get_pwm_scheduler().stats().items()):
+        print("Pin {} PWM jitter: {}".format(pin_number, stats))
+
     p0.pwm_stop()
     p1.pwm_stop()
     p2.pwm_stop()
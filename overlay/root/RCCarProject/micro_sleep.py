@@ -1,16 +1,269 @@
 #!/usr/bin/env python2
 
+import os
 import time
+import json
+import errno
+import ctypes
+import ctypes.util
+import threading as thread
+
+# ------------------------------ Monotonic clock -------------------------------
+
+CLOCK_MONOTONIC = 1
+CLOCK_THREAD_CPUTIME_ID = 3
+TIMER_ABSTIME = 1
+
+# wake-up latency calibration
+_CALIBRATION_SAMPLES = 100
+_CALIBRATION_SLEEPS = (200e-6, 500e-6, 1e-3, 2e-3)
+_CALIBRATION_PERCENTILE = 0.95
+
+# spin tail used until the background calibration is done, on the late side of the
+# wake-up latencies seen on a Raspberry Pi
+_DEFAULT_SPIN_TAIL = 200e-6
+
+
+# clock_gettime(2) timespec
+class _Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+_librt = ctypes.CDLL(ctypes.util.find_library("rt") or ctypes.util.find_library("c"), use_errno=True)
+
+
+# clocks for python versions that lack time.monotonic/time.clock_gettime (python 2)
+def _clock_gettime(clock_id):
+    """
+    Reads a clock using clock_gettime(2)
+    :param clock_id: CLOCK_MONOTONIC, CLOCK_THREAD_CPUTIME_ID
+    :return: (float) clock time in seconds
+    """
+    ts = _Timespec()
+
+    if _librt.clock_gettime(clock_id, ctypes.byref(ts)):
+        raise OSError(ctypes.get_errno(), "clock_gettime failed")
+
+    return ts.tv_sec + ts.tv_nsec * 1e-9
+
+
+def _clock_gettime_monotonic():
+    return _clock_gettime(CLOCK_MONOTONIC)
+
+
+# monotonic time in seconds, not affected by system clock updates
+monotonic = getattr(time, "monotonic", _clock_gettime_monotonic)
+
+
+# CPU time used by the calling thread
+def thread_cpu_time():
+    """
+    :return: (float) CPU time consumed by the calling thread in seconds
+    """
+    return _clock_gettime(CLOCK_THREAD_CPUTIME_ID)
+
+# ------------------------------- Precise sleep --------------------------------
+
+# clock_nanosleep(2) is missing from some C libraries, time.sleep is used instead
+_clock_nanosleep = getattr(_librt, "clock_nanosleep", None)
+
+# time spun before a deadline instead of sleeping in the kernel (wake-up latency),
+# None until calibrated (or loaded from the calibration file)
+_spin_tail = None
+
+# calibration cache, reused while the host name and kernel don't change (per user
+# cache directory unless RCCAR_SLEEP_CALIBRATION is set)
+_calibration_path = os.environ.get("RCCAR_SLEEP_CALIBRATION") or \
+                    os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                                 "rccar", "sleep_calibration.json")
+
+# background calibration (see prepare_spin_tail)
+_calibration_thread = None
+
+
+# kernel sleep until an absolute monotonic time
+def _kernel_sleep_until(deadline):
+    """
+    Sleeps in the kernel until the given CLOCK_MONOTONIC time, using clock_nanosleep
+    with TIMER_ABSTIME so signals and late wake ups don't stretch the sleep
+    :param deadline: monotonic time in seconds
+    :return: None
+    """
+    if _clock_nanosleep is None:
+
+        delay = deadline - monotonic()
+
+        if delay > 0:
+            time.sleep(delay)
+
+        return None
+
+    ts = _Timespec(int(deadline), int((deadline - int(deadline)) * 1e9))
+
+    # an interrupted absolute sleep is simply restarted
+    while _clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, ctypes.byref(ts), None) == errno.EINTR:
+        pass
+
+
+# host identity of a calibration
+def _host_key():
+    uname = os.uname()
+    return "{} {} {}".format(uname[1], uname[2], uname[4])
+
+
+# measure the wake-up latency of kernel sleeps
+def calibrate(samples=_CALIBRATION_SAMPLES, path=None):
+    """
+    Measures how late kernel sleeps wake up on this host and uses the given percentile
+    of the latency as the spin tail of sleep_until. Longer sleeps reach deeper idle
+    states and wake up later, the measured sleeps cover 200 us to 2 ms. The result is
+    saved to the calibration file.
+    :param samples: number of sleeps to measure
+    :param path: calibration file (default: RCCAR_SLEEP_CALIBRATION or the user cache)
+    :return: spin tail in seconds
+    """
+    global _spin_tail
+
+    latencies = list()
+
+    for sample in range(samples):
+
+        deadline = monotonic() + _CALIBRATION_SLEEPS[sample % len(_CALIBRATION_SLEEPS)]
+        _kernel_sleep_until(deadline)
+        latencies.append(max(0.0, monotonic() - deadline))
+
+    latencies.sort()
+    _spin_tail = latencies[min(len(latencies) - 1, int(len(latencies) * _CALIBRATION_PERCENTILE))]
+
+    path = path or _calibration_path
+
+    if path is not None:
+
+        try:
+
+            if not os.path.isdir(os.path.dirname(path) or "."):
+                os.makedirs(os.path.dirname(path))
+
+            with open(path, "w") as f:
+                json.dump(dict(host=_host_key(), spin_tail=_spin_tail), f)
+
+        except (OSError, IOError):
+            pass
+
+    return _spin_tail
+
+
+# spin tail saved by a calibration on this host
+def _load_calibration(path):
+    """
+    :param path: calibration file
+    :return: spin tail in seconds, None if the file is missing or from another host (or kernel)
+    """
+    try:
+
+        with open(path) as f:
+            calibration = json.load(f)
+
+        if calibration.get("host") == _host_key():
+            return float(calibration["spin_tail"])
+
+    except (OSError, IOError, ValueError, KeyError, TypeError, AttributeError):
+        pass
+
+    return None
+
+
+# current spin tail, calibrated on first use
+def get_spin_tail():
+    """
+    Returns the spin tail of sleep_until, loads it from the calibration file if it was
+    measured on this host (and kernel) before, measures it otherwise (~100 ms). A
+    background calibration in progress is waited for.
+    :return: spin tail in seconds
+    """
+    global _spin_tail
+
+    if _calibration_thread is not None:
+        _calibration_thread.join()
+
+    if _spin_tail is None:
+        _spin_tail = _load_calibration(_calibration_path)
+
+    if _spin_tail is None:
+        calibrate()
+
+    return _spin_tail
+
+
+# spin tail for start up paths, never waits for a calibration
+def prepare_spin_tail():
+    """
+    Loads the spin tail from the calibration file, or starts measuring it in a
+    background thread, sleep_until uses a conservative default tail until it's done
+    :return: spin tail in use, in seconds
+    """
+    global _spin_tail, _calibration_thread
+
+    if _spin_tail is None:
+        _spin_tail = _load_calibration(_calibration_path)
+
+    if _spin_tail is None:
+
+        _spin_tail = _DEFAULT_SPIN_TAIL
+
+        calibration = thread.Thread(target=calibrate)
+        calibration.setDaemon(True)
+        calibration.setName("Sleep_Calibration")
+        calibration.start()
+
+        _calibration_thread = calibration
+
+    return _spin_tail
+
+
+# sleep until an absolute monotonic time
+def sleep_until(deadline):
+    """
+    Sleeps until the given monotonic time: in the kernel for most of the interval,
+    then spins for the calibrated wake-up latency only
+    :param deadline: time in seconds (micro_sleep.monotonic clock)
+    :return: 0
+    """
+    tail = _spin_tail if _spin_tail is not None else get_spin_tail()
+
+    if deadline - monotonic() > tail:
+        _kernel_sleep_until(deadline - tail)
+
+    while monotonic() < deadline:
+        pass
+
+    return 0
+
+
+# sleep for a relative time
+def precise_sleep(seconds):
+    """
+    Sleeps for the given number of seconds with micro second accuracy (see sleep_until)
+    :param seconds: time to sleep in seconds
+    :return: 0
+    """
+    return sleep_until(monotonic() + seconds)
 
 
 def micro_sleep(micro_sec):
     """
-    Sleeps for a given number of micro-seconds. it uses polling to keep track of the time
-    so it's fairly accurate with large numbers (10+ micro seconds).
-    But because it uses polling, it can't be used extensively with threads.
+    Sleeps for a given number of micro-seconds. The time is slept in the kernel
+    (clock_nanosleep) except for the last calibrated tail which is spun, so it stays
+    accurate (10+ micro seconds) without keeping the CPU busy for the whole interval.
     :param micro_sec: number of micro seconds to sleep
     :return: 0
     """
+    return sleep_until(monotonic() + micro_sec * 1e-6)
+
+
+# legacy busy wait, kept for comparison
+def _spin_sleep(micro_sec):
+
     start_time = time.time()
 
     while (time.time() - start_time) < (micro_sec * 1e-6):
@@ -49,4 +302,28 @@ if __name__ == '__main__':
                 trials[t] = list(oh)
 
     for k in trials.keys():
-        print("Micro sleep for {}, actual sleep time: {}, overhead: {}".format(k, trials[k][0]/1000.0, trials[k][1]/1000.0))
\ No newline at end of file
+        print("Micro sleep for {}, actual sleep time: {}, overhead: {}".format(k, trials[k][0]/1000.0, trials[k][1]/1000.0))
+
+    # legacy busy wait vs kernel sleep + spin tail, for the ultrasonic 2 ms settle time
+    def cpu_and_error(sleep, t, runs=500):
+
+        cpu_start = sum(os.times()[:2])
+        errors = list()
+
+        for _ in range(runs):
+
+            st = monotonic()
+            sleep(t)
+            errors.append(abs(1e6 * (monotonic() - st) - t))
+
+        errors.sort()
+
+        return 1e6 * (sum(os.times()[:2]) - cpu_start) / runs, errors[runs // 2], errors[int(runs * 0.99)]
+
+    print("Spin tail: {:.1f} us".format(1e6 * get_spin_tail()))
+
+    for name, sleep in (("busy wait", _spin_sleep), ("micro_sleep", micro_sleep)):
+
+        cpu, median, p99 = cpu_and_error(sleep, 2000)
+        print("{:12s}: 2000 us sleep, cpu time {:8.1f} us, error median {:6.1f} us, p99 {:6.1f} us".format(
+                name, cpu, median, p99))
@@ -2,6 +2,7 @@
 
 import logging as log
 import gpiolib as gpio
+import wheel_encoder
 
 # ------------------------------- Motor State ----------------------------------
 
@@ -17,6 +18,11 @@ ROTATE_CCW = "rccw"
 STOP = "stop"
 BRAKE = "brake"
 
+# ------------------------------- PWM types ------------------------------------
+
+SOFTWARE_PWM = "software"
+HARDWARE_PWM = "hardware"
+
 # -------------------------------- Error codes ---------------------------------
 
 SUCCESS = 0
@@ -49,12 +55,21 @@ class MotorControl(object):
 
     """
 
-    def __init__(self, min_speed=0, pwm_freq=20):
+    def __init__(self, min_speed=0, pwm_freq=20, pwm_type=SOFTWARE_PWM, hw_pwm_freq=20000):
 
         self._pin_1 = None
         self._pin_2 = None
         self._pwm_pin = None
 
+        # pin_1 and pin_2 are written as one batch, so the H-bridge never sees a
+        # half updated direction
+        self._direction_pins = None
+
+        # requested PWM type, hardware PWM falls back to software PWM if the pin
+        # has no PWM channel or the channel can't be exported
+        self._pwm_type = pwm_type
+        self._hw_pwm_freq = hw_pwm_freq
+
         self._direction = None
         self._speed = 0
 
@@ -63,8 +78,12 @@ class MotorControl(object):
         self._pwm_freq = pwm_freq
         self._min_speed = min_speed
 
-        # TODO :: Add speed measurements
-        self._rpm = 0
+        # speed measurement (wheel_encoder.WheelEncoder), None without an encoder
+        self._encoder = None
+
+        # duty cycle owned by a closed loop speed controller (apply_duty), speed commands
+        # only record the commanded speed until release_duty
+        self._closed_loop = False
 
     # initialize motor pins
     def init_motor(self, pin_1, pin_2, pwm_pin):
@@ -90,9 +109,10 @@ class MotorControl(object):
                     self._pin_1.set_pin_direction(gpio.OUTPUT)
                     self._pin_1.set_pin_value(gpio.LOW)
 
+                    self._direction_pins = gpio.PinGroup([self._pin_1, self._pin_2])
+
                     # configure pwm pin
-                    self._pwm_pin = gpio.GPIO_Pin(pwm_pin, gpio.PWM)
-                    self._pwm_pin.pwm_generate(self._pwm_freq, self._speed)
+                    self._init_pwm_pin(pwm_pin)
 
                     self._state = _STOPPED
 
@@ -117,10 +137,94 @@ class MotorControl(object):
 
         return err_code
 
+    # initialize motor enable (PWM) pin
+    def _init_pwm_pin(self, pwm_pin):
+        """
+        Starts the PWM signal of the motor enable pin, using the SoC PWM peripheral if
+        hardware PWM was requested and the pin supports it, software PWM otherwise
+        :param pwm_pin: motor enable pin
+        :return: PWM type in use (SOFTWARE_PWM, HARDWARE_PWM)
+        """
+        if self._pwm_type == HARDWARE_PWM:
+
+            channel = gpio.HardwarePWM_Pin.channel_of(pwm_pin)
+
+            if channel is not None:
+
+                hw_pin = gpio.HardwarePWM_Pin(*channel)
+
+                if hw_pin.is_exported() and hw_pin.pwm_generate(self._hw_pwm_freq, self._speed) == gpio.SUCCESS:
+
+                    self._pwm_pin = hw_pin
+                    log.info("Motor pin {} uses hardware PWM channel {}:{}".format(pwm_pin, *channel))
+
+                    return HARDWARE_PWM
+
+                if hw_pin.is_exported():
+                    hw_pin.deinit_pin()
+
+            log.warning("No hardware PWM for motor pin {}, falling back to software PWM!".format(pwm_pin))
+
+        self._pwm_pin = gpio.GPIO_Pin(pwm_pin, gpio.PWM)
+        self._pwm_pin.pwm_generate(self._pwm_freq, self._speed)
+        self._pwm_type = SOFTWARE_PWM
+
+        return SOFTWARE_PWM
+
+    # initialize the wheel encoder
+    def init_encoder(self, pin, slots=20, wheel_diameter=6.5):
+        """
+        Starts measuring the motor speed with a wheel encoder on the given input pin
+        :param pin: encoder signal pin
+        :param slots: encoder pulses per wheel revolution
+        :param wheel_diameter: wheel diameter in cm
+        :return: error code that indicates if the encoder was initialized
+        """
+        # check if the encoder is initialized already
+        if self._encoder is not None:
+
+            log.error("Motor encoder is already initialized!")
+            return _ERR_INVALID_CONFIG
+
+        encoder = wheel_encoder.WheelEncoder(slots=slots, wheel_diameter=wheel_diameter)
+        err_code = encoder.init_encoder(pin=pin)
+
+        if err_code == wheel_encoder.SUCCESS:
+
+            self._encoder = encoder
+
+        else:
+
+            log.error("Failed to initialize motor encoder!")
+            err_code = _ERR_INVALID_PIN
+
+        return err_code
+
+    # wheel encoder
+    @property
+    def encoder(self):
+        """wheel_encoder.WheelEncoder of the motor, None without an encoder"""
+        return self._encoder
+
+    # measured motor speed
+    def get_rpm(self):
+        """
+        :return: wheel RPM measured by the encoder (magnitude, the encoder doesn't see the
+        direction), None without an encoder
+        """
+        return self._encoder.rpm() if self._encoder is not None else None
+
+    # measured wheel speed
+    def get_wheel_speed(self):
+        """
+        :return: wheel surface speed in cm/s, None without an encoder
+        """
+        return self._encoder.speed() if self._encoder is not None else None
+
     # de-initialize pins
     def deinit_motor(self):
         """
-        Release GPIO pins used by motor (pin-1, pin_2 and pwm_pin)
+        Release GPIO pins used by motor (pin-1, pin_2, pwm_pin and the encoder pin)
         :return: error code
         """
 
@@ -131,6 +235,9 @@ class MotorControl(object):
             self._pwm_pin.pwm_stop()
             self._pwm_pin.deinit_pin()
             self._pwm_pin = None
+            self._closed_loop = False
+
+            self._direction_pins = None
 
             self._pin_1.deinit_pin()
             self._pin_1 = None
@@ -138,6 +245,11 @@ class MotorControl(object):
             self._pin_2.deinit_pin()
             self._pin_2 = None
 
+            if self._encoder is not None:
+
+                self._encoder.deinit_encoder()
+                self._encoder = None
+
             log.info("Released motor pin.")
 
         else:
@@ -156,67 +268,69 @@ class MotorControl(object):
         :param speed: motor rotation speed % [0:100]
         :return: error code that indicates if the motor rotated successfully
         """
+        err_code, levels = self.prepare_rotation(direction, speed)
+
+        # check the command is valid
+        if levels is not None:
+
+            # update speed changes
+            self.apply_speed(speed)
+
+            # check if motor is not running or running in different direction
+            if levels:
+                self._direction_pins.write(levels)
+
+            self.direction_applied(direction)
+
+        return err_code
+
+    # check a rotation command
+    def prepare_rotation(self, direction, speed=0):
+        """
+        Checks a rotation command and computes the direction pin levels without applying
+        anything, rotate_motor and drive_train.DriveTrain apply them
+        :param direction: Direction to rotate motor in (ROTATE_CW, ROTATE_CCW, STOP, BRAKE)
+        :param speed: motor rotation speed % [0:100]
+        :return: (err_code, levels), levels is {GPIO_Pin: level} of the direction pins ({}
+        if the direction doesn't change), None if the command can't be applied
+        """
         err_code = SUCCESS
+        levels = dict()
 
         # check motor pins
         if self._state != _UNINITIALIZED:
 
-            # check speed limit
-            if speed < self._min_speed:
+            # check speed limit (the duty cycle doesn't matter for STOP)
+            if speed < self._min_speed and direction != STOP:
 
                 log.error("Speed is lower than the minimum speed limit! The motor may fail to rotate!")
                 log.debug("Given motor speed is {} while minimum required is {}".format(speed, self._min_speed))
                 err_code = _ERR_INVALID_ARGS
 
-            # update speed changes
-            if self._speed != speed:
-
-                self._speed = speed
-                self._pwm_pin.pwm_update(self._speed)
-
             # check if motor is not running or running in different direction
             if self._direction != direction:
 
                 # rotation direction clockwise (pin_1 -> Vcc, pin_2 -> GND)
                 if direction == ROTATE_CW:
-
-                    self._pin_1.set_pin_value(gpio.HIGH)
-                    self._pin_2.set_pin_value(gpio.LOW)
-
-                    self._state = _RUNNING_CW
-                    self._direction = ROTATE_CW
+                    levels = {self._pin_1: gpio.HIGH, self._pin_2: gpio.LOW}
 
                 # rotation direction counter clockwise (pin_1 -> GND, pin_2 -> Vcc)
                 elif direction == ROTATE_CCW:
-
-                    self._pin_1.set_pin_value(gpio.LOW)
-                    self._pin_2.set_pin_value(gpio.HIGH)
-
-                    self._state = _RUNNING_CCW
-                    self._direction = ROTATE_CCW
+                    levels = {self._pin_1: gpio.LOW, self._pin_2: gpio.HIGH}
 
                 # stop motor rotation (pin_1 -> GND, pin_2 -> GND)
                 elif direction == STOP:
-
-                    self._pin_1.set_pin_value(gpio.LOW)
-                    self._pin_2.set_pin_value(gpio.LOW)
-
-                    self._state = _STOPPED
-                    self._direction = STOP
+                    levels = {self._pin_1: gpio.LOW, self._pin_2: gpio.LOW}
 
                 # brake motor (pin_1 -> Vcc, pin_2 -> Vcc)
                 elif direction == BRAKE:
-
-                    self._pin_1.set_pin_value(gpio.HIGH)
-                    self._pin_2.set_pin_value(gpio.HIGH)
-
-                    self._state = _STOPPED
-                    self._direction = BRAKE
+                    levels = {self._pin_1: gpio.HIGH, self._pin_2: gpio.HIGH}
 
                 # if direction is invalid
                 else:
 
                     err_code = _ERR_INVALID_ARGS
+                    levels = None
                     log.error("Invalid rotation direction: {}!".format(direction))
 
         # if pins are not configured yet
@@ -224,9 +338,104 @@ class MotorControl(object):
 
             log.critical("Trying to rotate motor before initializing its pins!")
             err_code = _ERR_INVALID_CONFIG
+            levels = None
+
+        return err_code, levels
+
+    # apply the speed of a rotation command
+    def apply_speed(self, speed):
+        """
+        Sets the commanded speed and writes its duty cycle if it changed (no minimum
+        speed check, see prepare_rotation), the duty cycle isn't written while a closed
+        loop speed controller owns it
+        :param speed: motor rotation speed % [0:100]
+        :return: True if the duty cycle was written
+        """
+        if self._speed == speed:
+            return False
+
+        self._speed = speed
+
+        if self._closed_loop:
+            return False
+
+        self._pwm_pin.pwm_update(self._speed)
+
+        return True
+
+    # record the direction of a rotation command
+    def direction_applied(self, direction):
+        """
+        Updates the motor state once the direction pins of a prepared rotation are written
+        :param direction: Direction the motor rotates in (ROTATE_CW, ROTATE_CCW, STOP, BRAKE)
+        :return: None
+        """
+        self._direction = direction
+        self._state = {ROTATE_CW: _RUNNING_CW, ROTATE_CCW: _RUNNING_CCW}.get(direction, _STOPPED)
+
+    # direction pins group
+    @property
+    def direction_pins(self):
+        """gpiolib.PinGroup of the motor direction pins (pin_1, pin_2), None before init_motor"""
+        return self._direction_pins
+
+    # rotation direction
+    @property
+    def direction(self):
+        """rotation direction set by rotate_motor (ROTATE_CW, ROTATE_CCW, STOP, BRAKE), None before"""
+        return self._direction
+
+    # commanded motor speed
+    @property
+    def speed(self):
+        """commanded motor speed (PWM duty cycle %) set by rotate_motor / update_speed"""
+        return self._speed
+
+    # minimum speed
+    @property
+    def min_speed(self):
+        """lowest speed % the motor turns at"""
+        return self._min_speed
+
+    # write a duty cycle without changing the commanded speed
+    def apply_duty(self, duty):
+        """
+        Writes the PWM duty cycle, the commanded speed stays (closed loop speed control
+        writes its output here, see speed_controller). Speed commands stop writing the
+        duty cycle until release_duty.
+        :param duty: PWM duty cycle % [0:100]
+        :return: error code
+        """
+        err_code = SUCCESS
+
+        # check if motor is configured
+        if self._state != _UNINITIALIZED:
+
+            self._closed_loop = True
+            self._pwm_pin.pwm_update(duty)
+
+        else:
+
+            log.error("Trying to change motor duty cycle while the motor is not configured!")
+            err_code = _ERR_INVALID_CONFIG
 
         return err_code
 
+    # give the duty cycle back to the speed commands
+    def release_duty(self):
+        """
+        Ends closed loop control of the duty cycle (see apply_duty), the commanded speed
+        is written again
+        :return: error code
+        """
+        self._closed_loop = False
+
+        # check if motor is configured
+        if self._state != _UNINITIALIZED:
+            self._pwm_pin.pwm_update(self._speed)
+
+        return SUCCESS
+
     # change motor speed
     def update_speed(self, speed):
         """
@@ -243,7 +452,9 @@ class MotorControl(object):
             if speed >= self._min_speed:
 
                 self._speed = speed
-                self._pwm_pin.pwm_update(self._speed)
+
+                if not self._closed_loop:
+                    self._pwm_pin.pwm_update(self._speed)
 
             else:
 
@@ -0,0 +1,415 @@
+#!/usr/bin/env python2
+
+#
+# Motor speed ramping
+# Moves the duty cycle of every motor towards its target at a limited acceleration
+# (duty % per second) instead of stepping it, a reversal ramps down to zero, lets the
+# motor coast for a dead time and ramps up in the other direction. One timer thread
+# steps every ramping motor and sleeps while none is ramping. A new target preempts
+# the current ramp: its first step is applied right away in the calling thread.
+#
+
+import os
+import select
+import threading as thread
+import logging as log
+
+import motor_controller as motor
+from gpio_backend import set_nonblocking
+from micro_sleep import monotonic
+
+# -------------------------------- Error codes ---------------------------------
+
+SUCCESS = 0
+_ERR_INVALID_PIN = 1
+_ERR_USED_PIN = 2
+_ERR_INVALID_CONFIG = 3
+_ERR_INVALID_ARGS = 4
+_ERR_ERROR = 5
+
+# direction of a signed duty cycle
+_SIGNS = {motor.ROTATE_CW: 1, motor.ROTATE_CCW: -1, motor.STOP: 0, motor.BRAKE: 0}
+
+
+class _Ramp(object):
+    """
+    Ramp state of one motor, duty cycles are signed (clockwise positive)
+    """
+
+    def __init__(self, car_motor):
+
+        self.motor = car_motor
+
+        self.duty = 0.0
+        self.target = 0.0
+
+        # direction and speed applied once the motor reaches zero (STOP, BRAKE)
+        self.stop_direction = motor.STOP
+        self.stop_speed = 0
+
+        self.hold_until = 0.0
+        self.last_step = None
+        self.settled = True
+
+
+class RampEngine(object):
+
+    def __init__(self, acceleration=200.0, dead_time=0.05, rate=100, listener=None, drive_train=None):
+        """
+        :param acceleration: largest duty cycle change per second (% / s)
+        :param dead_time: coasting time between the two directions of a reversal (s)
+        :param rate: ramp steps per second
+        :param listener: callable(name, direction, speed) called after every step
+        applied to a motor
+        :param drive_train: drive_train.DriveTrain of the motors, the steps of all the
+        motors are committed together (None: motor after motor)
+        """
+        self._acceleration = float(acceleration)
+        self._dead_time = dead_time
+        self._period = 1.0 / rate
+        self._listener = listener
+        self._drive_train = drive_train
+
+        # ramps by name, in the order they were added
+        self._ramps = dict()
+        self._names = list()
+        self._lock = thread.RLock()
+
+        self._running = False
+        self._timer = None
+
+        self.steps = 0
+        self.preemptions = 0
+        self.reversals = 0
+
+        # self-pipe waking the timer (new target, stop), open while the timer runs
+        self._wake_r = None
+        self._wake_w = None
+
+    # add a motor
+    def add_motor(self, name, car_motor):
+        """
+        :param name: motor name (e.g. "left", "right")
+        :param car_motor: initialized motor_controller.MotorControl
+        :return: error code that indicates if the motor was added
+        """
+        if name in self._ramps:
+
+            log.error("Motor {} is ramped already!".format(name))
+            return _ERR_INVALID_ARGS
+
+        with self._lock:
+
+            self._ramps[name] = _Ramp(car_motor)
+            self._names.append(name)
+
+        return SUCCESS
+
+    @property
+    def names(self):
+        """motor names in the order they were added"""
+        return list(self._names)
+
+    # start the ramp timer
+    def start(self):
+        """
+        Starts the timer thread stepping the ramps
+        :return: error code that indicates if the timer started
+        """
+        if self._running:
+            return _ERR_INVALID_CONFIG
+
+        self._running = True
+
+        self._wake_r, self._wake_w = os.pipe()
+
+        for fd in (self._wake_r, self._wake_w):
+            set_nonblocking(fd)
+
+        self._timer = thread.Thread(target=self._timer_loop)
+        self._timer.setDaemon(True)
+        self._timer.setName("Motor_Ramp")
+        self._timer.start()
+
+        return SUCCESS
+
+    # stop the ramp timer
+    def stop(self):
+        """
+        Stops the timer thread, ramps in progress stay where they are
+        :return: 0
+        """
+        if self._running:
+
+            self._running = False
+            self._wake()
+            self._timer.join()
+            self._timer = None
+
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+
+            self._wake_r = None
+            self._wake_w = None
+
+        return 0
+
+    # new motor target
+    def set_target(self, name, direction, speed):
+        """
+        Ramps the motor towards the given direction and speed, the ramp in progress is
+        dropped and the first step towards the new target is applied right away
+        :param name: motor name
+        :param direction: motor_controller.ROTATE_CW, ROTATE_CCW, STOP or BRAKE (STOP and
+        BRAKE ramp down to zero, then coast or brake)
+        :param speed: motor speed % [0:100] (brake duty cycle for BRAKE)
+        :return: error code
+        """
+        return self.set_targets({name: (direction, speed)})
+
+    # new targets of several motors
+    def set_targets(self, targets):
+        """
+        Sets the targets of several motors (see set_target), their first steps are
+        applied together
+        :param targets: {name: (direction, speed)}
+        :return: error code
+        """
+        # check every target first
+        for name, (direction, speed) in targets.items():
+
+            if name not in self._ramps or direction not in _SIGNS or not 0 <= speed <= 100:
+
+                log.error("Invalid ramp target {} {} for motor {}!".format(direction, speed, name))
+                return _ERR_INVALID_ARGS
+
+        with self._lock:
+
+            now = monotonic()
+            steps = dict()
+
+            for name, (direction, speed) in targets.items():
+
+                ramp = self._ramps[name]
+
+                if not ramp.settled:
+                    self.preemptions += 1
+
+                ramp.target = float(_SIGNS[direction] * speed)
+
+                if not ramp.target:
+
+                    ramp.stop_direction = direction
+                    ramp.stop_speed = speed
+
+                ramp.settled = False
+                steps[name] = self._step(ramp, now)
+
+            self._apply(steps)
+
+        self._wake()
+
+        return SUCCESS
+
+    # signed duty cycle of a motor
+    def get_duty(self, name):
+        """
+        :param name: motor name
+        :return: duty cycle applied to the motor, negative counter clockwise
+        """
+        return self._ramps[name].duty
+
+    # True while a motor ramps
+    def ramping(self, name=None):
+        """
+        :param name: motor name, None for any motor
+        :return: True if the motor (any motor) has not reached its target yet
+        """
+        names = self._names if name is None else [name]
+
+        return any(not self._ramps[n].settled for n in names)
+
+    # ramp counters
+    def stats(self):
+        """
+        :return: dict(steps, preemptions, reversals, duty), preemptions count targets
+        that replaced a ramp in progress, duty is {name: signed duty cycle}
+        """
+        return dict(steps=self.steps, preemptions=self.preemptions, reversals=self.reversals,
+                    duty=dict((name, self._ramps[name].duty) for name in self._names))
+
+    # one ramp step of a motor
+    def _step(self, ramp, now):
+        """
+        Moves the duty cycle one acceleration limited step towards the target, the time
+        since the previous step counts for one timer period at most
+        :param ramp: _Ramp
+        :param now: monotonic time
+        :return: new signed duty cycle, None while coasting through a reversal
+        """
+        elapsed = now - ramp.last_step if ramp.last_step is not None else self._period
+        ramp.last_step = now
+
+        # coasting through a reversal
+        if now < ramp.hold_until:
+            return None
+
+        limit = self._acceleration * min(elapsed, self._period)
+        min_speed = ramp.motor.min_speed
+        duty, target = ramp.duty, ramp.target
+
+        # slow down towards zero: stopping or reversing
+        if duty and (target * duty <= 0):
+
+            duty -= max(-limit, min(limit, duty))
+
+            # below the motor minimum speed the motor stands still already
+            if abs(duty) < min_speed or abs(duty) < 1e-9:
+                duty = 0.0
+
+            # reversing, coast for the dead time before the other direction
+            if not duty and target:
+
+                self.reversals += 1
+                ramp.hold_until = now + self._dead_time
+
+        # speed up from zero, the motor doesn't turn below its minimum speed
+        elif not duty and target:
+
+            sign = 1 if target > 0 else -1
+            duty = sign * min(abs(target), max(min_speed, limit))
+
+        # same direction
+        else:
+
+            duty += max(-limit, min(limit, target - duty))
+
+        return duty
+
+    # write ramp steps to the motors
+    def _apply(self, steps):
+        """
+        :param steps: {name: signed duty cycle or None (no change)}
+        :return: None
+        """
+        commands = dict()
+
+        for name, duty in steps.items():
+
+            if duty is None:
+                continue
+
+            ramp = self._ramps[name]
+            ramp.duty = duty
+
+            if duty > 0:
+                commands[name] = (motor.ROTATE_CW, duty)
+            elif duty < 0:
+                commands[name] = (motor.ROTATE_CCW, -duty)
+            elif ramp.target:
+                commands[name] = (motor.STOP, ramp.motor.speed)
+            else:
+                commands[name] = (ramp.stop_direction, ramp.stop_speed)
+
+        if not commands:
+            return
+
+        if self._drive_train is not None:
+
+            self._drive_train.commit(commands)
+
+        else:
+
+            for name, (direction, speed) in commands.items():
+                self._ramps[name].motor.rotate_motor(direction=direction, speed=speed)
+
+        for name, (direction, speed) in commands.items():
+
+            ramp = self._ramps[name]
+            ramp.settled = ramp.duty == ramp.target and ramp.motor.direction == direction
+            self.steps += 1
+
+            if self._listener is not None:
+                self._listener(name, direction, speed)
+
+    # timer thread
+    def _timer_loop(self):
+
+        deadline = monotonic()
+
+        while self._running:
+
+            with self._lock:
+
+                now = monotonic()
+
+                self._apply(dict((name, self._step(self._ramps[name], now))
+                                 for name in self._names if not self._ramps[name].settled))
+
+            # sleep until the next step, or until a new target while nothing ramps
+            if self.ramping():
+
+                deadline = max(deadline + self._period, monotonic())
+                self._sleep(deadline - monotonic())
+
+            else:
+
+                self._sleep(None)
+                deadline = monotonic()
+
+        return 0
+
+    # sleep, woken up early by a new target or stop
+    def _sleep(self, delay):
+
+        if delay is not None and delay <= 0:
+            return
+
+        if select.select([self._wake_r], [], [], delay)[0]:
+
+            try:
+                os.read(self._wake_r, 64)
+            except OSError:
+                pass
+
+    # wake the timer
+    def _wake(self):
+
+        if self._wake_w is None:
+            return
+
+        try:
+            os.write(self._wake_w, b"x")
+        except OSError:
+            pass
+
+
+if __name__ == '__main__':
+
+    import time
+
+    m0 = motor.MotorControl()
+    m0.init_motor(pin_1=16, pin_2=20, pwm_pin=21)
+
+    engine = RampEngine(acceleration=200, dead_time=0.1)
+    engine.add_motor("left", m0)
+    engine.start()
+
+    engine.set_target("left", motor.ROTATE_CW, 100)
+    time.sleep(1)
+
+    # reversal: down to zero, coast, up the other way
+    engine.set_target("left", motor.ROTATE_CCW, 100)
+
+    while engine.ramping():
+
+        print("{:7.1f} %".format(engine.get_duty("left")))
+        time.sleep(.05)
+
+    engine.set_target("left", motor.BRAKE, 50)
+    time.sleep(1)
+
+    print(engine.stats())
+
+    engine.stop()
+    m0.deinit_motor()
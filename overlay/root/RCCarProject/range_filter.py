@@ -0,0 +1,374 @@
+#!/usr/bin/env python2
+
+#
+# Streaming filters for ultrasonic range readings
+# MedianFilter : running median over a sliding window (bisect, O(log n) search)
+# EMAFilter    : exponential moving average, O(1)
+# KalmanFilter : 1-D constant velocity Kalman filter (distance, closing speed), O(1)
+#
+# All filters drop invalid readings (timeouts reported as -1, readings outside the
+# sensor range) and outliers (jumps larger than outlier_distance from the current
+# estimate, accepted again after max_outliers consecutive rejections, as the object
+# in front really changed).
+# filter_batch replays recorded sessions, vectorized with numpy when it's installed.
+#
+
+from bisect import bisect_left, insort
+from collections import deque
+
+# numpy is optional, only used by the batch mode
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# ------------------------------- Filter types ---------------------------------
+
+MEDIAN = "median"
+EMA = "ema"
+KALMAN = "kalman"
+
+# default rejection limits (cm)
+_MIN_DISTANCE = 0
+_MAX_DISTANCE = 400
+_OUTLIER_DISTANCE = 50
+_MAX_OUTLIERS = 3
+
+
+# ------------------------------- Base filter ----------------------------------
+
+class RangeFilter(object):
+    """
+    Common part of the range filters: sample validation, outlier rejection and counters.
+    Subclasses implement _reset, _estimate and _accept.
+    """
+
+    def __init__(self, min_distance=_MIN_DISTANCE, max_distance=_MAX_DISTANCE,
+                 outlier_distance=_OUTLIER_DISTANCE, max_outliers=_MAX_OUTLIERS):
+        """
+        :param min_distance: readings below this distance are invalid
+        :param max_distance: readings above this distance are invalid
+        :param outlier_distance: readings further than this from the estimate are outliers
+        (None: no outlier rejection)
+        :param max_outliers: consecutive outliers after which the filter restarts from the
+        latest reading
+        """
+        self._min_distance = min_distance
+        self._max_distance = max_distance
+        self._outlier_distance = outlier_distance
+        self._max_outliers = max_outliers
+
+        self._outliers_in_row = 0
+
+        self.accepted = 0
+        self.invalid = 0
+        self.outliers = 0
+
+        self._reset()
+
+    @property
+    def value(self):
+        """current estimate, None before the first valid reading"""
+        return self._estimate()
+
+    # feed one reading
+    def update(self, distance, timestamp=None):
+        """
+        Filters one reading
+        :param distance: measured distance (-1 or None for a failed measurement)
+        :param timestamp: time of the reading in seconds (micro_sleep.monotonic), used by
+        the Kalman filter
+        :return: estimate after the reading, None before the first valid reading
+        """
+        # failed or out of range reading
+        if distance is None or not (self._min_distance <= distance <= self._max_distance):
+
+            self.invalid += 1
+            return self._estimate()
+
+        estimate = self._estimate()
+
+        # jump from the current estimate
+        if estimate is not None and self._outlier_distance is not None and \
+                abs(distance - estimate) > self._outlier_distance:
+
+            self._outliers_in_row += 1
+
+            if self._outliers_in_row <= self._max_outliers:
+
+                self.outliers += 1
+                return estimate
+
+            # the jump persisted, follow it
+            self._reset()
+
+        self._outliers_in_row = 0
+        self.accepted += 1
+        self._accept(distance, timestamp)
+
+        return self._estimate()
+
+    # drop the filter state
+    def reset(self):
+        """
+        Forgets previous readings (counters are kept)
+        :return: None
+        """
+        self._outliers_in_row = 0
+        self._reset()
+
+    # filter counters
+    def stats(self):
+        """
+        :return: dict(accepted, invalid, outliers) reading counts
+        """
+        return dict(accepted=self.accepted, invalid=self.invalid, outliers=self.outliers)
+
+    def _reset(self):
+        raise NotImplementedError
+
+    def _estimate(self):
+        raise NotImplementedError
+
+    def _accept(self, distance, timestamp):
+        raise NotImplementedError
+
+
+# ------------------------------- Running median -------------------------------
+
+class MedianFilter(RangeFilter):
+    """
+    Median of the last `window` valid readings. Readings are kept in arrival order
+    (to drop the oldest) and in a sorted list (to read the median), the sorted
+    position is found with bisect.
+    """
+
+    def __init__(self, window=5, **kwargs):
+        self._window = max(1, int(window))
+        RangeFilter.__init__(self, **kwargs)
+
+    def _reset(self):
+        self._readings = deque()
+        self._sorted = list()
+
+    def _estimate(self):
+
+        count = len(self._sorted)
+
+        if not count:
+            return None
+
+        if count & 1:
+            return self._sorted[count // 2]
+
+        return (self._sorted[count // 2 - 1] + self._sorted[count // 2]) / 2.0
+
+    def _accept(self, distance, timestamp):
+
+        if len(self._readings) == self._window:
+            del self._sorted[bisect_left(self._sorted, self._readings.popleft())]
+
+        self._readings.append(distance)
+        insort(self._sorted, distance)
+
+
+# -------------------------- Exponential moving average ------------------------
+
+class EMAFilter(RangeFilter):
+    """
+    Exponential moving average, estimate += alpha * (reading - estimate)
+    """
+
+    def __init__(self, alpha=0.3, **kwargs):
+        self._alpha = float(alpha)
+        RangeFilter.__init__(self, **kwargs)
+
+    def _reset(self):
+        self._value = None
+
+    def _estimate(self):
+        return self._value
+
+    def _accept(self, distance, timestamp):
+
+        if self._value is None:
+            self._value = float(distance)
+        else:
+            self._value += self._alpha * (distance - self._value)
+
+
+# ------------------------------- Kalman filter --------------------------------
+
+class KalmanFilter(RangeFilter):
+    """
+    1-D constant velocity Kalman filter, the state is (distance, velocity) and only the
+    distance is measured. The time step comes from the reading timestamps (period
+    without timestamps).
+    """
+
+    def __init__(self, process_noise=50.0, measurement_noise=4.0, period=0.1, **kwargs):
+        """
+        :param process_noise: acceleration variance (cm^2/s^4)
+        :param measurement_noise: reading variance (cm^2)
+        :param period: time step used for readings without a timestamp (seconds)
+        """
+        self._q = float(process_noise)
+        self._r = float(measurement_noise)
+        self._period = period
+        RangeFilter.__init__(self, **kwargs)
+
+    @property
+    def velocity(self):
+        """estimated rate of change of the distance (cm/s), negative when closing in"""
+        return self._v
+
+    def _reset(self):
+
+        self._x = None
+        self._v = 0.0
+        self._timestamp = None
+
+        # covariance [[p00, p01], [p01, p11]]
+        self._p00, self._p01, self._p11 = self._r, 0.0, 1e4
+
+    def _estimate(self):
+        return self._x
+
+    def _accept(self, distance, timestamp):
+
+        if self._x is None:
+
+            self._x = float(distance)
+            self._timestamp = timestamp
+            return None
+
+        dt = self._period
+
+        if timestamp is not None and self._timestamp is not None and timestamp > self._timestamp:
+            dt = timestamp - self._timestamp
+
+        self._timestamp = timestamp
+
+        # predict
+        x = self._x + self._v * dt
+
+        p00 = self._p00 + dt * (2 * self._p01 + dt * self._p11) + self._q * dt ** 4 / 4
+        p01 = self._p01 + dt * self._p11 + self._q * dt ** 3 / 2
+        p11 = self._p11 + self._q * dt ** 2
+
+        # update with the measured distance
+        innovation = distance - x
+        s = p00 + self._r
+        k0, k1 = p00 / s, p01 / s
+
+        self._x = x + k0 * innovation
+        self._v += k1 * innovation
+
+        self._p00 = (1 - k0) * p00
+        self._p01 = (1 - k0) * p01
+        self._p11 = p11 - k1 * p01
+
+
+# ---------------------------------- Factory -----------------------------------
+
+_FILTERS = {
+        MEDIAN: MedianFilter,
+        EMA: EMAFilter,
+        KALMAN: KalmanFilter
+}
+
+
+# create a filter by name
+def create_filter(kind=MEDIAN, **kwargs):
+    """
+    Creates a range filter
+    :param kind: MEDIAN, EMA or KALMAN
+    :param kwargs: filter parameters (window, alpha, process_noise, ...) and rejection
+    limits (min_distance, max_distance, outlier_distance, max_outliers)
+    :return: filter instance
+    """
+    if kind not in _FILTERS:
+        raise ValueError("Unknown range filter: {}".format(kind))
+
+    return _FILTERS[kind](**kwargs)
+
+
+# ------------------------------- Batch replay ---------------------------------
+
+# filter a recorded session
+def filter_batch(kind, distances, timestamps=None, **kwargs):
+    """
+    Filters a recorded session of readings. With numpy, invalid readings are rejected
+    and the running median is computed vectorized (outlier rejection doesn't apply to
+    the vectorized median, the median already ignores isolated spikes). EMA and Kalman
+    are recursive and are replayed through the streaming filter.
+    :param kind: MEDIAN, EMA or KALMAN
+    :param distances: readings
+    :param timestamps: reading times in seconds (optional)
+    :param kwargs: filter parameters, see create_filter
+    :return: list of estimates (None before the first valid reading)
+    """
+    if np is None or kind != MEDIAN or not hasattr(np.lib.stride_tricks, "sliding_window_view"):
+
+        range_filter = create_filter(kind, **kwargs)
+        timestamps = timestamps if timestamps is not None else [None] * len(distances)
+
+        return [range_filter.update(d, t) for d, t in zip(distances, timestamps)]
+
+    window = max(1, int(kwargs.get("window", 5)))
+    readings = np.asarray(distances, dtype=float)
+
+    valid = (readings >= kwargs.get("min_distance", _MIN_DISTANCE)) & \
+            (readings <= kwargs.get("max_distance", _MAX_DISTANCE))
+
+    # window over the valid readings only, like the streaming filter
+    compact = readings[valid]
+
+    if not len(compact):
+        return [None] * len(readings)
+
+    padded = np.concatenate((np.full(window - 1, np.nan), compact))
+    medians = np.nanmedian(np.lib.stride_tricks.sliding_window_view(padded, window), axis=1)
+
+    # every reading gets the median after the last valid reading so far
+    index = np.cumsum(valid) - 1
+    estimates = np.where(index >= 0, medians[np.maximum(index, 0)], np.nan)
+
+    return [None if np.isnan(e) else float(e) for e in estimates]
+
+
+if __name__ == '__main__':
+
+    import random
+
+    # a car closing in on a wall at 20 cm/s, readings every 0.1 s with noise,
+    # timeouts and echo spikes
+    session = list()
+
+    for n in range(100):
+
+        true_distance = 200 - 20 * n * 0.1
+
+        if n % 17 == 0:
+            reading = -1
+        elif n % 23 == 0:
+            reading = true_distance + 150
+        else:
+            reading = true_distance + random.gauss(0, 2)
+
+        session.append((true_distance, reading, n * 0.1))
+
+    for kind in (MEDIAN, EMA, KALMAN):
+
+        range_filter = create_filter(kind)
+        errors = list()
+
+        for true_distance, reading, timestamp in session:
+
+            estimate = range_filter.update(reading, timestamp)
+
+            if estimate is not None and true_distance > 0:
+                errors.append(abs(estimate - true_distance))
+
+        print("{:8s}: mean error {:6.2f} cm, max error {:6.2f} cm, {}".format(
+                kind, sum(errors) / len(errors), max(errors), range_filter.stats()))
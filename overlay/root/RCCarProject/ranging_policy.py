@@ -0,0 +1,95 @@
+#!/usr/bin/env python2
+
+#
+# Ultrasonic ranging rate policies
+# A policy maps the car motion (speed, whether it moves towards the measured obstacle)
+# and the last measured distance to a ranging rate. RCCar re-evaluates its policy when
+# the car moves and on every reading, and retunes the ultrasonic array.
+# FixedRatePolicy     : constant rate (the behaviour before policies)
+# AdaptiveRatePolicy  : fast when closing in on an obstacle, a trickle when stopped or
+#                       moving away from it
+#
+
+# --------------------------------- Motions ------------------------------------
+
+STOPPED = "stopped"
+APPROACHING = "approaching"
+RECEDING = "receding"
+TURNING = "turning"
+
+
+class RangingPolicy(object):
+    """
+    Base ranging policy, subclasses implement rate
+    """
+
+    # ranging rate for the current motion
+    def rate(self, speed, motion, distance):
+        """
+        :param speed: car speed % [0:100]
+        :param motion: STOPPED, APPROACHING (moving towards the measured obstacle),
+        RECEDING (moving away from it) or TURNING (rotating in place)
+        :param distance: last measured distance in cm, None or -1 if unknown
+        :return: measurements per second
+        """
+        raise NotImplementedError
+
+
+class FixedRatePolicy(RangingPolicy):
+    """
+    Ranges at a constant rate whatever the car does
+    """
+
+    def __init__(self, rate=10):
+        self._rate = rate
+
+    def rate(self, speed, motion, distance):
+        return self._rate
+
+
+class AdaptiveRatePolicy(RangingPolicy):
+    """
+    Ranges often enough that the car drives at most `travel` cm between two readings,
+    and takes at least `readings` readings in the time it needs to reach the obstacle.
+    A stopped car or a car moving away from the obstacle ranges at min_rate.
+    """
+
+    def __init__(self, min_rate=1.0, max_rate=40.0, full_speed=100.0, travel=5.0, readings=10):
+        """
+        :param min_rate: rate when stopped or receding (Hz)
+        :param max_rate: rate limit (Hz), the sensor latency budget bounds it too
+        :param full_speed: car speed at 100% in cm/s
+        :param travel: longest distance driven between two readings (cm)
+        :param readings: readings taken before reaching the obstacle
+        """
+        self._min_rate = float(min_rate)
+        self._max_rate = float(max_rate)
+        self._full_speed = float(full_speed)
+        self._travel = float(travel)
+        self._readings = readings
+
+    def rate(self, speed, motion, distance):
+
+        # nothing gets closer
+        if motion in (STOPPED, RECEDING) or speed <= 0:
+            return self._min_rate
+
+        velocity = self._full_speed * speed / 100.0
+        rate = velocity / self._travel
+
+        # closing in, keep up with the time left to the obstacle
+        if motion == APPROACHING and distance is not None and distance > 0:
+            rate = max(rate, self._readings * velocity / distance)
+
+        return min(self._max_rate, max(self._min_rate, rate))
+
+
+if __name__ == '__main__':
+
+    policy = AdaptiveRatePolicy()
+
+    for motion, speed, distance in ((STOPPED, 0, 100), (RECEDING, 50, 100), (TURNING, 50, None),
+                                    (APPROACHING, 20, 300), (APPROACHING, 50, 100), (APPROACHING, 100, 30)):
+
+        print("{:12s} speed {:3d}% distance {:>5} cm : {:5.1f} Hz".format(motion, speed, str(distance),
+                                                                        policy.rate(speed, motion, distance)))
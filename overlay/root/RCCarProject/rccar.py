@@ -1,9 +1,17 @@
 #!/usr/bin/env python2
 
 import logging as log
+import threading as thread
 
+import gpiolib as gpio
 import motor_controller as motor
 import ultrasonic
+import ultrasonic_array as us_array
+import ranging_policy
+import speed_controller
+import motor_ramp
+import drive_train
+import drive_mixer
 
 # ---------------- Logging/Debug configurations ---------------
 
@@ -43,6 +51,37 @@ BACKWARD_RIGHT = 6
 BACKWARD_LEFT = 7
 STOP = 8
 
+# ------------------------------- Motors ---------------------------------------
+
+LEFT_MOTOR = "left"
+RIGHT_MOTOR = "right"
+
+# direction presets: (throttle sign, steering sign, steer by the turn rate, or all the
+# way for a rotation in place)
+_PRESETS = {
+        FORWARD: (1, 0, False),
+        BACKWARD: (-1, 0, False),
+        ROTATE_RIGHT: (1, 1, False),
+        ROTATE_LEFT: (1, -1, False),
+        FORWARD_RIGHT: (1, 1, True),
+        FORWARD_LEFT: (1, -1, True),
+        BACKWARD_RIGHT: (-1, 1, True),
+        BACKWARD_LEFT: (-1, -1, True)
+}
+
+# sensor facing each direction of travel
+_TRAVEL_SENSORS = {
+        FORWARD: us_array.FRONT,
+        FORWARD_RIGHT: us_array.FRONT,
+        FORWARD_LEFT: us_array.FRONT,
+        BACKWARD: us_array.REAR,
+        BACKWARD_RIGHT: us_array.REAR,
+        BACKWARD_LEFT: us_array.REAR
+}
+
+# relative ranging rate change below which the ultrasonic array isn't retuned
+_RATE_HYSTERESIS = 0.1
+
 # ------------------------------ RC Car Controller -----------------------------
 
 
@@ -54,6 +93,7 @@ class RCCar(object):
         self.right_motor = None
         self.left_motor = None
         self.ultrasonic = None
+        self.ultrasonic_array = None
 
         self._left_motor_pin_1 = lm_pin_1
         self._left_motor_pin_2 = lm_pin_2
@@ -69,7 +109,55 @@ class RCCar(object):
         self._ultrasonic_min_distance = kwargs.get("us_min_distance", 5)
         self._ultrasonic_max_distance = kwargs.get("us_max_distance", 300)
 
+        # ultrasonic ranging service rate in Hz (None: measure on every get_distance call)
+        self._ultrasonic_ranging_rate = kwargs.get("us_ranging_rate", None)
+
+        # more sensors besides the front one {direction: (trig pin, echo pin)}, and the
+        # exclusion groups of sensors hearing each other (None: all of them do)
+        self._ultrasonic_sensors = kwargs.get("us_sensors", {})
+        self._ultrasonic_groups = kwargs.get("us_exclusion_groups", None)
+
+        # ranging rate policy (ranging_policy.RangingPolicy), re-evaluated when the car
+        # moves and on every reading of the sensor facing the direction of travel
+        self._ultrasonic_rate_policy = kwargs.get("us_rate_policy", None)
+        self._ranging_lock = thread.Lock()
+
         self._motor_min_speed = kwargs.get("motor_min_speed", 0)
+        self._motor_pwm_type = kwargs.get("motor_pwm_type", motor.SOFTWARE_PWM)
+
+        # wheel encoder pins (None: no speed measurement), pulses per revolution and
+        # wheel diameter in cm
+        self._left_encoder_pin = kwargs.get("lm_encoder_pin", None)
+        self._right_encoder_pin = kwargs.get("rm_encoder_pin", None)
+        self._encoder_slots = kwargs.get("encoder_slots", 20)
+        self._wheel_diameter = kwargs.get("wheel_diameter", 6.5)
+
+        # closed loop speed control with both encoders: wheel RPM at 100% speed (None:
+        # open loop duty cycle), control loop rate in Hz and PID gains (kp, ki, kd)
+        self._max_rpm = kwargs.get("max_rpm", None)
+        self._speed_loop_rate = kwargs.get("speed_loop_rate", 50)
+        self._speed_gains = kwargs.get("speed_gains", None)
+        self.speed_controller = None
+
+        # motor speed ramping: duty cycle change limit in % per second (None: speed and
+        # direction steps are applied at once), coasting time of a reversal in seconds
+        self._motor_acceleration = kwargs.get("motor_acceleration", None)
+        self._reversal_dead_time = kwargs.get("reversal_dead_time", 0.05)
+        self.motor_ramp = None
+
+        # both motors applied together (drive_train.DriveTrain)
+        self.drive_train = None
+
+        # (throttle, steering) mixing into wheel duty cycles, steering curve [0:1]
+        self._mixer = drive_mixer.DriveMixer(steering_expo=kwargs.get("steering_expo", 0.0))
+        self._drive_command = None
+
+        # export and configure all car pins in one pass before the modules claim them
+        self._bulk_init = kwargs.get("bulk_init", True)
+
+        # pin journal file, and re-adopting the pins it lists (restart after a crash)
+        self._pin_journal = kwargs.get("pin_journal", None)
+        self._warm_start = kwargs.get("warm_start", False)
 
         assert all(
                 [
@@ -95,16 +183,26 @@ class RCCar(object):
     # initialize car components
     def initialize(self):
         """
-        Initialize car components (left motor, right motor, ultrasonic)
+        Initialize car components (left motor, right motor, ultrasonic, wheel encoders)
         :return: error code that indicates if the car components were initialized successfully
         """
         err_code = SUCCESS
 
+        if self._pin_journal is not None:
+            gpio.set_pin_journal(self._pin_journal)
+
+        # re-adopt the pins a crashed run left exported
+        if self._warm_start:
+            gpio.adopt_journaled_pins()
+
+        # bring up all GPIO pins at once, the modules adopt them
+        if self._bulk_init:
+            self._bring_up_pins()
+
         # create instances of car modules 9left motor, right motor, ultrasonic)
-        self.right_motor = motor.MotorControl(min_speed=self._motor_min_speed)
-        self.left_motor = motor.MotorControl(min_speed=self._motor_min_speed)
-        self.ultrasonic = ultrasonic.UltrasonicSensor(min_distance=self._ultrasonic_min_distance,
-                                                      max_distance=self._ultrasonic_max_distance, sound_speed=34000)
+        self.right_motor = motor.MotorControl(min_speed=self._motor_min_speed, pwm_type=self._motor_pwm_type)
+        self.left_motor = motor.MotorControl(min_speed=self._motor_min_speed, pwm_type=self._motor_pwm_type)
+        self.ultrasonic_array = us_array.UltrasonicArray(groups=self._ultrasonic_groups)
 
         # initialize car modules
         left_motor = self.right_motor.init_motor(
@@ -119,11 +217,43 @@ class RCCar(object):
                 pwm_pin=self._left_motor_pwm_pin
         )
 
-        ranger = self.ultrasonic.init_ultrasonic(
+        ranger = self.ultrasonic_array.add_sensor(
+                us_array.FRONT,
                 trig_pin=self._ultrasonic_trig_pin,
-                echo_pin=self._ultrasonic_echo_pin
+                echo_pin=self._ultrasonic_echo_pin,
+                min_distance=self._ultrasonic_min_distance,
+                max_distance=self._ultrasonic_max_distance
         )
 
+        for direction, (trig_pin, echo_pin) in sorted(self._ultrasonic_sensors.items()):
+
+            if ranger != ultrasonic.SUCCESS:
+                break
+
+            ranger = self.ultrasonic_array.add_sensor(
+                    direction,
+                    trig_pin=trig_pin,
+                    echo_pin=echo_pin,
+                    min_distance=self._ultrasonic_min_distance,
+                    max_distance=self._ultrasonic_max_distance
+            )
+
+        # front sensor
+        self.ultrasonic = self.ultrasonic_array.sensor(us_array.FRONT)
+
+        # wheel encoders
+        encoders = motor.SUCCESS
+
+        for car_motor, encoder_pin in ((self.left_motor, self._left_encoder_pin),
+                                       (self.right_motor, self._right_encoder_pin)):
+
+            if encoder_pin is not None and encoders == motor.SUCCESS:
+                encoders = car_motor.init_encoder(encoder_pin, slots=self._encoder_slots,
+                                                  wheel_diameter=self._wheel_diameter)
+
+        # pins of modules that failed to claim them
+        gpio.release_pins()
+
         # if initializing left motor was successful
         if left_motor != motor.SUCCESS:
 
@@ -142,17 +272,101 @@ class RCCar(object):
             err_code = ERR_ERROR
             log.critical("Ultrasonic failed to initialize!")
 
+        # if initializing the wheel encoders was successful
+        elif encoders != motor.SUCCESS:
+
+            err_code = ERR_ERROR
+            log.critical("Wheel encoders failed to initialize!")
+
         else:
 
             self._state = READY
             log.debug("Car modules initialized successfully!")
 
+            self.drive_train = drive_train.DriveTrain({LEFT_MOTOR: self.left_motor, RIGHT_MOTOR: self.right_motor})
+
+            # hold the wheel speeds with the encoders
+            if self._max_rpm and self.left_motor.encoder is not None and self.right_motor.encoder is not None:
+                self._start_speed_control()
+
+            # ramp the motor speeds
+            if self._motor_acceleration:
+
+                self.motor_ramp = motor_ramp.RampEngine(acceleration=self._motor_acceleration,
+                                                        dead_time=self._reversal_dead_time,
+                                                        listener=self._on_ramp_step,
+                                                        drive_train=self.drive_train)
+
+                self.motor_ramp.add_motor(LEFT_MOTOR, self.left_motor)
+                self.motor_ramp.add_motor(RIGHT_MOTOR, self.right_motor)
+                self.motor_ramp.start()
+
+            # measure distances in the background
+            if self._ultrasonic_rate_policy is not None:
+
+                self.ultrasonic_array.start(self._ranging_policy_rate())
+
+                for direction in (us_array.FRONT, us_array.REAR):
+
+                    if self.ultrasonic_array.sensor(direction) is not None:
+                        self.ultrasonic_array.sensor(direction).add_sample_listener(self._on_ultrasonic_sample)
+
+            elif self._ultrasonic_ranging_rate:
+                self.ultrasonic_array.start(self._ultrasonic_ranging_rate)
+
+        return err_code
+
+    # export and configure car pins in bulk
+    def _bring_up_pins(self):
+        """
+        Exports all car GPIO pins in one pass and configures their direction and initial
+        value in bulk (see gpiolib.export_pins), motor and ultrasonic modules adopt the
+        prepared pins. On failure the modules bring their pins up one by one.
+        :return: error code of gpiolib.export_pins
+        """
+        pins = {
+                self._left_motor_pin_1: (gpio.OUTPUT, gpio.LOW),
+                self._left_motor_pin_2: (gpio.OUTPUT, gpio.LOW),
+                self._right_motor_pin_1: (gpio.OUTPUT, gpio.LOW),
+                self._right_motor_pin_2: (gpio.OUTPUT, gpio.LOW),
+                self._ultrasonic_trig_pin: (gpio.OUTPUT, gpio.LOW),
+                self._ultrasonic_echo_pin: (gpio.INPUT, None)
+        }
+
+        for trig_pin, echo_pin in self._ultrasonic_sensors.values():
+
+            pins[trig_pin] = (gpio.OUTPUT, gpio.LOW)
+            pins[echo_pin] = (gpio.INPUT, None)
+
+        for encoder_pin in (self._left_encoder_pin, self._right_encoder_pin):
+
+            if encoder_pin is not None:
+                pins[encoder_pin] = (gpio.INPUT, None)
+
+        # hardware PWM enable pins are driven through /sys/class/pwm, not exported as GPIO
+        if self._motor_pwm_type != motor.HARDWARE_PWM:
+
+            pins[self._left_motor_pwm_pin] = (gpio.OUTPUT, gpio.LOW)
+            pins[self._right_motor_pwm_pin] = (gpio.OUTPUT, gpio.LOW)
+
+        # pins re-adopted by a warm start are ready already
+        for pin in gpio.prepared_pins():
+            pins.pop(pin, None)
+
+        if not pins:
+            return gpio.SUCCESS
+
+        err_code = gpio.export_pins(pins)
+
+        if err_code != gpio.SUCCESS:
+            log.warning("Bulk pin bring-up failed, initializing pins one by one.")
+
         return err_code
 
     # de-initialize car modules
     def deinit(self):
         """
-        De-initialize car components (left motor, right motor, ultrasonic)
+        De-initialize car components (left motor, right motor, ultrasonic, wheel encoders)
         :return: error code that indicates if car modules were de-initialized successfully
         """
         err_code = SUCCESS
@@ -160,15 +374,29 @@ class RCCar(object):
         # check if car is initialized
         if self._state != UNINITIALIZED:
 
+            # stop the ramps and the speed control loop before releasing the motors
+            if self.motor_ramp is not None:
+
+                self.motor_ramp.stop()
+                self.motor_ramp = None
+
+            if self.speed_controller is not None:
+
+                self.speed_controller.stop()
+                self.speed_controller = None
+
+            self.drive_train = None
+
             # deinit car modules
             self.right_motor.deinit_motor()
             self.left_motor.deinit_motor()
-            self.ultrasonic.deinit_ultrasonic()
+            self.ultrasonic_array.deinit()
 
             # reset car attributes
             self.right_motor = None
             self.left_motor = None
             self.ultrasonic = None
+            self.ultrasonic_array = None
 
             self._left_motor_pin_1 = None
             self._left_motor_pin_2 = None
@@ -227,84 +455,32 @@ class RCCar(object):
             self._state = RUNNING
             self._car_direction = direction
 
+            # continuous commands don't apply any more
+            self._drive_command = None
+
             # direction == stop
             if direction == STOP:
 
-                # stop both motors
-                self.right_motor.rotate_motor(direction=motor.BRAKE, speed=self._car_speed)
-                self.left_motor.rotate_motor(direction=motor.BRAKE, speed=self._car_speed)
+                # brake both motors
+                self._drive({RIGHT_MOTOR: (motor.BRAKE, self._car_speed), LEFT_MOTOR: (motor.BRAKE, self._car_speed)})
                 log.debug("Car braked!")
 
-            # direction == forward
-            elif direction == FORWARD:
-
-                # rotate both motors in the same direction (clockwise direction)
-                self.right_motor.rotate_motor(direction=motor.ROTATE_CW, speed=self._car_speed)
-                self.left_motor.rotate_motor(direction=motor.ROTATE_CW, speed=self._car_speed)
-                log.debug("Moving car in forward direction!")
-
-            # direction == backward
-            elif direction == BACKWARD:
-
-                # rotate both motors in the same direction (counter clockwise direction)
-                self.right_motor.rotate_motor(direction=motor.ROTATE_CCW, speed=self._car_speed)
-                self.left_motor.rotate_motor(direction=motor.ROTATE_CCW, speed=self._car_speed)
-                self._state = RUNNING
-                log.debug("Moving car in backwards direction!")
-
-            # direction == rotate right
-            elif direction == ROTATE_RIGHT:
-
-                # rotate both motors in the same direction (counter clockwise direction)
-                self.right_motor.rotate_motor(direction=motor.ROTATE_CCW, speed=self._car_speed)
-                self.left_motor.rotate_motor(direction=motor.ROTATE_CW, speed=self._car_speed)
-                self._state = RUNNING
-                log.debug("Rotating car to the right!")
-
-            # direction == rotate left
-            elif direction == ROTATE_LEFT:
-
-                self.right_motor.rotate_motor(direction=motor.ROTATE_CW, speed=self._car_speed)
-                self.left_motor.rotate_motor(direction=motor.ROTATE_CCW, speed=self._car_speed)
-                self._state = RUNNING
-                log.debug("Rotating car to the left!")
-
-            # direction == forward right
-            elif direction == FORWARD_RIGHT:
-
-                self.right_motor.rotate_motor(direction=motor.ROTATE_CW,
-                                              speed=(round(self._car_speed * self._car_turn_rate/100.0, 2))
-                                              )
-                self.left_motor.rotate_motor(direction=motor.ROTATE_CW, speed=self._car_speed)
-                self._state = RUNNING
-                log.debug("Turning car to the right!")
-
-            elif direction == FORWARD_LEFT:
-
-                self.right_motor.rotate_motor(direction=motor.ROTATE_CW, speed=self._car_speed)
-                self.left_motor.rotate_motor(direction=motor.ROTATE_CW,
-                                             speed=(round(self._car_speed * self._car_turn_rate/100.0, 2))
-                                             )
-                self._state = RUNNING
-                log.debug("Turning car to the left!")
-
-            elif direction == BACKWARD_RIGHT:
-
-                self.right_motor.rotate_motor(direction=motor.ROTATE_CCW,
-                                              speed=(round(self._car_speed * self._car_turn_rate/100.0, 2))
-                                              )
-                self.left_motor.rotate_motor(direction=motor.ROTATE_CCW, speed=self._car_speed)
-                self._state = RUNNING
-                log.debug("Turning car to the right!")
-
-            elif direction == BACKWARD_LEFT:
-
-                self.right_motor.rotate_motor(direction=motor.ROTATE_CCW, speed=self._car_speed)
-                self.left_motor.rotate_motor(direction=motor.ROTATE_CCW,
-                                             speed=(round(self._car_speed * self._car_turn_rate/100.0, 2))
-                                             )
-                self._state = RUNNING
-                log.debug("Turning car to the left!")
+            # throttle and steering of the direction
+            elif direction in _PRESETS:
+
+                throttle_sign, steering_sign, turning = _PRESETS[direction]
+
+                # the inner wheel runs at turn rate % of the outer one, or backwards
+                steering = self._mixer.steering(self._car_turn_rate / 100.0) if turning else 100.0
+
+                # wheel directions at 0% speed (speed or turn rate 0)
+                outer = motor.ROTATE_CW if throttle_sign > 0 else motor.ROTATE_CCW
+                inner = outer if turning or not steering_sign else \
+                    (motor.ROTATE_CCW if throttle_sign > 0 else motor.ROTATE_CW)
+
+                self._mix(throttle_sign * self._car_speed, steering_sign * steering,
+                          (outer, inner) if steering_sign >= 0 else (inner, outer))
+                log.debug("Moving car in direction {}!".format(direction))
 
             else:
 
@@ -312,8 +488,100 @@ class RCCar(object):
                 log.debug("Invalid direction: {}".format(direction))
                 err_code = ERR_INVALID_ARGUMENT
 
+            # wheel speeds the speed control loop holds
+            self._update_speed_targets()
+
+            # range faster or slower for the new motion
+            self._adapt_ranging_rate()
+
         return err_code
 
+    # drive the car with continuous throttle and steering
+    def drive(self, throttle, steering=0):
+        """
+        Drives the car with continuous controls (joystick, autonomous loops), mixed into
+        left / right wheel duty cycles (see drive_mixer.DriveMixer)
+        :param throttle: speed % [-100:100], negative backwards
+        :param steering: steering % [-100:100], positive to the right: 0 straight, the
+        inner wheel slows down to a stop at 50 and turns backwards up to 100 (rotation in
+        place)
+        :return: error code that indicates if the car moved successfully
+        """
+        err_code = SUCCESS
+
+        # check if car is initialized
+        if self._state == UNINITIALIZED:
+
+            log.error("Trying to drive car before initialization!")
+            err_code = ERR_ERROR
+
+        # check the command range
+        elif not (-100 <= throttle <= 100 and -100 <= steering <= 100):
+
+            log.error("Invalid drive command: throttle {}, steering {}!".format(throttle, steering))
+            err_code = ERR_INVALID_ARGUMENT
+
+        else:
+
+            self._state = RUNNING
+            self._car_speed = abs(throttle)
+            self._car_direction = self._nearest_direction(throttle, steering)
+            self._drive_command = (throttle, steering)
+
+            self._mix(throttle, steering)
+
+            # wheel speeds the speed control loop holds
+            self._update_speed_targets()
+
+            # range faster or slower for the new motion
+            self._adapt_ranging_rate()
+
+        return err_code
+
+    # apply a throttle and steering command
+    def _mix(self, throttle, steering, idle_directions=(motor.STOP, motor.STOP)):
+        """
+        :param throttle: speed % [-100:100]
+        :param steering: steering % [-100:100]
+        :param idle_directions: (left, right) directions of wheels mixed to 0% (presets
+        keep their rotation directions at 0% speed)
+        :return: error code of _drive
+        """
+        commands = dict()
+
+        for name, duty, idle in zip((LEFT_MOTOR, RIGHT_MOTOR), self._mixer.mix(throttle, steering), idle_directions):
+
+            duty = round(duty, 2)
+
+            if duty > 0:
+                commands[name] = (motor.ROTATE_CW, duty)
+            elif duty < 0:
+                commands[name] = (motor.ROTATE_CCW, -duty)
+            else:
+                commands[name] = (idle, 0)
+
+        return self._drive(commands)
+
+    # direction preset closest to a command
+    @staticmethod
+    def _nearest_direction(throttle, steering):
+        """
+        :param throttle: speed % [-100:100]
+        :param steering: steering % [-100:100]
+        :return: direction constant (the ranging policy and the rear sensor use it)
+        """
+        if throttle == 0:
+            return STOP
+
+        # rotation in place
+        if abs(steering) >= 100:
+            return ROTATE_RIGHT if (steering > 0) == (throttle > 0) else ROTATE_LEFT
+
+        if throttle > 0:
+            return FORWARD if not steering else (FORWARD_RIGHT if steering > 0 else FORWARD_LEFT)
+
+        return BACKWARD if not steering else (BACKWARD_RIGHT if steering > 0 else BACKWARD_LEFT)
+
     # change motor parameters
     def change_car_params(self, speed=None, turn_rate=None):
         """
@@ -334,8 +602,13 @@ class RCCar(object):
             self._car_turn_rate = turn_rate
             log.debug("Changed turn rate to: {}!".format(speed))
 
-        # update motors
-        if (self._state != STOPPED and self._state != UNINITIALIZED) and self._car_direction is not None:
+        # update motors, a continuous command keeps its steering
+        if (self._state != STOPPED and self._state != UNINITIALIZED) and self._drive_command is not None:
+
+            throttle, steering = self._drive_command
+            self.drive(self._car_speed if throttle >= 0 else -self._car_speed, steering)
+
+        elif (self._state != STOPPED and self._state != UNINITIALIZED) and self._car_direction is not None:
             self.move(self._car_direction, self._car_speed)
 
         return err_code
@@ -348,6 +621,115 @@ class RCCar(object):
         """
         return self._car_speed
 
+    # start closed loop speed control
+    def _start_speed_control(self):
+        """
+        Starts the speed control loop of both motors, move() sets their target RPM from
+        the speed % and the turn rate
+        :return: error code of SpeedController.start
+        """
+        kp, ki, kd = self._speed_gains if self._speed_gains is not None else (0.1, 0.5, 0.0)
+
+        self.speed_controller = speed_controller.SpeedController(rate=self._speed_loop_rate, kp=kp, ki=ki, kd=kd,
+                                                                 max_rpm=self._max_rpm,
+                                                                 min_duty=self._motor_min_speed)
+
+        self.speed_controller.add_motor(LEFT_MOTOR, self.left_motor)
+        self.speed_controller.add_motor(RIGHT_MOTOR, self.right_motor)
+
+        err_code = self.speed_controller.start()
+
+        if err_code != speed_controller.SUCCESS:
+
+            log.error("Speed control failed to start, driving open loop!")
+            self.speed_controller = None
+
+        return err_code
+
+    # rotate the motors, ramped if ramping is on
+    def _drive(self, commands):
+        """
+        :param commands: {LEFT_MOTOR / RIGHT_MOTOR: (direction, speed)}, directions are
+        motor_controller.ROTATE_CW, ROTATE_CCW, STOP or BRAKE, speeds % [0:100]
+        :return: error code of DriveTrain.commit or RampEngine.set_targets
+        """
+        if self.motor_ramp is not None:
+            return self.motor_ramp.set_targets(commands)
+
+        return self.drive_train.commit(commands)
+
+    # ramp step applied to a motor (caller or ramp timer thread)
+    def _on_ramp_step(self, name, direction, speed):
+
+        self._update_speed_target(name)
+
+    # target RPM of both motors
+    def _update_speed_targets(self):
+        """
+        A running motor is held at its commanded speed % of max_rpm, a stopped or braked
+        motor is released
+        :return: None
+        """
+        for name in (LEFT_MOTOR, RIGHT_MOTOR):
+            self._update_speed_target(name)
+
+    # target RPM of a motor
+    def _update_speed_target(self, name):
+
+        if self.speed_controller is None:
+            return
+
+        car_motor = self.left_motor if name == LEFT_MOTOR else self.right_motor
+
+        if car_motor.direction in (motor.ROTATE_CW, motor.ROTATE_CCW):
+            self.speed_controller.set_target(name, car_motor.speed * self._max_rpm / 100.0)
+        else:
+            self.speed_controller.set_target(name, 0)
+
+    # motor update skew
+    def drive_stats(self):
+        """
+        :return: DriveTrain.stats (left / right wheel skew of every move), None before
+        initialization
+        """
+        return self.drive_train.stats() if self.drive_train is not None else None
+
+    # speed control loop counters
+    def speed_control_stats(self):
+        """
+        :return: SpeedController.stats (loop period jitter, overruns, per motor target,
+        RPM and duty cycle), None without closed loop speed control
+        """
+        return self.speed_controller.stats() if self.speed_controller is not None else None
+
+    # measured wheel RPM
+    def get_rpm(self):
+        """
+        Returns the wheel RPM measured by the encoders
+        :return: (left RPM, right RPM), None for a motor without an encoder
+        """
+        return self.left_motor.get_rpm(), self.right_motor.get_rpm()
+
+    # measured wheel speeds
+    def get_wheel_speeds(self):
+        """
+        Returns the wheel surface speeds measured by the encoders
+        :return: (left speed, right speed) in cm/s, None for a motor without an encoder
+        """
+        return self.left_motor.get_wheel_speed(), self.right_motor.get_wheel_speed()
+
+    # measured car speed
+    def get_linear_speed(self):
+        """
+        Returns the car speed measured by the encoders, the mean of both wheel speeds (the
+        encoders don't see the rotation direction, a car turning in place reads its
+        wheel speed)
+        :return: speed in cm/s, None without encoders
+        """
+        speeds = [speed for speed in self.get_wheel_speeds() if speed is not None]
+
+        return sum(speeds) / len(speeds) if speeds else None
+
     # gets distance ahead of the car
     def get_distance(self):
         """
@@ -357,6 +739,97 @@ class RCCar(object):
         self._distance_to_object = self.ultrasonic.get_distance()
         return self._distance_to_object
 
+    # gets distances around the car
+    def get_distances(self):
+        """
+        Returns the distance to the nearest object in every direction with a sensor
+        :return: {direction: distance}, directions are ultrasonic_array.FRONT, REAR, LEFT,
+        RIGHT (or the names given in us_sensors), -1 for sensors without an echo
+        """
+        return self.ultrasonic_array.distances()
+
+    # ultrasonic ranging counters
+    def ranging_stats(self):
+        """
+        :return: ultrasonic array counters (see UltrasonicArray.stats), with the requested
+        rate, the effective rate of every sensor and the ranging CPU use
+        """
+        return self.ultrasonic_array.stats()
+
+    # ranging rate the policy asks for
+    def _ranging_policy_rate(self):
+        """
+        Evaluates the ranging policy for the current motion, the distance is the one of
+        the sensor facing the direction of travel
+        :return: measurements per second
+        """
+        direction = self._car_direction if self._state == RUNNING else STOP
+        sensor = self.ultrasonic_array.sensor(_TRAVEL_SENSORS.get(direction, us_array.FRONT))
+
+        if direction == STOP or self._car_speed <= 0:
+            motion = ranging_policy.STOPPED
+
+        elif direction in (ROTATE_RIGHT, ROTATE_LEFT):
+            motion = ranging_policy.TURNING
+
+        # no sensor looking where the car goes
+        elif sensor is None:
+            motion = ranging_policy.RECEDING
+            sensor = self.ultrasonic
+
+        else:
+            motion = ranging_policy.APPROACHING
+
+        return self._ultrasonic_rate_policy.rate(self._car_speed, motion, sensor.latest_sample()[0])
+
+    # retune the ultrasonic array for the current motion
+    def _adapt_ranging_rate(self):
+        """
+        Applies the ranging policy rate if it differs enough from the current one
+        :return: None
+        """
+        if self._ultrasonic_rate_policy is None or not self.ultrasonic_array.ranging:
+            return None
+
+        with self._ranging_lock:
+
+            rate = self._ranging_policy_rate()
+            current = self.ultrasonic_array.rate
+
+            if abs(rate - current) > _RATE_HYSTERESIS * current:
+
+                self.ultrasonic_array.set_rate(rate)
+                log.debug("Ultrasonic ranging rate changed to {:.1f} Hz".format(rate))
+
+        return None
+
+    # new reading of a travel direction sensor
+    def _on_ultrasonic_sample(self, sample):
+        self._adapt_ranging_rate()
+
+    # waits for a new distance reading
+    def wait_for_distance(self, sequence=None, timeout=None):
+        """
+        Waits for the next distance reading of the ultrasonic ranging service, measures in
+        the calling thread if the service is not running
+        :param sequence: sequence number of the last reading seen (None: the latest one)
+        :param timeout: maximum time to wait in seconds
+        :return: (err_code, (distance, timestamp, sequence, result)), err_code is SUCCESS if
+        a new reading arrived, result is the measurement result (ultrasonic.ECHO_OK, ...)
+        """
+        # measure inline, the reading is new if it was published after the current one
+        if not self.ultrasonic.ranging:
+
+            sequence = self.ultrasonic.latest_sample()[2]
+            self.ultrasonic.get_distance()
+
+        err_code, sample = self.ultrasonic.wait_for_sample(sequence, timeout)
+
+        if err_code == ultrasonic.SUCCESS:
+            self._distance_to_object = sample[0]
+
+        return err_code, sample
+
 
 if __name__ == '__main__':
 
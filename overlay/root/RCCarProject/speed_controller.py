@@ -0,0 +1,435 @@
+#!/usr/bin/env python2
+
+#
+# Closed loop motor speed control
+# One fixed rate loop thread runs a PID controller per motor: the wheel encoder RPM is
+# the measurement, the PWM duty cycle the output. The duty is a feed-forward term from
+# a duty -> RPM table learned while the wheels turn at a steady speed, plus the PID
+# correction, so the loop only has to correct what the table gets wrong (left / right
+# motor differences, battery droop).
+# Anti-windup: the integral only grows while the output isn't saturated in the
+# direction of the error and the encoder measures the wheel.
+#
+
+import threading as thread
+import logging as log
+from collections import deque
+
+import micro_sleep
+from micro_sleep import monotonic, thread_cpu_time
+
+# -------------------------------- Error codes ---------------------------------
+
+SUCCESS = 0
+_ERR_INVALID_PIN = 1
+_ERR_USED_PIN = 2
+_ERR_INVALID_CONFIG = 3
+_ERR_INVALID_ARGS = 4
+_ERR_ERROR = 5
+
+# loop periods kept for the timing statistics
+_TIMING_HISTORY = 256
+
+# relative speed error below which the wheel turns at a steady speed (table learning)
+_STEADY_ERROR = 0.05
+
+
+class FeedForwardTable(object):
+    """
+    Wheel RPM at evenly spaced duty cycles, starts as a straight line up to max_rpm and
+    learns the measured RPM of the duty cycles the motor runs at
+    """
+
+    def __init__(self, max_rpm, points=11, learning_rate=0.05, table=None):
+        """
+        :param max_rpm: RPM at 100% duty cycle, initial guess
+        :param points: duty cycles in the table, 0% to 100%
+        :param learning_rate: weight of a new measurement
+        :param table: RPM of each point (a table learned before)
+        """
+        self._step = 100.0 / (points - 1)
+        self._learning_rate = learning_rate
+
+        if table is not None and len(table) == points:
+            self._rpm = [float(rpm) for rpm in table]
+        else:
+            self._rpm = [max_rpm * i / (points - 1.0) for i in range(points)]
+
+    @property
+    def table(self):
+        """RPM of every table point (duty cycles 0% to 100%)"""
+        return list(self._rpm)
+
+    # learn the RPM of a duty cycle
+    def learn(self, duty, rpm):
+        """
+        Moves the two points around the duty cycle towards the measured RPM, weighted by
+        their distance to it
+        :param duty: duty cycle % [0:100]
+        :param rpm: RPM measured at that duty cycle
+        :return: None
+        """
+        position = min(max(duty, 0.0), 100.0) / self._step
+        low = min(int(position), len(self._rpm) - 2)
+        weight = position - low
+
+        predicted = self._rpm[low] * (1 - weight) + self._rpm[low + 1] * weight
+        error = rpm - predicted
+
+        self._rpm[low] += self._learning_rate * error * (1 - weight)
+        self._rpm[low + 1] += self._learning_rate * error * weight
+
+    # duty cycle for a RPM
+    def duty(self, rpm):
+        """
+        Inverse interpolation of the table (made monotonic, a flat or noisy table never
+        maps a higher RPM to a lower duty cycle)
+        :param rpm: target RPM
+        :return: duty cycle % [0:100]
+        """
+        previous_duty, previous_rpm = 0.0, self._rpm[0]
+
+        for i in range(1, len(self._rpm)):
+
+            point_duty, point_rpm = i * self._step, max(self._rpm[i], previous_rpm)
+
+            if rpm <= point_rpm:
+
+                if point_rpm == previous_rpm:
+                    return previous_duty
+
+                return previous_duty + (rpm - previous_rpm) / (point_rpm - previous_rpm) * self._step
+
+            previous_duty, previous_rpm = point_duty, point_rpm
+
+        return 100.0
+
+
+class _MotorLoop(object):
+    """
+    PID state of one motor
+    """
+
+    def __init__(self, motor, table):
+
+        self.motor = motor
+        self.table = table
+
+        self.target = 0.0
+        self.rpm = 0.0
+        self.duty = None
+        self.integral = 0.0
+        self.previous_rpm = None
+        self.saturated = 0
+
+
+class SpeedController(object):
+
+    def __init__(self, rate=50, kp=0.1, ki=0.5, kd=0.0, max_rpm=300, min_duty=0, max_duty=100, learn=True):
+        """
+        :param rate: control loop rate in Hz
+        :param kp: proportional gain (duty % per RPM)
+        :param ki: integral gain (duty % per RPM and second)
+        :param kd: derivative gain on the measurement (duty % per RPM/s)
+        :param max_rpm: RPM at 100% duty cycle, initial feed-forward table
+        :param min_duty: lowest duty cycle written while a target is set (motor minimum speed)
+        :param max_duty: highest duty cycle written
+        :param learn: learn the feed-forward tables while the loop runs
+        """
+        self._rate = float(rate)
+        self._kp = kp
+        self._ki = ki
+        self._kd = kd
+        self._max_rpm = max_rpm
+        self._min_duty = min_duty
+        self._max_duty = max_duty
+        self._learn = learn
+
+        # motor loops by name, in the order they were added
+        self._loops = dict()
+        self._names = list()
+        self._lock = thread.Lock()
+
+        self._running = False
+        self._thread = None
+
+        # loop timing
+        self._periods = deque(maxlen=_TIMING_HISTORY)
+        self._iterations = 0
+        self._overruns = 0
+        self._start_time = None
+        self._cpu_time = 0.0
+
+    # add a motor to the loop
+    def add_motor(self, name, motor, table=None):
+        """
+        :param name: motor name (e.g. "left", "right")
+        :param motor: motor_controller.MotorControl with an initialized encoder
+        :param table: learned feed-forward table of the motor (see FeedForwardTable.table)
+        :return: error code that indicates if the motor was added
+        """
+        # check the motor can be measured
+        if name in self._loops or motor.encoder is None:
+
+            log.error("Failed to add motor {} to the speed controller!".format(name))
+            log.debug("The motor exists already or has no wheel encoder.")
+            return _ERR_INVALID_ARGS
+
+        with self._lock:
+
+            self._loops[name] = _MotorLoop(motor, FeedForwardTable(self._max_rpm, table=table))
+            self._names.append(name)
+
+        return SUCCESS
+
+    @property
+    def names(self):
+        """motor names in the order they were added"""
+        return list(self._names)
+
+    # change the target speed of a motor
+    def set_target(self, name, rpm):
+        """
+        :param name: motor name
+        :param rpm: target RPM, 0 releases the motor (the loop stops writing its duty
+        cycle and the motor gets back its commanded speed)
+        :return: error code
+        """
+        loop = self._loops.get(name, None)
+
+        if loop is None or rpm < 0:
+
+            log.error("Invalid speed target {} for motor {}!".format(rpm, name))
+            return _ERR_INVALID_ARGS
+
+        with self._lock:
+
+            # start from the feed-forward duty, no stale correction
+            if rpm == 0 or loop.target == 0:
+
+                loop.integral = 0.0
+                loop.previous_rpm = None
+
+            loop.target = float(rpm)
+
+            if rpm == 0 and loop.duty is not None:
+
+                loop.duty = None
+                loop.motor.release_duty()
+
+        return SUCCESS
+
+    # target speed of a motor
+    def get_target(self, name):
+        """
+        :param name: motor name
+        :return: target RPM, 0 if the motor is released
+        """
+        return self._loops[name].target
+
+    # learned feed-forward table of a motor
+    def get_table(self, name):
+        """
+        :param name: motor name
+        :return: RPM at duty cycles 0% to 100% (FeedForwardTable.table)
+        """
+        return self._loops[name].table.table
+
+    # start the control loop
+    def start(self):
+        """
+        Starts the control loop thread
+        :return: error code that indicates if the loop started
+        """
+        if self._running or not self._loops or self._rate <= 0:
+
+            log.error("Failed to start the speed controller!")
+            log.debug("Already running, no motors or invalid rate: {}".format(self._rate))
+            return _ERR_INVALID_CONFIG
+
+        self._running = True
+        self._periods.clear()
+        self._iterations = 0
+        self._overruns = 0
+        self._start_time = monotonic()
+        self._cpu_time = 0.0
+
+        self._thread = thread.Thread(target=self._control_loop)
+        self._thread.setDaemon(True)
+        self._thread.setName("Speed_Controller")
+        self._thread.start()
+
+        return SUCCESS
+
+    # stop the control loop
+    def stop(self):
+        """
+        Stops the control loop, the motors get back their commanded speed
+        :return: 0
+        """
+        if self._running:
+
+            self._running = False
+            self._thread.join()
+            self._thread = None
+
+            for name in self._names:
+                self.set_target(name, 0)
+
+        return 0
+
+    @property
+    def running(self):
+        """True while the control loop runs"""
+        return self._running
+
+    # control loop counters
+    def stats(self):
+        """
+        :return: dict(rate, iterations, overruns, period, jitter, max_jitter, cpu_time,
+        cpu_load, motors), period is the mean measured loop period, jitter the standard
+        deviation and max_jitter the largest deviation of the period from 1/rate (s),
+        overruns count iterations that ended after the next deadline, motors is
+        {name: dict(target, rpm, duty, integral, saturated)}
+        """
+        periods = list(self._periods)
+        nominal = 1.0 / self._rate
+        elapsed = monotonic() - self._start_time if self._start_time is not None else 0
+
+        if periods:
+
+            mean = sum(periods) / len(periods)
+            jitter = (sum((p - nominal) ** 2 for p in periods) / len(periods)) ** 0.5
+            max_jitter = max(abs(p - nominal) for p in periods)
+
+        else:
+
+            mean, jitter, max_jitter = 0.0, 0.0, 0.0
+
+        motors = dict((name, dict(target=loop.target, rpm=loop.rpm, duty=loop.duty, integral=loop.integral,
+                                  saturated=loop.saturated))
+                      for name, loop in self._loops.items())
+
+        return dict(rate=self._rate,
+                    iterations=self._iterations,
+                    overruns=self._overruns,
+                    period=mean,
+                    jitter=jitter,
+                    max_jitter=max_jitter,
+                    cpu_time=self._cpu_time,
+                    cpu_load=self._cpu_time / elapsed if elapsed else 0.0,
+                    motors=motors)
+
+    # control loop thread
+    def _control_loop(self):
+
+        period = 1.0 / self._rate
+        cpu_start = thread_cpu_time()
+
+        deadline = monotonic()
+        previous = None
+
+        while self._running:
+
+            now = monotonic()
+
+            if previous is not None:
+                self._periods.append(now - previous)
+
+            dt = now - previous if previous is not None else period
+            previous = now
+
+            with self._lock:
+
+                for name in self._names:
+                    self._update(self._loops[name], dt)
+
+            self._iterations += 1
+            self._cpu_time = thread_cpu_time() - cpu_start
+
+            # fixed rate on an absolute schedule, missed deadlines are skipped
+            deadline += period
+
+            if monotonic() > deadline:
+
+                self._overruns += 1
+                deadline = monotonic()
+
+            micro_sleep.sleep_until(deadline)
+
+        return 0
+
+    # one PID step of a motor
+    def _update(self, loop, dt):
+        """
+        :param loop: _MotorLoop
+        :param dt: time since the previous step in seconds
+        :return: None
+        """
+        loop.rpm = loop.motor.get_rpm()
+
+        # released motor
+        if loop.target <= 0:
+            return
+
+        error = loop.target - loop.rpm
+
+        # derivative on the measurement, a target change doesn't kick the output
+        derivative = 0.0
+
+        if loop.previous_rpm is not None and dt > 0:
+            derivative = -(loop.rpm - loop.previous_rpm) / dt
+
+        loop.previous_rpm = loop.rpm
+
+        feed_forward = loop.table.duty(loop.target)
+        duty = feed_forward + self._kp * error + loop.integral + self._kd * derivative
+
+        # integrate unless the output is saturated in the direction of the error, or the
+        # wheel is still spinning up (the encoder reads 0 until it sees a few edges)
+        saturated = (duty >= self._max_duty and error > 0) or (duty <= self._min_duty and error < 0)
+
+        if loop.rpm > 0 and not saturated:
+            loop.integral += self._ki * error * dt
+
+        if duty > self._max_duty or duty < self._min_duty:
+            loop.saturated += 1
+
+        duty = min(max(duty, self._min_duty), self._max_duty)
+
+        # the wheel turns at a steady speed, the table learns what this duty cycle gives,
+        # the integral gives up what the feed-forward term takes over (no duty step)
+        if self._learn and loop.duty is not None and abs(error) <= _STEADY_ERROR * loop.target:
+
+            loop.table.learn(loop.duty, loop.rpm)
+            loop.integral -= loop.table.duty(loop.target) - feed_forward
+
+        if duty != loop.duty:
+
+            loop.duty = duty
+            loop.motor.apply_duty(duty)
+
+
+if __name__ == '__main__':
+
+    import time
+    import motor_controller as motor
+
+    m0 = motor.MotorControl()
+    m0.init_motor(pin_1=16, pin_2=20, pwm_pin=21)
+    m0.init_encoder(pin=12)
+
+    controller = SpeedController(rate=50, max_rpm=300)
+    controller.add_motor("left", m0)
+
+    m0.rotate_motor(direction=motor.ROTATE_CW, speed=50)
+    controller.set_target("left", 150)
+    controller.start()
+
+    for _ in range(10):
+
+        print(controller.stats())
+        time.sleep(.5)
+
+    controller.stop()
+    m0.deinit_motor()
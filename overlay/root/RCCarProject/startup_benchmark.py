@@ -0,0 +1,156 @@
+#!/usr/bin/env python2
+
+#
+# RC car cold start benchmark
+# Launches fresh python processes that bring the car up (RCCar.initialize) and
+# reports the time from process launch to the car being ready, with pins brought
+# up one by one (legacy), in bulk (gpiolib.export_pins) and re-adopted after a
+# simulated crash (warm start from the pin journal).
+# The GPIO backend is selected with --backend/--root, or RCCAR_GPIO_BACKEND/RCCAR_GPIO_ROOT.
+#
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import gpio_backend
+from micro_sleep import monotonic
+
+SEQUENTIAL = "sequential"
+BULK = "bulk"
+WARM = "warm"
+CRASH = "crash"
+
+# car pins (same as CarController)
+CAR_PINS = dict(
+        lm_pin_1=16,
+        lm_pin_2=20,
+        lm_pwm_pin=21,
+        rm_pin_1=13,
+        rm_pin_2=19,
+        rm_pwm_pin=26,
+        us_trig_pin=6,
+        us_echo_pin=5
+)
+
+
+# child process: bring the car up and report when it's ready
+def bring_up_car(mode, journal):
+    """
+    Imports the car modules, initializes the car and prints the monotonic times at
+    which initialization started and the car was ready
+    :param mode: SEQUENTIAL, BULK, WARM (re-adopt the pins in the journal) or CRASH
+    (exit without releasing the pins)
+    :param journal: pin journal file (WARM, CRASH)
+    :return: error code of RCCar.initialize
+    """
+    import rccar
+
+    if mode in (WARM, CRASH):
+        car = rccar.RCCar(pin_journal=journal, warm_start=(mode == WARM), **CAR_PINS)
+    else:
+        car = rccar.RCCar(bulk_init=(mode == BULK), **CAR_PINS)
+
+    start = monotonic()
+    err_code = car.initialize()
+    ready = monotonic()
+
+    print("{} {}".format(start, ready))
+    sys.stdout.flush()
+
+    # leave the pins exported, like a crashed controller
+    if mode == CRASH:
+        os._exit(err_code)
+
+    car.deinit()
+
+    return err_code
+
+
+# parent process: time one car bring-up in a new process
+def cold_start(mode, environ, journal):
+    """
+    Runs one child process and times it, a WARM start is preceded by a crashed run
+    :param mode: SEQUENTIAL, BULK or WARM pin bring-up
+    :param environ: environment of the child process
+    :param journal: pin journal file
+    :return: (launch to ready, initialize duration) in seconds, None on failure
+    """
+    if mode == WARM and cold_start(CRASH, environ, journal) is None:
+        return None
+
+    launch = monotonic()
+
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--child", mode, "--journal", journal],
+                             stdout=subprocess.PIPE, env=environ)
+    output, _ = child.communicate()
+
+    if child.returncode:
+        return None
+
+    start, ready = [float(t) for t in output.split()[-2:]]
+
+    return ready - launch, ready - start
+
+
+# mean, minimum and maximum of a list of samples
+def summary(samples):
+    return sum(samples) / len(samples), min(samples), max(samples)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="RC car cold start benchmark")
+    parser.add_argument("--runs", type=int, default=10, help="number of cold starts per mode")
+    parser.add_argument("--backend", default=None,
+                        choices=(gpio_backend.SYSFS, gpio_backend.EMULATED, gpio_backend.MEMORY,
+                                 gpio_backend.MMAP),
+                        help="GPIO backend (default: RCCAR_GPIO_BACKEND or sysfs)")
+    parser.add_argument("--root", default=None, help="sysfs root directory or register file")
+    parser.add_argument("--child", default=None, choices=(SEQUENTIAL, BULK, WARM, CRASH), help=argparse.SUPPRESS)
+    parser.add_argument("--journal", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.exit(bring_up_car(args.child, args.journal))
+
+    environ = dict(os.environ)
+    work_dir = tempfile.mkdtemp(prefix="startup_")
+    journal = os.path.join(work_dir, "pins.json")
+
+    if args.backend:
+        environ["RCCAR_GPIO_BACKEND"] = args.backend
+
+    if args.root:
+        environ["RCCAR_GPIO_ROOT"] = args.root
+
+    # an emulated sysfs has to outlive the child processes to be re-adopted
+    elif environ.get("RCCAR_GPIO_BACKEND") == gpio_backend.EMULATED:
+        environ["RCCAR_GPIO_ROOT"] = os.path.join(work_dir, "gpio")
+
+    modes = [SEQUENTIAL, BULK]
+
+    # in-memory pins don't survive the crashed process
+    if environ.get("RCCAR_GPIO_BACKEND") != gpio_backend.MEMORY:
+        modes.append(WARM)
+
+    for mode in modes:
+
+        results = [cold_start(mode, environ, journal) for _ in range(args.runs)]
+        results = [r for r in results if r is not None]
+
+        if not results:
+
+            print("{:10s} : car failed to start".format(mode))
+            continue
+
+        launch = summary([r[0] * 1000 for r in results])
+        init = summary([r[1] * 1000 for r in results])
+
+        print("{:10s} : launch to ready {:8.2f} ms (min {:8.2f}, max {:8.2f}), "
+              "initialize {:8.2f} ms (min {:8.2f}, max {:8.2f})".format(mode, *(launch + init)))
+
+    shutil.rmtree(work_dir, ignore_errors=True)
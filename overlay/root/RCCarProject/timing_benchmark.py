@@ -0,0 +1,440 @@
+#!/usr/bin/env python2
+
+#
+# Timing benchmark suite
+# Reports latency distributions (p50/p90/p99/max and a histogram) instead of means:
+#   micro_sleep : overshoot of micro_sleep over a range of delays
+#   pwm         : period and duty cycle error of GPIO_Pin.pwm_generate, measured from
+#                 the pin transitions recorded by the in-memory backend
+#   pin_write   : GPIO_Pin.set_pin_value latency on each available gpio backend
+#   ranging     : UltrasonicSensor.get_distance error and latency against a simulated
+#                 sensor (echo_simulator) on the in-memory backend
+# Optional busy threads add background load. Results can be saved as JSON and
+# compared against a previous (baseline) run.
+#
+
+import os
+import sys
+import json
+import time
+import mmap
+import argparse
+import shutil
+import platform
+import tempfile
+import threading as thread
+
+import gpiolib as gpio
+import gpio_backend
+import micro_sleep
+import ultrasonic
+import echo_simulator
+from micro_sleep import monotonic
+
+# histogram bucket upper edges in micro seconds, the last bucket is unbounded
+HISTOGRAM_EDGES = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# default benchmark parameters
+SLEEP_DELAYS = (10, 50, 100, 500, 1000, 2000, 10000)
+PWM_SETTINGS = ((20, 50), (100, 25), (500, 50))
+RANGING_DISTANCES = (20, 100, 250)
+
+# a p99 larger than the baseline by more than this ratio is a regression
+REGRESSION_TOLERANCE = 0.2
+
+# pin used by the pwm and pin write benchmarks
+BENCHMARK_PIN = 21
+
+# simulated ultrasonic sensor pins
+TRIG_PIN = 6
+ECHO_PIN = 5
+
+
+# latency distribution of a list of samples
+def distribution(samples):
+    """
+    Summarizes samples (micro seconds)
+    :param samples: list of numbers
+    :return: dict(count, mean, p50, p90, p99, max, histogram), histogram is a list of
+    [bucket upper edge (None: unbounded), count] on absolute values
+    """
+    if not samples:
+        return dict(count=0)
+
+    ordered = sorted(samples)
+    count = len(ordered)
+
+    buckets = [0] * (len(HISTOGRAM_EDGES) + 1)
+
+    for sample in ordered:
+
+        bucket = 0
+
+        while bucket < len(HISTOGRAM_EDGES) and abs(sample) > HISTOGRAM_EDGES[bucket]:
+            bucket += 1
+
+        buckets[bucket] += 1
+
+    return dict(count=count,
+                mean=sum(ordered) / float(count),
+                p50=ordered[int(count * 0.5)],
+                p90=ordered[min(count - 1, int(count * 0.9))],
+                p99=ordered[min(count - 1, int(count * 0.99))],
+                max=ordered[-1],
+                histogram=[[edge, n] for edge, n in zip(list(HISTOGRAM_EDGES) + [None], buckets)])
+
+
+# background load
+class LoadThreads(object):
+    """
+    Busy python threads competing for the CPU and the interpreter lock while a
+    benchmark runs
+    """
+
+    def __init__(self, threads=0):
+        self._count = threads
+        self._threads = list()
+        self._stop = thread.Event()
+
+    def __enter__(self):
+
+        for i in range(self._count):
+
+            t = thread.Thread(target=self._spin)
+            t.setDaemon(True)
+            t.setName("Load_{}".format(i))
+            t.start()
+
+            self._threads.append(t)
+
+        return self
+
+    def __exit__(self, *exc):
+
+        self._stop.set()
+
+        for t in self._threads:
+            t.join()
+
+        return False
+
+    def _spin(self):
+
+        n = 0
+
+        while not self._stop.is_set():
+            n += 1
+
+
+# micro_sleep overshoot
+def bench_micro_sleep(delays=SLEEP_DELAYS, runs=500):
+    """
+    Measures how much later than requested micro_sleep returns
+    :param delays: requested delays in micro seconds
+    :param runs: sleeps per delay
+    :return: {delay: distribution of the overshoot in micro seconds}
+    """
+    results = dict()
+
+    micro_sleep.get_spin_tail()
+
+    for delay in delays:
+
+        overshoot = list()
+
+        for _ in range(runs):
+
+            start = monotonic()
+            micro_sleep.micro_sleep(delay)
+            overshoot.append(1e6 * (monotonic() - start) - delay)
+
+        results[str(delay)] = distribution(overshoot)
+
+    return results
+
+
+# software PWM period/duty error
+def bench_pwm(settings=PWM_SETTINGS, periods=100):
+    """
+    Generates PWM on an in-memory pin and measures every period and high time from the
+    recorded pin transitions
+    :param settings: (frequency Hz, duty cycle %) pairs
+    :param periods: periods to measure per setting
+    :return: {"<frequency>Hz_<duty>": dict(period_error, duty_error)}, period error in
+    micro seconds, duty error in percentage points
+    """
+    results = dict()
+
+    backend = gpio_backend.MemoryBackend()
+    pin = gpio.GPIO_Pin(BENCHMARK_PIN, gpio.PWM, backend=backend)
+
+    try:
+
+        for frequency, duty_cycle in settings:
+
+            backend.clear_transitions()
+
+            pin.pwm_generate(frequency, duty_cycle)
+            time.sleep((periods + 1.0) / frequency)
+            pin.pwm_stop()
+
+            rises = [t for t, _, value in backend.transitions(BENCHMARK_PIN) if value == gpio.HIGH]
+            falls = [t for t, _, value in backend.transitions(BENCHMARK_PIN) if value == gpio.LOW]
+
+            period_error = list()
+            duty_error = list()
+
+            for start, end in zip(rises, rises[1:]):
+
+                fall = [t for t in falls if start < t < end]
+
+                period_error.append(1e6 * ((end - start) - 1.0 / frequency))
+
+                if fall:
+                    duty_error.append(100.0 * (fall[0] - start) / (end - start) - duty_cycle)
+
+            results["{}Hz_{}".format(frequency, duty_cycle)] = dict(period_error=distribution(period_error),
+                                                                     duty_error=distribution(duty_error))
+
+    finally:
+
+        pin.deinit_pin()
+        backend.close()
+
+    return results
+
+
+# backends that can be benchmarked on this host
+def available_backends():
+    """
+    :return: {name: backend factory}, sysfs only if /sys/class/gpio is writable, mmap
+    on /dev/gpiomem if present, on a register file stand-in otherwise
+    """
+    backends = {
+            gpio_backend.MEMORY: gpio_backend.MemoryBackend,
+            gpio_backend.EMULATED: gpio_backend.EmulatedSysfsBackend
+    }
+
+    if os.access(os.path.join(gpio_backend.SYSFS_GPIO_ROOT, "export"), os.W_OK):
+        backends[gpio_backend.SYSFS] = gpio_backend.SysfsBackend
+
+    if os.path.exists(gpio_backend.GPIOMEM_DEVICE):
+
+        backends[gpio_backend.MMAP] = gpio_backend.MmapBackend
+
+    else:
+
+        def registers_file():
+
+            work_dir = tempfile.mkdtemp(prefix="gpiomem_")
+            path = os.path.join(work_dir, "gpiomem")
+
+            with open(path, "wb") as f:
+                f.write(b"\0" * mmap.PAGESIZE)
+
+            # the registers stay mapped once the stand-in file is gone
+            try:
+                return gpio_backend.MmapBackend(path)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        backends[gpio_backend.MMAP] = registers_file
+
+    return backends
+
+
+# pin write latency
+def bench_pin_writes(backends=None, writes=5000):
+    """
+    Times GPIO_Pin.set_pin_value on each backend, values alternate so no write is elided
+    by the pin state cache
+    :param backends: {name: backend factory} (default: available_backends())
+    :param writes: writes per backend
+    :return: {backend name: distribution of the write latency in micro seconds}
+    """
+    results = dict()
+
+    for name, factory in sorted((backends or available_backends()).items()):
+
+        backend = factory()
+        pin = gpio.GPIO_Pin(BENCHMARK_PIN, gpio.GPIO, backend=backend)
+        pin.set_pin_direction(gpio.OUTPUT)
+
+        latency = list()
+
+        try:
+
+            for i in range(writes):
+
+                start = monotonic()
+                pin.set_pin_value(i & 1)
+                latency.append(1e6 * (monotonic() - start))
+
+        finally:
+
+            pin.set_pin_value(gpio.LOW)
+            pin.deinit_pin()
+            backend.close()
+
+        results[name] = distribution(latency)
+
+    return results
+
+
+# ultrasonic ranging error and latency
+def bench_ranging(distances=RANGING_DISTANCES, readings=100, jitter=20e-6):
+    """
+    Measures simulated obstacles with UltrasonicSensor.get_distance, the simulated
+    sensor answers every trigger (no dropouts, no multipath)
+    :param distances: obstacle distances in cm
+    :param readings: readings per distance
+    :param jitter: echo pulse width jitter of the simulated sensor (s)
+    :return: {"<distance>cm": dict(error, latency)}, error in cm, latency in micro seconds
+    """
+    results = dict()
+
+    backend = gpio_backend.MemoryBackend()
+    previous = gpio.set_backend(backend)
+
+    sensor = ultrasonic.UltrasonicSensor(min_distance=2, max_distance=300)
+    sensor.init_ultrasonic(trig_pin=TRIG_PIN, echo_pin=ECHO_PIN)
+
+    try:
+
+        with echo_simulator.EchoSimulator(backend, TRIG_PIN, ECHO_PIN, jitter=jitter, seed=1) as simulator:
+
+            for distance in distances:
+
+                simulator.set_distance(distance)
+
+                error = list()
+                latency = list()
+
+                for _ in range(readings):
+
+                    start = monotonic()
+                    reading = sensor.get_distance()
+                    latency.append(1e6 * (monotonic() - start))
+
+                    if reading >= 0:
+                        error.append(reading - distance)
+
+                results["{}cm".format(distance)] = dict(error=distribution(error), latency=distribution(latency))
+
+    finally:
+
+        sensor.deinit_ultrasonic()
+        gpio.set_backend(previous)
+        backend.close()
+
+    return results
+
+
+# flatten nested results to {"group.key.metric": value}
+def flatten(results, prefix=""):
+
+    flat = dict()
+
+    for key, value in results.items():
+
+        if isinstance(value, dict):
+            flat.update(flatten(value, "{}{}.".format(prefix, key)))
+
+        elif isinstance(value, (int, float)) and key != "count":
+            flat["{}{}".format(prefix, key)] = value
+
+    return flat
+
+
+# compare p99 against a baseline run
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compares the p99 of every distribution against a baseline run
+    :param results: benchmark results
+    :param baseline: baseline benchmark results
+    :param tolerance: allowed relative p99 increase
+    :return: list of (metric, baseline p99, current p99, regression flag)
+    """
+    current = flatten(dict((k, v) for k, v in results.items() if k != "meta"))
+    previous = flatten(dict((k, v) for k, v in baseline.items() if k != "meta"))
+
+    rows = list()
+
+    for metric in sorted(current):
+
+        if not metric.endswith(".p99") or metric not in previous:
+            continue
+
+        before, after = abs(previous[metric]), abs(current[metric])
+        rows.append((metric, previous[metric], current[metric], after > before * (1 + tolerance)))
+
+    return rows
+
+
+# print a distribution table
+def report(results):
+
+    flat = flatten(results)
+
+    for group in ("micro_sleep", "pwm", "pin_write", "ranging"):
+
+        for metric in sorted(flatten(results.get(group, {}), group + ".")):
+
+            if metric.endswith(".p50"):
+
+                name = metric[:-4]
+                stats = [flat[name + "." + s] for s in ("p50", "p90", "p99", "max")]
+                print("{:40s} p50 {:10.2f}  p90 {:10.2f}  p99 {:10.2f}  max {:10.2f}".format(name, *stats))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="micro_sleep, PWM and pin write timing benchmark")
+    parser.add_argument("--load", type=int, default=0, help="number of busy background threads")
+    parser.add_argument("--runs", type=int, default=500, help="sleeps per micro_sleep delay")
+    parser.add_argument("--periods", type=int, default=100, help="PWM periods per setting")
+    parser.add_argument("--writes", type=int, default=5000, help="pin writes per backend")
+    parser.add_argument("--readings", type=int, default=100, help="simulated ultrasonic readings per distance")
+    parser.add_argument("--skip", action="append", default=[], choices=("micro_sleep", "pwm", "pin_write", "ranging"),
+                        help="skip a benchmark (repeatable)")
+    parser.add_argument("--json", default=None, help="save the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="compare p99 values against this JSON file")
+    args = parser.parse_args()
+
+    results = dict(meta=dict(host=platform.node(), kernel=platform.release(), python=platform.python_version(),
+                             load=args.load, time=time.time()))
+
+    with LoadThreads(args.load):
+
+        if "micro_sleep" not in args.skip:
+            results["micro_sleep"] = bench_micro_sleep(runs=args.runs)
+
+        if "pwm" not in args.skip:
+            results["pwm"] = bench_pwm(periods=args.periods)
+
+        if "pin_write" not in args.skip:
+            results["pin_write"] = bench_pin_writes(writes=args.writes)
+
+        if "ranging" not in args.skip:
+            results["ranging"] = bench_ranging(readings=args.readings)
+
+    report(results)
+
+    if args.json:
+
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = 0
+
+        for metric, before, after, regression in compare(results, baseline):
+
+            regressions += regression
+            print("{:40s} p99 {:10.2f} -> {:10.2f} {}".format(metric, before, after, "REGRESSION" if regression else ""))
+
+        sys.exit(1 if regressions else 0)
@@ -1,9 +1,15 @@
 #!/usr/bin/env python2
 
+import os
 import time
+import select
+import threading as thread
 import logging as log
 import gpiolib as gpio
 import micro_sleep
+from gpio_backend import set_nonblocking
+from collections import deque
+from micro_sleep import monotonic, thread_cpu_time
 
 # -------------------------------- Error codes ---------------------------------
 
@@ -13,6 +19,27 @@ _ERR_USED_PIN = 2
 _ERR_INVALID_CONFIG = 3
 _ERR_INVALID_ARGS = 4
 _ERR_ERROR = 5
+_ERR_TIMEOUT = 6
+
+# ---------------------------- Measurement results -----------------------------
+
+ECHO_OK = SUCCESS
+ECHO_TIMEOUT = 7     # no echo pulse started (no object, sensor busy or disconnected)
+ECHO_TOO_NEAR = 8    # echo shorter than the round trip to min distance
+ECHO_TOO_FAR = 9     # echo longer than the round trip to max distance
+
+# ------------------------------ Echo timing (s) -------------------------------
+
+# trigger line held low before the pulse, trigger pulse width
+_TRIGGER_SETTLE = 0.002
+_TRIGGER_PULSE = 0.00001
+
+# from the trigger pulse to the echo rising (the sensor sends its 40kHz burst
+# first, about 0.5 ms on the HC-SR04)
+_ECHO_START_TIMEOUT = 0.003
+
+# samples the effective ranging rate is measured over
+_RATE_WINDOW = 16
 
 # ----------------------- Logging/Debug configurations -------------------------
 
@@ -40,6 +67,42 @@ class UltrasonicSensor(object):
         self._max_time = self._max_distance / float(self._sound_speed)
         self._min_time = self._min_distance / float(self._sound_speed)
 
+        # longest echo pulse worth waiting for: round trip to max distance
+        self._echo_timeout = 2 * self._max_time
+
+        # measurement outcome counters and the longest measurement seen
+        self._echo_results = dict((result, 0) for result in
+                                  (ECHO_OK, ECHO_TIMEOUT, ECHO_TOO_NEAR, ECHO_TOO_FAR))
+        self._max_measurement_time = 0.0
+
+        # echo timing through edge detection (falls back to polling the echo pin)
+        self._echo_edges = False
+
+        # ranging service: latest (distance, monotonic timestamp, sequence number, result),
+        # the tuple is replaced as a whole so readers never need a lock
+        self._sample = (-1, 0.0, 0, ECHO_TIMEOUT)
+        self._ranging_rate = 0
+        self._ranging_thread = None
+        self._ranging = False
+
+        # event set by an external scheduler (UltrasonicArray) for every measurement
+        self._fire_event = None
+
+        # callbacks receiving every published sample
+        self._sample_listeners = list()
+
+        # publication times of the latest samples, ranging thread CPU time and start time
+        self._sample_times = deque(maxlen=_RATE_WINDOW)
+        self._ranging_cpu = 0.0
+        self._ranging_start = None
+
+        # notified with every published sample and when the service stops
+        self._sample_ready = thread.Condition()
+
+        # self-pipe interrupting the ranging thread sleep, open while the pins are
+        self._stop_r = None
+        self._stop_w = None
+
     # initialize ultrasonic sensor GPIO pins
     def init_ultrasonic(self, trig_pin=None, echo_pin=None):
         """
@@ -65,6 +128,20 @@ class UltrasonicSensor(object):
 
                 self._trig_pin.set_pin_value(gpio.LOW)
 
+                self._stop_r, self._stop_w = os.pipe()
+
+                for fd in (self._stop_r, self._stop_w):
+                    set_nonblocking(fd)
+
+                # time echo pulses from edge events if the GPIO backend supports them
+                self._echo_edges = self._echo_pin.set_pin_edge(gpio.BOTH) == gpio.SUCCESS
+
+                if not self._echo_edges:
+                    log.warning("Echo pin {} has no edge detection, polling it instead.".format(echo_pin))
+
+                # load the trigger delays sleep calibration, or measure it in the background
+                micro_sleep.prepare_spin_tail()
+
             else:
 
                 log.error("Failed to configure Echo pin: {} for ultrasonic sensor!".format(echo_pin))
@@ -86,6 +163,8 @@ class UltrasonicSensor(object):
         De-configure GPIO pins associated with ultrasonic module (trigger/echo pins)
         :return: 0
         """
+        self.stop_ranging()
+
         if self._trig_pin and self._echo_pin:
 
             gpio.GPIO_Pin.deinit_pin(self._trig_pin)
@@ -94,67 +173,431 @@ class UltrasonicSensor(object):
             self._trig_pin = None
             self._echo_pin = None
 
+            os.close(self._stop_r)
+            os.close(self._stop_w)
+
+            self._stop_r = None
+            self._stop_w = None
+
         return 0
 
     # measures distance to the first object in front of the ultrasonic sensor
     def get_distance(self):
         """
-        Gets distance measured by the ultrasonic module
-        :returns (int) : the distance to the first object in front of the sensor
+        Gets distance measured by the ultrasonic module, while the ranging service runs
+        this is the latest published distance (no measurement in the calling thread)
+        :returns (int) : the distance to the first object in front of the sensor, -1 if
+        no echo was measured (see measure for the reason)
         """
 
+        # ranging service owns the sensor
+        if self._ranging:
+            distance = self._sample[0]
+
         # check if pins have been initialized
-        if self._trig_pin and self._echo_pin:
+        elif self._trig_pin and self._echo_pin:
 
-            # set trigger pin low
-            self._trig_pin.set_pin_value(gpio.LOW)
-            micro_sleep.micro_sleep(2000)
+            result, distance = self.measure()
+            self._publish(distance, result)
 
-            # send trigger pulse (HIGH for 10 microseconds)
-            self._trig_pin.set_pin_value(gpio.HIGH)
-            micro_sleep.micro_sleep(10)
-            self._trig_pin.set_pin_value(gpio.LOW)
+        # if pins were not initialized
+        else:
 
-            start = time.time()
-            # wait for echo
-            while self._echo_pin.get_pin_value()[1] == gpio.LOW and (time.time() - start) < self._max_time:
-                pass
+            log.critical("Trying to echo without initializing pins!")
+            distance = -1
 
-            if (time.time() - start) > (self._max_time + 3e5):
+        return distance
 
-                log.error("Echo signal delayed too long, either an object is too close or too far from the sensor!")
-                distance = -1
+    # one measurement
+    def measure(self):
+        """
+        Triggers the sensor and times the echo, never takes longer than latency_budget
+        (plus scheduling delays). Pins must be initialized and the ranging service stopped.
+        :return: (result, distance), result is ECHO_OK, ECHO_TIMEOUT, ECHO_TOO_NEAR or
+        ECHO_TOO_FAR, distance is -1 for ECHO_TIMEOUT and ECHO_TOO_FAR
+        """
+        start = monotonic()
 
-            else:
+        if self._echo_edges:
+            result, distance = self._get_distance_edges()
+        else:
+            result, distance = self._get_distance_polling()
 
-                rise = time.time()
-                while self._echo_pin.get_pin_value()[1] == gpio.HIGH:
-                    pass
+        self._echo_results[result] += 1
+        self._max_measurement_time = max(self._max_measurement_time, monotonic() - start)
 
-                fall = time.time()
-                delta = rise - fall
+        return result, distance
 
-                if delta <= (self._min_time + 2e5):
+    @property
+    def latency_budget(self):
+        """worst case duration of one measurement in seconds (trigger, echo start, echo
+        pulse for max distance), ranging faster than 1 / latency_budget runs measurements
+        back to back"""
+        return _TRIGGER_SETTLE + _TRIGGER_PULSE + _ECHO_START_TIMEOUT + self._echo_timeout
 
-                    log.debug("Object is too close to the sensor!")
+    # measurement counters
+    def echo_stats(self):
+        """
+        :return: dict(ok, timeout, too_near, too_far) measurement counts, the longest
+        measurement (max_time) and the latency_budget, times in seconds
+        """
+        return dict(ok=self._echo_results[ECHO_OK],
+                    timeout=self._echo_results[ECHO_TIMEOUT],
+                    too_near=self._echo_results[ECHO_TOO_NEAR],
+                    too_far=self._echo_results[ECHO_TOO_FAR],
+                    max_time=self._max_measurement_time,
+                    latency_budget=self.latency_budget)
+
+    # ranging service counters
+    def ranging_stats(self):
+        """
+        :return: dict(rate, effective_rate, cpu_time, cpu_load), rate is the requested
+        rate, effective_rate the rate of the latest samples, cpu_time the CPU time used by
+        the ranging thread (s) and cpu_load its share of the ranging time
+        """
+        times = list(self._sample_times)
+        effective_rate = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 0.0
+        elapsed = monotonic() - self._ranging_start if self._ranging_start is not None else 0
 
-                elif delta >= (self._max_time + 2e5):
+        return dict(rate=self._ranging_rate if self._fire_event is None else None,
+                    effective_rate=effective_rate,
+                    cpu_time=self._ranging_cpu,
+                    cpu_load=self._ranging_cpu / elapsed if elapsed else 0.0)
 
-                    log.debug("Object is too far from the sensor!")
+    # register a sample callback
+    def add_sample_listener(self, callback):
+        """
+        Calls callback(sample) with every published sample, from the thread that measured
+        it (ranging thread), the callback must not block
+        :param callback: callable receiving (distance, timestamp, sequence, result)
+        :return: None
+        """
+        self._sample_listeners.append(callback)
+
+    # unregister a sample callback
+    def remove_sample_listener(self, callback):
+        """
+        :param callback: callable given to add_sample_listener
+        :return: None
+        """
+        if callback in self._sample_listeners:
+            self._sample_listeners.remove(callback)
+
+    # start background ranging
+    def start_ranging(self, rate=10, fire_event=None):
+        """
+        Starts the ranging service, a thread measuring the distance at the given rate and
+        publishing every reading (see latest_sample, wait_for_sample)
+        :param rate: measurements per second
+        :param fire_event: threading.Event, if given the thread measures once every time
+        the event is set instead of following the rate (external trigger scheduling)
+        :return: error code that indicates if the service was started
+        """
+        err_code = SUCCESS
 
-                else:
+        # check pins and rate
+        if not (self._trig_pin and self._echo_pin) or rate <= 0:
 
-                    pass
+            log.error("Failed to start ultrasonic ranging!")
+            log.debug("Pins are not initialized or invalid rate: {}".format(rate))
+            err_code = _ERR_INVALID_CONFIG
 
-                distance = (fall - rise) * self._sound_speed / 2
+        # service already running, only update the rate
+        elif self._ranging:
+
+            self.set_ranging_rate(rate)
 
-        # if pins were not initialized
         else:
 
-            log.critical("Trying to echo without initializing pins!")
-            distance = -1
+            if fire_event is None and rate * self.latency_budget > 1:
+                log.warning("Ultrasonic ranging at {} Hz exceeds the sensor maximum of {:.1f} Hz, "
+                            "measurements will run back to back".format(rate, 1 / self.latency_budget))
 
-        return distance
+            self._ranging_rate = rate
+            self._fire_event = fire_event
+            self._ranging = True
+
+            self._sample_times.clear()
+            self._ranging_cpu = 0.0
+            self._ranging_start = monotonic()
+
+            self._ranging_thread = thread.Thread(target=self._ranging_loop)
+            self._ranging_thread.setDaemon(True)
+            self._ranging_thread.setName("Ultrasonic_Ranging")
+            self._ranging_thread.start()
+
+            log.info("Ultrasonic ranging started at {} Hz".format(rate))
+
+        return err_code
+
+    # stop background ranging
+    def stop_ranging(self):
+        """
+        Stops the ranging service, returns once the ranging thread has exited
+        :return: 0
+        """
+        if self._ranging:
+
+            self._ranging = False
+            self._wake(self._stop_w)
+
+            # waiting threads give up
+            with self._sample_ready:
+                self._sample_ready.notify_all()
+
+            if self._fire_event is not None:
+                self._fire_event.set()
+
+            if self._ranging_thread is not thread.current_thread():
+                self._ranging_thread.join()
+
+            self._ranging_thread = None
+            self._fire_event = None
+            log.info("Ultrasonic ranging stopped")
+
+        return 0
+
+    # change the ranging rate
+    def set_ranging_rate(self, rate):
+        """
+        :param rate: measurements per second, the wait for the next measurement is
+        re-planned right away
+        :return: error code
+        """
+        if rate <= 0:
+            return _ERR_INVALID_ARGS
+
+        self._ranging_rate = rate
+
+        if self._ranging:
+            self._wake(self._stop_w)
+
+        return SUCCESS
+
+    @property
+    def ranging(self):
+        """True while the ranging service runs"""
+        return self._ranging
+
+    # latest published reading
+    def latest_sample(self):
+        """
+        Latest reading of the ranging service (or of the last get_distance call), never blocks
+        :return: (distance, timestamp, sequence, result), timestamp is micro_sleep.monotonic
+        time at the end of the measurement, sequence is 0 before the first reading, result
+        is the measurement result (see measure)
+        """
+        return self._sample
+
+    # wait for a new reading
+    def wait_for_sample(self, sequence=None, timeout=None):
+        """
+        Blocks until the ranging service publishes a reading newer than the given one
+        :param sequence: sequence number of the last reading seen (None: the latest one)
+        :param timeout: maximum time to wait in seconds (None: forever)
+        :return: (err_code, (distance, timestamp, sequence, result))
+        """
+        sample = self._sample
+
+        if sequence is None:
+            sequence = sample[2]
+
+        if sample[2] > sequence:
+            return SUCCESS, sample
+
+        if not self._ranging:
+            return _ERR_INVALID_CONFIG, sample
+
+        deadline = None if timeout is None else monotonic() + timeout
+
+        with self._sample_ready:
+
+            while True:
+
+                sample = self._sample
+
+                if sample[2] > sequence:
+                    return SUCCESS, sample
+
+                remaining = None if deadline is None else deadline - monotonic()
+
+                if (remaining is not None and remaining <= 0) or not self._ranging:
+                    return _ERR_TIMEOUT, sample
+
+                self._sample_ready.wait(remaining)
+
+    # ranging thread
+    def _ranging_loop(self):
+
+        deadline = monotonic()
+        cpu_start = thread_cpu_time()
+
+        while self._ranging:
+
+            # externally scheduled, wait for the next turn
+            if self._fire_event is not None:
+
+                self._fire_event.wait()
+                self._fire_event.clear()
+
+                if not self._ranging:
+                    break
+
+            result, distance = self.measure()
+            self._publish(distance, result)
+
+            self._ranging_cpu = thread_cpu_time() - cpu_start
+
+            if self._fire_event is not None:
+                continue
+
+            # next measurement on an absolute schedule, a late one starts right away,
+            # a rate change re-plans the wait from the previous measurement
+            previous = deadline
+            deadline = max(previous + 1.0 / self._ranging_rate, monotonic())
+
+            while self._ranging and self._sleep_until(deadline):
+                deadline = max(previous + 1.0 / self._ranging_rate, monotonic())
+
+        return 0
+
+    # sleep until a monotonic time, True if woken up early (stop, rate change)
+    def _sleep_until(self, deadline):
+
+        delay = deadline - monotonic()
+
+        if delay > 0 and select.select([self._stop_r], [], [], delay)[0]:
+
+            try:
+                os.read(self._stop_r, 64)
+            except OSError:
+                pass
+
+            return True
+
+        return False
+
+    # publish a reading and wake the waiting threads
+    def _publish(self, distance, result=ECHO_OK):
+
+        sample = (distance, monotonic(), self._sample[2] + 1, result)
+
+        with self._sample_ready:
+
+            self._sample = sample
+            self._sample_ready.notify_all()
+
+        self._sample_times.append(sample[1])
+
+        for callback in list(self._sample_listeners):
+            callback(sample)
+
+    @staticmethod
+    def _wake(fd):
+
+        try:
+            os.write(fd, b"x")
+        except OSError:
+            pass
+
+    # send trigger pulse
+    def _trigger(self):
+        """
+        Sends a 10 micro seconds trigger pulse to the sensor
+        :return: 0
+        """
+        # set trigger pin low
+        self._trig_pin.set_pin_value(gpio.LOW)
+        micro_sleep.micro_sleep(_TRIGGER_SETTLE * 1e6)
+
+        # send trigger pulse (HIGH for 10 microseconds)
+        self._trig_pin.set_pin_value(gpio.HIGH)
+        micro_sleep.micro_sleep(_TRIGGER_PULSE * 1e6)
+        self._trig_pin.set_pin_value(gpio.LOW)
+
+        return 0
+
+    # measure echo pulse width from edge events
+    def _get_distance_edges(self):
+        """
+        Measures the echo pulse width from the timestamps of its rising and falling
+        edges, the thread sleeps in the kernel while waiting for both edges
+        :return: (result, distance), see measure
+        """
+        # edges left from a previous measurement
+        self._echo_pin.flush_edges()
+
+        self._trigger()
+
+        # wait for echo rising edge
+        rise = None
+        deadline = monotonic() + _ECHO_START_TIMEOUT
+
+        while rise is None:
+
+            err_code, timestamp, value = self._echo_pin.wait_for_edge(deadline - monotonic())
+
+            if err_code != gpio.SUCCESS:
+                break
+
+            if value == gpio.HIGH:
+                rise = timestamp
+
+        if rise is None:
+            return ECHO_TIMEOUT, -1
+
+        # wait for echo falling edge, no longer than the round trip to max distance
+        err_code, fall, _ = self._echo_pin.wait_for_edge(self._echo_timeout - (monotonic() - rise))
+
+        if err_code != gpio.SUCCESS:
+            return ECHO_TOO_FAR, -1
+
+        return self._echo_result(fall - rise)
+
+    # measure echo pulse width by polling the echo pin
+    def _get_distance_polling(self):
+        """
+        Measures the echo pulse width by polling the echo pin value, both waits are
+        bounded like the edge events ones
+        :return: (result, distance), see measure
+        """
+        self._trigger()
+
+        # wait for echo
+        deadline = monotonic() + _ECHO_START_TIMEOUT
+
+        while self._echo_pin.get_pin_value()[1] == gpio.LOW:
+
+            if monotonic() > deadline:
+                return ECHO_TIMEOUT, -1
+
+        rise = monotonic()
+        deadline = rise + self._echo_timeout
+
+        # wait for the echo end
+        while self._echo_pin.get_pin_value()[1] == gpio.HIGH:
+
+            if monotonic() > deadline:
+                return ECHO_TOO_FAR, -1
+
+        return self._echo_result(monotonic() - rise)
+
+    # classify an echo pulse
+    def _echo_result(self, delta):
+        """
+        :param delta: echo pulse width in seconds
+        :return: (result, distance), a too near distance is still returned
+        """
+        # pulse ended after the round trip to max distance
+        if delta > self._echo_timeout:
+            return ECHO_TOO_FAR, -1
+
+        distance = delta * self._sound_speed / 2
+
+        if delta < 2 * self._min_time:
+            return ECHO_TOO_NEAR, distance
+
+        return ECHO_OK, distance
 
 
 if __name__ == '__main__':
@@ -176,5 +619,7 @@ if __name__ == '__main__':
         time.sleep(.5)
         count += 1
 
+    print("Echo results: {}".format(us.echo_stats()))
+
     us.deinit_ultrasonic()
     p0.deinit_pin()
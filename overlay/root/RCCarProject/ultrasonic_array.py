@@ -0,0 +1,447 @@
+#!/usr/bin/env python2
+
+#
+# Array of ultrasonic sensors (front, rear, sides, ...)
+# Sensors that hear each other's bursts are listed in exclusion groups. The scheduler
+# splits the grouped sensors into firing slots (no two sensors of a group in the same
+# slot) and fires the slots one after the other, the sensors of a slot fire together.
+# Sensors outside any group range on their own at the full rate.
+#
+
+import os
+import select
+import threading as thread
+import logging as log
+import ultrasonic
+from gpio_backend import set_nonblocking
+from micro_sleep import monotonic, thread_cpu_time
+
+# ------------------------------- Directions -----------------------------------
+
+FRONT = "front"
+REAR = "rear"
+LEFT = "left"
+RIGHT = "right"
+
+# -------------------------------- Error codes ---------------------------------
+
+SUCCESS = 0
+_ERR_INVALID_PIN = 1
+_ERR_USED_PIN = 2
+_ERR_INVALID_CONFIG = 3
+_ERR_INVALID_ARGS = 4
+_ERR_ERROR = 5
+
+# extra wait for a slot measurement on top of the sensor latency budget (s)
+_SLOT_MARGIN = 0.05
+
+
+class UltrasonicArray(object):
+
+    def __init__(self, groups=None, guard_time=0.0):
+        """
+        :param groups: exclusion groups, lists of sensor names that must not fire at the
+        same time (None: every sensor interferes with every other)
+        :param guard_time: pause between two slots in seconds, lets late echoes of the
+        previous slot die out
+        """
+        self._groups = None if groups is None else [set(group) for group in groups]
+        self._guard_time = guard_time
+
+        # sensors by name, in the order they were added
+        self._sensors = dict()
+        self._names = list()
+
+        # firing slots of the scheduled sensors, sensors ranging on their own
+        self._slots = list()
+        self._free = list()
+
+        self._rate = 0
+        self._running = False
+        self._scheduler = None
+        self._fire_events = dict()
+
+        self._cycles = 0
+        self._start_time = None
+        self._start_readings = 0
+        self._scheduler_cpu = 0.0
+
+        # self-pipe interrupting the scheduler sleep, open while the scheduler runs
+        self._stop_r = None
+        self._stop_w = None
+
+    # add and initialize a sensor
+    def add_sensor(self, name, trig_pin, echo_pin, min_distance=4, max_distance=300, sound_speed=34000):
+        """
+        Creates a sensor and initializes its pins
+        :param name: sensor name, usually its direction (FRONT, REAR, LEFT, RIGHT)
+        :param trig_pin: trigger pin
+        :param echo_pin: echo pin
+        :param min_distance: sensor minimum distance
+        :param max_distance: sensor maximum distance
+        :param sound_speed: speed of sound in cm/s
+        :return: error code that indicates if the sensor was added
+        """
+        # check the name and the array state
+        if name in self._sensors or self._running:
+
+            log.error("Failed to add ultrasonic sensor {}!".format(name))
+            log.debug("The sensor exists already or the array is ranging.")
+            return _ERR_INVALID_ARGS
+
+        sensor = ultrasonic.UltrasonicSensor(min_distance=min_distance, max_distance=max_distance,
+                                             sound_speed=sound_speed)
+
+        err_code = sensor.init_ultrasonic(trig_pin=trig_pin, echo_pin=echo_pin)
+
+        if err_code == ultrasonic.SUCCESS:
+
+            self._sensors[name] = sensor
+            self._names.append(name)
+            self._plan()
+
+        return err_code
+
+    # sensor by name
+    def sensor(self, name):
+        """
+        :param name: sensor name
+        :return: UltrasonicSensor, None if there is no such sensor
+        """
+        return self._sensors.get(name, None)
+
+    @property
+    def names(self):
+        """sensor names in the order they were added"""
+        return list(self._names)
+
+    @property
+    def schedule(self):
+        """firing slots (lists of sensor names fired together) of the scheduled sensors,
+        followed by the free running sensors"""
+        return [list(slot) for slot in self._slots], list(self._free)
+
+    @property
+    def ranging(self):
+        """True while the array ranges"""
+        return self._running
+
+    # split the sensors into firing slots
+    def _plan(self):
+        """
+        Greedy coloring of the interference graph, the most constrained sensors are
+        placed first, each sensor goes to the first slot without a sensor it interferes with
+        :return: None
+        """
+        conflicts = dict((name, set()) for name in self._names)
+        groups = self._groups if self._groups is not None else [set(self._names)]
+
+        for group in groups:
+
+            members = [name for name in self._names if name in group]
+
+            for name in members:
+                conflicts[name].update(n for n in members if n != name)
+
+        self._free = [name for name in self._names if not conflicts[name]]
+        self._slots = list()
+
+        for name in sorted((n for n in self._names if conflicts[n]),
+                           key=lambda n: (-len(conflicts[n]), self._names.index(n))):
+
+            for slot in self._slots:
+
+                if not conflicts[name] & set(slot):
+
+                    slot.append(name)
+                    break
+
+            else:
+
+                self._slots.append([name])
+
+    # duration of one scheduler cycle
+    def cycle_budget(self):
+        """
+        :return: worst case duration of one scheduler cycle in seconds, the slowest
+        sensor of each slot sets the slot duration
+        """
+        return sum(max(self._sensors[name].latency_budget for name in slot) + self._guard_time
+                   for slot in self._slots)
+
+    # start ranging
+    def start(self, rate=10):
+        """
+        Starts ranging, every sensor measures up to `rate` times per second. Scheduled
+        sensors are fired by the scheduler thread, the others range on their own.
+        :param rate: measurements per second of each sensor
+        :return: error code that indicates if ranging started
+        """
+        if not self._sensors or rate <= 0 or self._running:
+
+            log.error("Failed to start the ultrasonic array!")
+            log.debug("No sensors, invalid rate: {} or already ranging".format(rate))
+            return _ERR_INVALID_CONFIG
+
+        cycle = self.cycle_budget()
+
+        if cycle * rate > 1:
+            log.warning("Ultrasonic array schedule takes {:.1f} ms, sensors in exclusion groups range at "
+                        "{:.1f} Hz at most".format(cycle * 1000, 1 / cycle))
+
+        self._rate = rate
+        self._running = True
+        self._cycles = 0
+        self._start_time = monotonic()
+        self._start_readings = self._readings()
+        self._scheduler_cpu = 0.0
+
+        for name in self._free:
+            self._sensors[name].start_ranging(rate)
+
+        for slot in self._slots:
+
+            for name in slot:
+
+                self._fire_events[name] = thread.Event()
+                self._sensors[name].start_ranging(rate, fire_event=self._fire_events[name])
+
+        if self._slots:
+
+            self._stop_r, self._stop_w = os.pipe()
+
+            for fd in (self._stop_r, self._stop_w):
+                set_nonblocking(fd)
+
+            self._scheduler = thread.Thread(target=self._schedule_loop)
+            self._scheduler.setDaemon(True)
+            self._scheduler.setName("Ultrasonic_Scheduler")
+            self._scheduler.start()
+
+        log.info("Ultrasonic array ranging: {} slots, {} free running sensors".format(len(self._slots),
+                                                                                       len(self._free)))
+
+        return SUCCESS
+
+    # change the ranging rate
+    def set_rate(self, rate):
+        """
+        :param rate: measurements per second of each sensor, the sensors and the
+        scheduler re-plan their wait for the next measurement right away
+        :return: error code
+        """
+        if rate <= 0:
+            return _ERR_INVALID_ARGS
+
+        self._rate = rate
+
+        if self._running:
+
+            for name in self._free:
+                self._sensors[name].set_ranging_rate(rate)
+
+            self._wake()
+
+        return SUCCESS
+
+    @property
+    def rate(self):
+        """requested measurements per second of each sensor, 0 when not ranging"""
+        return self._rate if self._running else 0
+
+    # stop ranging
+    def stop(self):
+        """
+        Stops the scheduler and the sensors ranging services
+        :return: 0
+        """
+        if self._running:
+
+            self._running = False
+            self._wake()
+
+            if self._scheduler is not None:
+
+                self._scheduler.join()
+                self._scheduler = None
+
+                os.close(self._stop_r)
+                os.close(self._stop_w)
+
+                self._stop_r = None
+                self._stop_w = None
+
+            for name in self._names:
+                self._sensors[name].stop_ranging()
+
+            self._fire_events = dict()
+
+        return 0
+
+    # de-initialize all sensors
+    def deinit(self):
+        """
+        Stops ranging and de-configures the pins of every sensor
+        :return: 0
+        """
+        self.stop()
+
+        for name in self._names:
+            self._sensors[name].deinit_ultrasonic()
+
+        self._sensors = dict()
+        self._names = list()
+        self._slots = list()
+        self._free = list()
+
+        return 0
+
+    # per sensor distances
+    def distances(self):
+        """
+        Latest distance of every sensor, never blocks (measures every sensor in the
+        calling thread if the array is not ranging)
+        :return: {name: distance}, -1 for sensors without an echo
+        """
+        return dict((name, self._sensors[name].get_distance()) for name in self._names)
+
+    # per sensor samples
+    def samples(self):
+        """
+        :return: {name: (distance, timestamp, sequence, result)} latest sample of every sensor
+        """
+        return dict((name, self._sensors[name].latest_sample()) for name in self._names)
+
+    # array counters
+    def stats(self):
+        """
+        :return: dict(cycles, readings, readings_per_second, planned_readings_per_second,
+        slots, rate, effective_rate, cpu_time, cpu_load), readings count every sensor
+        measurement since start, the planned rate is the worst case (every echo from max
+        distance) the rate and the schedule allow, effective_rate is {name: rate of the
+        latest samples}, cpu_time the CPU time of the ranging and scheduler threads (s)
+        and cpu_load its share of the ranging time
+        """
+        readings = self._readings() - self._start_readings
+        elapsed = monotonic() - self._start_time if self._start_time is not None else 0
+        cycle = self.cycle_budget()
+
+        scheduled = sum(len(slot) for slot in self._slots)
+        planned = len(self._free) * self._rate
+
+        if scheduled:
+            planned += scheduled * min(self._rate, 1 / cycle)
+
+        ranging = dict((name, self._sensors[name].ranging_stats()) for name in self._names)
+        cpu_time = self._scheduler_cpu + sum(stats["cpu_time"] for stats in ranging.values())
+
+        return dict(cycles=self._cycles,
+                    readings=readings,
+                    readings_per_second=readings / elapsed if elapsed else 0.0,
+                    planned_readings_per_second=planned,
+                    slots=len(self._slots),
+                    rate=self.rate,
+                    effective_rate=dict((name, stats["effective_rate"]) for name, stats in ranging.items()),
+                    cpu_time=cpu_time,
+                    cpu_load=cpu_time / elapsed if elapsed else 0.0)
+
+    # measurements of all sensors
+    def _readings(self):
+
+        return sum(sum(self._sensors[name].echo_stats()[key] for key in ("ok", "timeout", "too_near", "too_far"))
+                   for name in self._names)
+
+    # scheduler thread
+    def _schedule_loop(self):
+
+        deadline = monotonic()
+        cpu_start = thread_cpu_time()
+
+        while self._running:
+
+            for slot in self._slots:
+
+                sequences = dict((name, self._sensors[name].latest_sample()[2]) for name in slot)
+
+                # fire the slot and wait for every sensor of it to publish
+                for name in slot:
+                    self._fire_events[name].set()
+
+                for name in slot:
+
+                    sensor = self._sensors[name]
+                    sensor.wait_for_sample(sequences[name], sensor.latency_budget + _SLOT_MARGIN)
+
+                # let late echoes die out
+                guard_end = monotonic() + self._guard_time
+
+                while self._running and self._sleep_until(guard_end):
+                    pass
+
+                if not self._running:
+                    return 0
+
+            self._cycles += 1
+            self._scheduler_cpu = thread_cpu_time() - cpu_start
+
+            # next cycle on an absolute schedule, a late one starts right away, a rate
+            # change re-plans the wait from the previous cycle
+            previous = deadline
+            deadline = max(previous + 1.0 / self._rate, monotonic())
+
+            while self._running and self._sleep_until(deadline):
+                deadline = max(previous + 1.0 / self._rate, monotonic())
+
+        return 0
+
+    # sleep until a monotonic time, True if woken up early (stop, rate change)
+    def _sleep_until(self, deadline):
+
+        delay = deadline - monotonic()
+
+        if delay > 0 and select.select([self._stop_r], [], [], delay)[0]:
+
+            try:
+                os.read(self._stop_r, 64)
+            except OSError:
+                pass
+
+            return True
+
+        return False
+
+    # wake the scheduler
+    def _wake(self):
+
+        if self._stop_w is None:
+            return
+
+        try:
+            os.write(self._stop_w, b"x")
+        except OSError:
+            pass
+
+
+if __name__ == '__main__':
+
+    import time
+
+    # front and rear sensors face away from each other, the side sensors hear both
+    array = UltrasonicArray(groups=[[FRONT, LEFT, RIGHT], [REAR, LEFT, RIGHT]])
+
+    array.add_sensor(FRONT, trig_pin=6, echo_pin=5)
+    array.add_sensor(REAR, trig_pin=23, echo_pin=24)
+    array.add_sensor(LEFT, trig_pin=17, echo_pin=27)
+    array.add_sensor(RIGHT, trig_pin=22, echo_pin=25)
+
+    print("Schedule: {}".format(array.schedule))
+
+    array.start(rate=15)
+
+    for _ in range(10):
+
+        print(array.distances())
+        time.sleep(.5)
+
+    print(array.stats())
+    array.deinit()
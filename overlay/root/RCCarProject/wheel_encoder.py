@@ -0,0 +1,233 @@
+#!/usr/bin/env python2
+
+#
+# Wheel encoder (slotted disk + opto interrupter, hall sensor, ...) on a GPIO input
+# Both edges of the encoder signal are counted from the gpiolib event dispatcher (no
+# polling). Every edge flips the level, so an event reporting the same level as the
+# previous one means at least one edge was lost (coalesced by the kernel or dropped),
+# it is counted as two edges.
+# RPM is computed from the edge timestamps: over the edges of the last window when
+# there are enough of them (count based, high speed), over the last slot period
+# otherwise (period based, low speed).
+#
+
+import math
+import threading as thread
+import logging as log
+from bisect import bisect_left
+from collections import deque
+
+import gpiolib as gpio
+from micro_sleep import monotonic
+
+# -------------------------------- Error codes ---------------------------------
+
+SUCCESS = 0
+_ERR_INVALID_PIN = 1
+_ERR_USED_PIN = 2
+_ERR_INVALID_CONFIG = 3
+_ERR_INVALID_ARGS = 4
+_ERR_ERROR = 5
+
+# ------------------------------- RPM methods ----------------------------------
+
+PERIOD = "period"
+COUNT = "count"
+
+# edge timestamps kept, enough for the window at several kHz
+_EDGE_HISTORY = 8192
+
+# event delivery delay tolerated before an edge counts as overdue (s)
+_EDGE_LATENCY = 0.02
+
+
+class WheelEncoder(object):
+
+    def __init__(self, slots=20, wheel_diameter=6.5, window=0.1, min_edges=8, stop_timeout=0.5):
+        """
+        :param slots: encoder pulses per wheel revolution (disk slots)
+        :param wheel_diameter: wheel diameter in cm
+        :param window: count based RPM window in seconds
+        :param min_edges: edges in the window below which RPM is period based
+        :param stop_timeout: the wheel is stopped after this long without an edge (s)
+        """
+        self._slots = slots
+        self._wheel_circumference = math.pi * wheel_diameter
+        self._window = window
+        self._min_edges = min_edges
+        self._stop_timeout = stop_timeout
+
+        self._pin = None
+        self._level = None
+
+        # (timestamp, edge count) of every edge event
+        self._edges = deque(maxlen=_EDGE_HISTORY)
+        self._lock = thread.Lock()
+
+        self._count = 0
+        self.events = 0
+        self.missed = 0
+
+    # initialize the encoder pin
+    def init_encoder(self, pin=None):
+        """
+        Configures the encoder pin as input and starts counting its edges
+        :param pin: encoder signal pin
+        :return: error code that indicates if the encoder was initialized
+        """
+        err_code = SUCCESS
+
+        assert pin
+
+        # check if the pin is available
+        if gpio.GPIO_Pin.is_available(pin) and not gpio.GPIO_Pin.is_used(pin)[1]:
+
+            self._pin = gpio.GPIO_Pin(pin, gpio.GPIO)
+            self._pin.set_pin_direction(gpio.INPUT)
+            self._level = self._pin.get_pin_value()[1]
+
+            err_code = gpio.add_event_detect(self._pin, gpio.BOTH, callback=self._on_edge)
+
+            if err_code != gpio.SUCCESS:
+
+                log.error("Failed to count edges of encoder pin {}!".format(pin))
+
+                self._pin.deinit_pin()
+                self._pin = None
+                err_code = _ERR_ERROR
+
+        else:
+
+            log.error("Failed to configure encoder pin: {}!".format(pin))
+            log.debug("The pin {} is either used before or is unavailable for this board!".format(pin))
+            err_code = _ERR_INVALID_PIN
+
+        return err_code
+
+    # release the encoder pin
+    def deinit_encoder(self):
+        """
+        Stops counting and de-configures the encoder pin
+        :return: 0
+        """
+        if self._pin:
+
+            gpio.remove_event_detect(self._pin)
+            self._pin.deinit_pin()
+            self._pin = None
+
+        return 0
+
+    @property
+    def count(self):
+        """edges counted since initialization (missed edges included)"""
+        return self._count
+
+    # wheel revolutions per minute
+    def rpm(self):
+        """
+        :return: wheel RPM, 0 if the wheel is stopped
+        """
+        return self._edge_rate()[0] * 60.0 / (2 * self._slots)
+
+    # wheel surface speed
+    def speed(self):
+        """
+        :return: wheel speed in cm/s
+        """
+        return self.rpm() / 60.0 * self._wheel_circumference
+
+    # distance driven by the wheel
+    def distance(self):
+        """
+        :return: distance in cm since initialization
+        """
+        return self._count / (2.0 * self._slots) * self._wheel_circumference
+
+    # encoder counters
+    def stats(self):
+        """
+        :return: dict(edges, events, missed, rpm, method), missed counts events that
+        revealed lost edges, method is PERIOD or COUNT (None while stopped)
+        """
+        rate, method = self._edge_rate()
+
+        return dict(edges=self._count, events=self.events, missed=self.missed,
+                    rpm=rate * 60.0 / (2 * self._slots), method=method)
+
+    # edges per second
+    def _edge_rate(self):
+        """
+        Count based over the edges of the last window when it holds at least min_edges
+        edges, period based over the last slot period (two edges, so uneven slot and
+        bar widths cancel out) otherwise. Once the next edge is overdue the rate drops
+        with the time elapsed since the last edge, so a stopping wheel slows down smoothly.
+        :return: (edges per second, PERIOD/COUNT), (0.0, None) if the wheel is stopped
+        """
+        with self._lock:
+            edges = list(self._edges)
+
+        now = monotonic()
+
+        if len(edges) < 3 or now - edges[-1][0] > self._stop_timeout:
+            return 0.0, None
+
+        last_time, last_count = edges[-1]
+        start = bisect_left(edges, (last_time - self._window,))
+
+        if len(edges) - 1 - start >= self._min_edges:
+            method = COUNT
+        else:
+            method = PERIOD
+            start = len(edges) - 3
+
+        first_time, first_count = edges[start]
+
+        if last_time <= first_time:
+            return 0.0, None
+
+        rate = (last_count - first_count) / (last_time - first_time)
+
+        # the next edge is overdue (beyond the event delivery delay), the wheel slowed
+        # down at least this much
+        overdue = now - last_time
+
+        if overdue > _EDGE_LATENCY and overdue * rate > 1:
+            rate = 1 / overdue
+
+        return rate, method
+
+    # edge event (event dispatcher thread)
+    def _on_edge(self, pin_number, value, timestamp):
+
+        self.events += 1
+
+        # same level as the previous event, the opposite edge was lost
+        if value == self._level:
+
+            self.missed += 1
+            self._count += 2
+
+        else:
+
+            self._count += 1
+
+        self._level = value
+
+        with self._lock:
+            self._edges.append((timestamp, self._count))
+
+
+if __name__ == '__main__':
+
+    import time
+
+    encoder = WheelEncoder(slots=20, wheel_diameter=6.5)
+    encoder.init_encoder(pin=12)
+
+    for _ in range(20):
+
+        print("RPM: {:8.1f}, speed: {:6.1f} cm/s, {}".format(encoder.rpm(), encoder.speed(), encoder.stats()))
+        time.sleep(.5)
+
+    encoder.deinit_encoder()